@@ -0,0 +1,272 @@
+"""
+命令历史的内存索引，为命令输入框提供即时补全
+
+每次在界面中运行的命令记录在 feedback_store 的 command_history 表中（项目、退出码、耗时）。
+补全时按命令去重，以“频率 × 最近使用时间”（frecency）跨项目排序，依次给出：
+
+1. 以输入内容开头的命令（有序列表上二分查找）；
+2. 输入的每个词都是命令中某个词的前缀，例如 “test 29” 匹配 “pytest tests/test_2999.py”
+   （词前缀倒排索引）；
+3. 输入的字符按顺序出现在命令中（子序列模糊匹配），只用于不超过 FUZZY_MAX_CHARS 个字符的
+   短输入（例如 “dcud” 匹配 “docker compose up -d”），较长的输入由前两种匹配处理。
+
+前缀和词前缀匹配的候选较少时直接取出候选；候选很多（输入很短）或需要模糊匹配时，
+按排名顺序扫描，最多检查 SCAN_LIMIT 条，排名靠后的命令仍可通过前缀和词前缀找到
+（前缀匹配在扫描凑不满结果时，从有序前缀区间中取排名最高的几个）。
+
+索引在第一次需要补全时才从数据库构建，之后运行的命令直接加入索引。
+每次查询的工作量有上限，与历史总条数无关。本模块不依赖 Qt。
+"""
+
+import re
+import time
+import heapq
+import bisect
+import threading
+from operator import itemgetter
+from typing import Iterable, Optional, TypedDict
+
+from feedback_store import FeedbackStore
+
+# 按排名顺序扫描时最多检查的命令数
+SCAN_LIMIT = 2000
+# 候选超过这个数量时改为按排名顺序扫描（候选足够密集，很快就能凑满结果）
+CANDIDATE_SET_LIMIT = 256
+# 模糊匹配只用于缩写式的短输入（不计空白）：字符越多，正则在不匹配的命令上回溯得越多
+FUZZY_MAX_CHARS = 8
+
+# 词的分隔符：空白、路径分隔符和常见的 Shell/参数标点
+_SEPARATORS = re.compile(r"[\s/\\=:,;|&'\"()<>]+")
+
+
+class HistoryEntry(TypedDict):
+    command: str
+    project: str  # 最近一次运行所在的项目目录
+    count: int
+    last_used: float
+    successes: int  # 退出码为 0 的次数
+
+
+def frecency(entry: HistoryEntry, now: float) -> float:
+    """运行次数按最近一次使用的时间加权：一小时内 ×4，一天内 ×2，一周内 ×1，一个月内 ×0.5，更早 ×0.25"""
+    age = now - entry["last_used"]
+    if age < 3600:
+        weight = 4.0
+    elif age < 86400:
+        weight = 2.0
+    elif age < 7 * 86400:
+        weight = 1.0
+    elif age < 30 * 86400:
+        weight = 0.5
+    else:
+        weight = 0.25
+    return entry["count"] * weight
+
+
+def _normalize(command: str) -> str:
+    """小写、分隔符统一为空格并以空格开头，词前缀匹配即查找 " " + word"""
+    return " " + _SEPARATORS.sub(" ", command.lower()).strip()
+
+
+class CommandHistoryIndex:
+    """
+    去重后的命令历史索引
+
+    条目按构建时的 frecency 排名编号（0 为最高），倒排索引的 postings 按编号升序，
+    按编号顺序扫描即按排名顺序扫描。之后新增的命令编号递增；返回前统一按当前的
+    frecency 重新排序。
+    """
+
+    def __init__(self, entries: Iterable[HistoryEntry], now: Optional[float] = None):
+        now = now or time.time()
+        self.entries: list[HistoryEntry] = sorted(entries, key=lambda e: frecency(e, now), reverse=True)
+        self._ids: dict[str, int] = {}
+        self._normalized: list[str] = []
+        self._lowered: list[str] = []
+        self._keys: list[tuple[str, int]] = []  # (小写命令, 编号)，用于前缀二分查找
+        self._postings: dict[str, list[int]] = {}
+        self._tokens: list[str] = []  # 有序的不重复词，用于词前缀二分查找
+        self._lock = threading.Lock()
+        for entry_id, entry in enumerate(self.entries):
+            self._index_entry(entry_id, entry)
+        self._keys.sort()
+        self._tokens = sorted(self._postings)
+        # 排名前 SCAN_LIMIT 条的规范化命令按行拼接，扫描时一次正则匹配在 C 层完成
+        self._built = len(self.entries)
+        self._scanned = min(self._built, SCAN_LIMIT)
+        self._blob = "\n".join(self._normalized[:self._scanned])
+        self._line_starts = [0]
+        for normalized in self._normalized[:max(self._scanned - 1, 0)]:
+            self._line_starts.append(self._line_starts[-1] + len(normalized) + 1)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _index_entry(self, entry_id: int, entry: HistoryEntry) -> list[str]:
+        """登记一个条目，返回它带来的新词"""
+        command = entry["command"]
+        normalized = _normalize(command)
+        self._ids[command] = entry_id
+        self._normalized.append(normalized)
+        self._lowered.append(command.lower())
+        self._keys.append((command.lower(), entry_id))
+        new_tokens = []
+        for token in set(normalized.split()):
+            posting = self._postings.get(token)
+            if posting is None:
+                self._postings[token] = [entry_id]
+                new_tokens.append(token)
+            else:
+                posting.append(entry_id)
+        return new_tokens
+
+    def add(self, command: str, project: str, started_at: float, exit_code: Optional[int]):
+        """记录一次新的运行"""
+        command = command.strip()
+        if not command:
+            return
+        with self._lock:
+            entry_id = self._ids.get(command)
+            if entry_id is not None:
+                entry = self.entries[entry_id]
+                entry["count"] += 1
+                entry["last_used"] = max(entry["last_used"], started_at)
+                entry["project"] = project
+                entry["successes"] += exit_code == 0
+                return
+            entry = HistoryEntry(command=command, project=project, count=1, last_used=started_at,
+                                 successes=int(exit_code == 0))
+            self.entries.append(entry)
+            new_tokens = self._index_entry(len(self.entries) - 1, entry)
+            # _index_entry 把键追加在末尾，移到有序位置
+            bisect.insort(self._keys, self._keys.pop())
+            for token in new_tokens:
+                bisect.insort(self._tokens, token)
+
+    def search(self, text: str, limit: int = 10) -> list[str]:
+        """返回最多 limit 条补全，按匹配方式（前缀、词前缀、模糊）分组，组内按 frecency 排序"""
+        query = text.strip().lower()
+        if not query:
+            return []
+        now = time.time()
+        with self._lock:
+            found: list[int] = []
+            seen: set[int] = set()
+            for stage in (self._prefix_matches, self._word_matches, self._fuzzy_matches):
+                if len(found) >= limit:
+                    break
+                matches = [entry_id for entry_id in stage(query, limit) if entry_id not in seen]
+                matches.sort(key=lambda entry_id: frecency(self.entries[entry_id], now), reverse=True)
+                found.extend(matches)
+                seen.update(matches)
+            return [self.entries[entry_id]["command"] for entry_id in found[:limit]]
+
+    def _line_at(self, position: int) -> tuple[int, int]:
+        """拼接文本中某个位置所在的条目编号及下一行的起始位置"""
+        entry_id = bisect.bisect_right(self._line_starts, position) - 1
+        return entry_id, self._line_starts[entry_id] + len(self._normalized[entry_id]) + 1
+
+    def _scan(self, find, matches_line, limit: int) -> list[int]:
+        """
+        按编号（排名）顺序扫描前 SCAN_LIMIT 条和构建之后新增的命令，收集匹配的前 limit 个条目
+
+        find(text, start) 返回 text 中从 start 起第一个可能匹配的位置（没有时返回 -1），
+        matches_line(normalized) 确认该条目是否匹配。
+        """
+        matches = []
+        position = find(self._blob, 0)
+        while position >= 0:
+            entry_id, next_line = self._line_at(position)
+            if matches_line(self._normalized[entry_id]):
+                matches.append(entry_id)
+                if len(matches) >= limit:
+                    return matches
+            position = find(self._blob, next_line)
+        for entry_id in range(self._built, len(self._normalized)):
+            if matches_line(self._normalized[entry_id]):
+                matches.append(entry_id)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def _prefix_matches(self, query: str, limit: int) -> list[int]:
+        start = bisect.bisect_left(self._keys, (query,))
+        end = bisect.bisect_left(self._keys, (query + "\U0010ffff",), start)
+        if end - start <= CANDIDATE_SET_LIMIT:
+            return [entry_id for _, entry_id in self._keys[start:end]]
+        # 前缀很短、匹配很多：匹配通常集中在排名靠前的命令中，先扫描前 SCAN_LIMIT 条
+        lowered = self._lowered
+        matches = []
+        for entry_id in range(min(len(lowered), SCAN_LIMIT)):
+            if lowered[entry_id].startswith(query):
+                matches.append(entry_id)
+                if len(matches) >= limit:
+                    return matches
+        # 匹配的命令排名都靠后：直接从前缀区间中取编号最小（排名最高）的几个
+        return heapq.nsmallest(limit, map(itemgetter(1), self._keys[start:end]))
+
+    def _word_matches(self, query: str, limit: int) -> list[int]:
+        words = _normalize(query).split()
+        if not words:
+            return []
+        needles = [" " + word for word in words]
+
+        # 选出匹配词最少的那个查询词，用它的 postings 作为候选；匹配词较少时
+        # 按 postings 总长度比较，它同时决定了扫描时用哪个词定位
+        best = None
+        for word in words:
+            start = bisect.bisect_left(self._tokens, word)
+            end = bisect.bisect_left(self._tokens, word + "\U0010ffff", start)
+            if start == end:
+                return []
+            size = (sum(len(self._postings[token]) for token in self._tokens[start:end])
+                    if end - start <= 64 else len(self.entries) + end - start)
+            if best is None or size < best[2]:
+                best = (start, end, size, word)
+        start, end, _, rarest_word = best
+
+        normalized = self._normalized
+        if end - start <= 64:
+            candidates: set[int] = set()
+            for token in self._tokens[start:end]:
+                candidates.update(self._postings[token])
+            if len(candidates) <= CANDIDATE_SET_LIMIT:
+                return [entry_id for entry_id in sorted(candidates)
+                        if all(needle in normalized[entry_id] for needle in needles)]
+        # 用出现最少的词定位，再检查所在的命令是否包含其他词
+        rarest = " " + rarest_word
+        return self._scan(lambda text, start: text.find(rarest, start),
+                          lambda normalized: all(needle in normalized for needle in needles), limit)
+
+    def _fuzzy_matches(self, query: str, limit: int) -> list[int]:
+        chars = [c for c in _normalize(query) if not c.isspace()]
+        if not chars or len(chars) > FUZZY_MAX_CHARS:
+            return []
+        # 模式为首字符加若干 [^c]*c：匹配成功时每个字符取最左边的位置；匹配失败时
+        # Python 的 re 仍会回溯到各个 [^c]* 中重试，代价随字符数增长，因此只接受短输入。
+        # 正则引擎按开头的字面字符快速定位候选位置
+        pattern = re.compile(re.escape(chars[0]) + "".join(f"[^\n{re.escape(c)}]*{re.escape(c)}" for c in chars[1:]))
+
+        def find(text: str, start: int) -> int:
+            match = pattern.search(text, start)
+            return match.start() if match else -1
+
+        return self._scan(find, lambda normalized: pattern.search(normalized) is not None, limit)
+
+
+_index: Optional[CommandHistoryIndex] = None
+_index_lock = threading.Lock()
+
+
+def load_command_history(store: FeedbackStore) -> CommandHistoryIndex:
+    """第一次调用时从数据库构建进程内共享的索引（较慢，可在后台线程中调用）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CommandHistoryIndex(HistoryEntry(**row) for row in store.load_command_history())
+        return _index
+
+
+def loaded_command_history() -> Optional[CommandHistoryIndex]:
+    """已构建的索引，尚未构建时返回 None（不触发加载）"""
+    return _index
@@ -0,0 +1,191 @@
+"""
+反馈界面宿主与 MCP 服务器之间的帧协议
+
+宿主进程的 stdin/stdout 上传输的是一串帧，每帧为：
+    1 字节类型 + 4 字节大端长度 + 负载
+
+- 类型 J：UTF-8 编码的 JSON 消息（请求或结果），字段 "blobs" 表示其后紧跟的二进制帧数量
+- 类型 B：二进制负载（例如图片原始字节），按顺序属于前一条 JSON 消息
+
+结果消息只编码一次：文字反馈、命令日志和图片元数据都在同一个 JSON 对象中，
+图片字节直接以 B 帧传输，不再经过临时文件或嵌套的 JSON 字符串。
+"""
+
+import os
+import json
+import contextlib
+import struct
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    # 界面宿主只用同步读写，asyncio 仅在服务器端的 read_message_async 中导入
+    import asyncio
+
+FRAME_JSON = b'J'
+FRAME_BLOB = b'B'
+
+_HEADER = struct.Struct('>cI')
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+IMAGE_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+}
+
+
+class ProtocolError(RuntimeError):
+    """帧格式不符合协议"""
+
+
+class IncompleteMessageError(ProtocolError):
+    """JSON 帧已读到，但流在其二进制帧传完之前结束；message 为已解析的 JSON 消息"""
+
+    def __init__(self, message: dict):
+        super().__init__(f"消息的二进制帧不完整: {message.get('id')}")
+        self.message = message
+
+
+def guess_image_mime(path: str) -> str:
+    """根据文件扩展名确定图片 MIME 类型，未知格式默认为 PNG"""
+    return IMAGE_MIME_TYPES.get(Path(path).suffix.lower(), 'image/png')
+
+
+def encode_frame(kind: bytes, payload: bytes) -> bytes:
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+def encode_message(message: dict) -> bytes:
+    """编码一条不带二进制帧的 JSON 消息"""
+    message = dict(message, blobs=0)
+    return encode_frame(FRAME_JSON, json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def write_message(stream: BinaryIO, message: dict, blob_paths: Optional[List[str]] = None):
+    """
+    写入一条 JSON 消息，并把 blob_paths 中的文件按块流式写成 B 帧
+
+    写入任何帧之前先打开全部文件，文件不存在等错误以 OSError 抛出，流保持完整。
+    文件在传输过程中被截断时抛出 ProtocolError：帧头已声明的长度无法兑现，
+    流已经错位，调用方不能再向其写入消息。
+    """
+    blob_paths = blob_paths or []
+    with contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(path, 'rb')) for path in blob_paths]
+        message = dict(message, blobs=len(files))
+        stream.write(encode_frame(FRAME_JSON, json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+        for path, f in zip(blob_paths, files):
+            size = os.fstat(f.fileno()).st_size
+            stream.write(_HEADER.pack(FRAME_BLOB, size))
+            remaining = size
+            while remaining:
+                chunk = f.read(min(_COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ProtocolError(f"文件在传输过程中被截断: {path}")
+                stream.write(chunk)
+                remaining -= len(chunk)
+    stream.flush()
+
+
+def _decode_header(header: bytes) -> Tuple[bytes, int]:
+    kind, length = _HEADER.unpack(header)
+    if kind not in (FRAME_JSON, FRAME_BLOB):
+        raise ProtocolError(f"未知帧类型: {kind!r}")
+    return kind, length
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> Optional[bytes]:
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def read_message(stream: BinaryIO) -> Optional[Tuple[dict, List[bytes]]]:
+    """读取一条 JSON 消息及其二进制帧，流结束时返回 None"""
+    header = _read_exactly(stream, _HEADER.size)
+    if header is None:
+        return None
+    kind, length = _decode_header(header)
+    if kind != FRAME_JSON:
+        raise ProtocolError("消息必须以 JSON 帧开始")
+    payload = _read_exactly(stream, length)
+    if payload is None:
+        return None
+    message = json.loads(payload)
+
+    blobs = []
+    for _ in range(message.get('blobs', 0)):
+        header = _read_exactly(stream, _HEADER.size)
+        if header is None:
+            return None
+        kind, length = _decode_header(header)
+        if kind != FRAME_BLOB:
+            raise ProtocolError("缺少二进制帧")
+        blob = _read_exactly(stream, length)
+        if blob is None:
+            return None
+        blobs.append(blob)
+    return message, blobs
+
+
+async def _spool_blob(reader: "asyncio.StreamReader", length: int, spool_threshold: int) -> BinaryIO:
+    """按块把二进制帧写入临时文件，超过 spool_threshold 的部分落盘，内存占用有上限"""
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    remaining = length
+    while remaining:
+        chunk = await reader.readexactly(min(_COPY_CHUNK_SIZE, remaining))
+        spool.write(chunk)
+        remaining -= len(chunk)
+    spool.seek(0)
+    return spool
+
+
+async def read_message_async(reader: "asyncio.StreamReader",
+                             spool_threshold: Optional[int] = None) -> Optional[Tuple[dict, List[Union[bytes, BinaryIO]]]]:
+    """
+    read_message 的 asyncio 版本，流结束时返回 None
+
+    流在某条消息的二进制帧传完之前结束时抛出 IncompleteMessageError，
+    调用方可以据此只让这条消息对应的请求失败。
+
+    指定 spool_threshold 时二进制帧以 SpooledTemporaryFile 返回（已定位到开头），
+    不会把整张图片一次性读入内存。
+    """
+    import asyncio
+
+    try:
+        kind, length = _decode_header(await reader.readexactly(_HEADER.size))
+        if kind != FRAME_JSON:
+            raise ProtocolError("消息必须以 JSON 帧开始")
+        message = json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+    blobs = []
+    try:
+        for _ in range(message.get('blobs', 0)):
+            kind, length = _decode_header(await reader.readexactly(_HEADER.size))
+            if kind != FRAME_BLOB:
+                raise ProtocolError("缺少二进制帧")
+            if spool_threshold is None:
+                blobs.append(await reader.readexactly(length))
+            else:
+                blobs.append(await _spool_blob(reader, length, spool_threshold))
+    except asyncio.IncompleteReadError:
+        raise IncompleteMessageError(message) from None
+    finally:
+        if len(blobs) < message.get('blobs', 0):
+            # 消息不完整：已读到的二进制帧不会交给调用方，关闭其中的临时文件
+            for blob in blobs:
+                if hasattr(blob, 'close'):
+                    blob.close()
+    return message, blobs
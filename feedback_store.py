@@ -0,0 +1,479 @@
+"""
+反馈界面的本地存储
+
+窗口状态、按项目的命令配置和分割器状态保存在一个 SQLite 数据库中（WAL 模式），
+取代原来按项目分组写入平台 QSettings 文件的做法：
+
+- 启动时一条查询读出窗口和当前项目的全部设置，不再解析包含所有项目的整个配置文件；
+- 修改先记在内存中，由后台线程合并后在一个事务中写入（write-behind），
+  界面线程不等待磁盘；
+- 每个设置是一行，多个界面进程同时写入时各自只更新改动的键，
+  不会像整体重写配置文件那样互相覆盖。
+
+同一个数据库还保存命令运行历史，以及每轮反馈的归档（FTS5 全文索引，
+按 ARCHIVE_MAX_SESSIONS / ARCHIVE_MAX_AGE_DAYS 保留）。
+
+数据库位于 ~/.interactive-feedback-mcp/feedback.db，可用环境变量
+INTERACTIVE_FEEDBACK_HOME 指定其他目录。本模块不依赖 Qt，服务器进程也可以使用。
+"""
+
+import os
+import sys
+import json
+import re
+import time
+import atexit
+import sqlite3
+import threading
+from typing import Any, Iterable, Optional
+
+# 修改后等待多久写入数据库（秒），期间的多次修改合并为一个事务
+WRITE_BEHIND_DELAY = 0.5
+# 其他进程正在写入时最多等待的时间（秒）
+BUSY_TIMEOUT = 5.0
+
+# 全局窗口设置使用的作用域，项目设置以 get_project_settings_group() 的结果为作用域
+WINDOW_SCOPE = "MainWindow_General"
+
+# 按顺序执行的结构迁移，PRAGMA user_version 记录已执行的数量
+_MIGRATIONS = [
+    """
+    CREATE TABLE settings (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (scope, key)
+    ) WITHOUT ROWID;
+    """,
+    """
+    CREATE TABLE command_history (
+        id INTEGER PRIMARY KEY,
+        project TEXT NOT NULL,
+        command TEXT NOT NULL,
+        exit_code INTEGER,
+        duration REAL,
+        started_at REAL NOT NULL
+    );
+    CREATE INDEX command_history_command ON command_history (command, started_at);
+    CREATE INDEX command_history_project ON command_history (project, started_at);
+    """,
+    """
+    CREATE TABLE feedback_sessions (
+        id INTEGER PRIMARY KEY,
+        project TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        duration REAL NOT NULL,
+        image_hashes TEXT NOT NULL,
+        command_stats TEXT
+    );
+    CREATE INDEX feedback_sessions_project ON feedback_sessions (project, started_at);
+    """,
+]
+
+# 归档的全文索引不在迁移链中：SQLite 没有编译 FTS5（或缺少分词器）时只停用归档，设置和命令历史照常使用
+_ARCHIVE_DDL = "CREATE VIRTUAL TABLE IF NOT EXISTS feedback_text USING fts5 (prompt, feedback, command_logs{tokenize})"
+
+# command_history 最多保留的运行记录数，超出后删除最早的记录
+HISTORY_MAX_ENTRIES = 100_000
+
+
+def number_from_env(name: str, default: float) -> float:
+    """读取数值型环境变量（类型与默认值相同），格式不正确时使用默认值，不影响导入"""
+    try:
+        return type(default)(os.environ.get(name, default))
+    except ValueError:
+        print(f"环境变量 {name} 的值无效，使用默认值 {default}", file=sys.stderr)
+        return default
+
+
+# 反馈归档的保留策略：最多保留的会话数（0 表示不归档）和天数（0 表示不按时间删除）
+ARCHIVE_MAX_SESSIONS = number_from_env("FEEDBACK_ARCHIVE_MAX_SESSIONS", 5000)
+ARCHIVE_MAX_AGE_DAYS = number_from_env("FEEDBACK_ARCHIVE_MAX_DAYS", 180.0)
+# 搜索时最多为多少条匹配（最近的）计算 BM25 相关度
+RANK_CANDIDATES = 200
+# 搜索结果中每段摘录的大致长度（字符）
+SNIPPET_CHARS = 48
+# 全文索引按三字符切分（trigram，中文无需分词），更短的搜索词改为逐条查找子串
+_TRIGRAM = 3
+# trigram 分词器需要 SQLite 3.34；更早的版本使用默认分词器，所有搜索词都逐条查找子串
+_TRIGRAM_AVAILABLE = sqlite3.sqlite_version_info >= (3, 34, 0)
+_ARCHIVE_COLUMNS = ("prompt", "feedback", "command_logs")
+
+
+def get_data_dir() -> str:
+    return os.environ.get("INTERACTIVE_FEEDBACK_HOME") or os.path.join(os.path.expanduser("~"), ".interactive-feedback-mcp")
+
+
+def setting_value(values: dict[str, Any], key: str, default: Any = None) -> Any:
+    """从 load() 的结果中取值，并转换为默认值的类型（兼容从 QSettings 导入的字符串）"""
+    value = values.get(key)
+    if value is None or default is None or isinstance(value, type(default)) and not isinstance(default, bool):
+        return default if value is None else value
+    try:
+        if isinstance(default, bool):
+            if isinstance(value, str):
+                return value.strip().lower() in ("true", "1", "yes")
+            return bool(value)
+        if isinstance(default, bytes) and isinstance(value, str):
+            return value.encode("utf-8")
+        return type(default)(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _excerpt(text: str, pattern: re.Pattern) -> Optional[str]:
+    """截取 text 中第一处匹配附近的一段，段内所有匹配用 ** 标出（与 FTS 的 snippet() 格式一致）"""
+    match = pattern.search(text)
+    if not match:
+        return None
+    start = max(0, match.start() - SNIPPET_CHARS // 2)
+    end = min(len(text), match.end() + SNIPPET_CHARS // 2)
+    return ("…" if start > 0 else "") + pattern.sub(lambda m: f"**{m.group()}**", text[start:end]) \
+        + ("…" if end < len(text) else "")
+
+
+class FeedbackStore:
+    """
+    线程安全的设置存储
+
+    命令历史（record_command）和反馈归档（record_feedback）与设置一样先进入待写队列，
+    随同一个事务提交。
+
+    load() 一次读出若干作用域的全部键；set()/set_many() 只写入内存中的待写队列，
+    后台线程在 WRITE_BEHIND_DELAY 秒后批量提交；flush() 立即提交（进程退出时自动调用）。
+    读取会合并尚未提交的修改，调用方总能读到自己刚写入的值。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(get_data_dir(), "feedback.db")
+        # _db_lock 保护数据库连接，_lock 保护待写队列；需要两者时先取 _db_lock
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, str], Any] = {}
+        self._removed_scopes: set[str] = set()
+        self._pending_history: list[tuple] = []
+        self._pending_feedback: list[tuple] = []
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._conn = self._connect(self.path)
+        self._trigram = False
+        self._archive_enabled = self._create_archive_index(self._conn)
+        if self._archive_enabled:
+            # 归档表按建表时的分词器使用；用 trigram 建的表在不支持 trigram 的 SQLite 中无法读写，停用归档
+            self._trigram = "trigram" in self._conn.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'feedback_text'").fetchone()[0]
+            self._archive_enabled = _TRIGRAM_AVAILABLE or not self._trigram
+        self._writer = threading.Thread(target=self._write_behind, name="feedback-store-writer", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = None
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            FeedbackStore._migrate(conn)
+        except (OSError, sqlite3.Error) as e:
+            # 数据库目录不可写、文件损坏或迁移失败（例如其他进程长时间持有写锁）：
+            # 退回内存数据库，本次运行的设置不会保存
+            print(f"无法打开设置数据库，本次运行的设置不会保存: {e}", file=sys.stderr)
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+            FeedbackStore._migrate(conn)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _create_archive_index(conn: sqlite3.Connection) -> bool:
+        """创建归档的全文索引表（已存在时不变），SQLite 不支持 FTS5 或分词器时返回 False"""
+        tokenize = ", tokenize = 'trigram'" if _TRIGRAM_AVAILABLE else ""
+        try:
+            conn.execute(_ARCHIVE_DDL.format(tokenize=tokenize))
+            # 已有的表由其他 SQLite 创建时，只有实际读取才能发现缺少模块
+            conn.execute("SELECT rowid FROM feedback_text LIMIT 0").fetchall()
+        except sqlite3.Error as e:
+            print(f"无法使用全文索引，反馈归档已停用: {e}", file=sys.stderr)
+            return False
+        return True
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(_MIGRATIONS):
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 其他进程可能已经完成迁移，拿到写锁后重新读取版本
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for migration in _MIGRATIONS[version:]:
+                for statement in migration.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {len(_MIGRATIONS)}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load(self, scopes: Iterable[str]) -> dict[str, dict[str, Any]]:
+        """一次查询读出多个作用域的全部设置，返回 {scope: {key: value}}"""
+        scopes = list(scopes)
+        result: dict[str, dict[str, Any]] = {scope: {} for scope in scopes}
+        placeholders = ",".join("?" * len(scopes))
+        with self._db_lock, self._lock:
+            rows = self._conn.execute(
+                f"SELECT scope, key, value FROM settings WHERE scope IN ({placeholders})", scopes
+            ).fetchall()
+            for scope, key, value in rows:
+                if scope not in self._removed_scopes:
+                    result[scope][key] = value
+            for (scope, key), value in self._pending.items():
+                if scope in result:
+                    result[scope][key] = value
+        return result
+
+    def get(self, scope: str, key: str, default: Any = None) -> Any:
+        return setting_value(self.load([scope])[scope], key, default)
+
+    def set(self, scope: str, key: str, value: Any):
+        self.set_many(scope, {key: value})
+
+    def set_many(self, scope: str, values: dict[str, Any]):
+        with self._lock:
+            for key, value in values.items():
+                # QByteArray 等二进制类型以 BLOB 存储，其他类型存为字符串
+                if not isinstance(value, (str, int, float, bytes, type(None))):
+                    try:
+                        value = bytes(value)
+                    except TypeError:
+                        value = str(value)
+                self._pending[(scope, key)] = value
+            self._wakeup.notify()
+
+    def record_command(self, project: str, command: str, exit_code: Optional[int], duration: float,
+                       started_at: Optional[float] = None):
+        """记录一次命令运行"""
+        if started_at is None:
+            started_at = time.time() - duration
+        with self._lock:
+            self._pending_history.append((project, command, exit_code, duration, started_at))
+            self._wakeup.notify()
+
+    def load_command_history(self) -> list[dict]:
+        """按命令汇总的历史：运行次数、最近一次运行的时间和项目、成功次数"""
+        self.flush()
+        with self._db_lock:
+            # SQLite 中与 MAX() 一起查询的普通列取自最大值所在的行，即最近一次运行的项目
+            rows = self._conn.execute(
+                "SELECT command, project, COUNT(*), MAX(started_at), SUM(exit_code = 0) "
+                "FROM command_history GROUP BY command"
+            ).fetchall()
+        return [
+            {"command": command, "project": project, "count": count, "last_used": last_used, "successes": successes or 0}
+            for command, project, count, last_used, successes in rows
+        ]
+
+    def record_feedback(self, project: str, prompt: str, feedback: str, command_logs: str,
+                        image_hashes: list[str], command_stats: Optional[dict], started_at: float, duration: float):
+        """归档一轮反馈：汇报内容、用户反馈、返回给 AI 的命令日志摘要、图片哈希和耗时"""
+        if ARCHIVE_MAX_SESSIONS <= 0 or not self._archive_enabled:
+            return
+        with self._lock:
+            self._pending_feedback.append((
+                project, started_at, duration, json.dumps(image_hashes),
+                json.dumps(command_stats) if command_stats else None, prompt, feedback, command_logs,
+            ))
+            self._wakeup.notify()
+
+    def search_feedback(self, query: str, project: Optional[str] = None, limit: int = 10) -> list[dict]:
+        """
+        在归档中搜索同时包含所有搜索词的反馈，按相关度（BM25）排序
+
+        不少于三个字符的词通过全文索引匹配；更短的词（如两个汉字）逐条查找子串，
+        只有短词时按时间倒序返回。匹配不区分大小写。匹配超过 RANK_CANDIDATES 条时
+        只在最近的 RANK_CANDIDATES 条中排序。SQLite 不支持 trigram 时所有词都逐条查找子串。
+        每个结果的 snippets 为 {列名: 摘录}，匹配处以 ** 标出。
+        """
+        terms = query.split()
+        if not terms or not self._archive_enabled:
+            return []
+        long_terms = [term for term in terms if self._trigram and len(term) >= _TRIGRAM]
+        short_terms = [term for term in terms if term not in long_terms]
+
+        conditions, params = [], []
+        if long_terms:
+            conditions.append("feedback_text MATCH ?")
+            params.append(" ".join('"' + term.replace('"', '""') + '"' for term in long_terms))
+        for term in short_terms:
+            # 与 trigram 分词器一样不区分大小写；没有大小写之分的词（如汉字）不必转换整列
+            if term.lower() == term.upper():
+                check = "instr({column}, ?) > 0"
+            else:
+                check = "instr(lower({column}), ?) > 0"
+                term = term.lower()
+            conditions.append("(" + " OR ".join(check.format(column=column) for column in _ARCHIVE_COLUMNS) + ")")
+            params += [term] * len(_ARCHIVE_COLUMNS)
+        if project:
+            conditions.append("s.project = ?")
+            params.append(project)
+        matching = (f"FROM feedback_text JOIN feedback_sessions s ON s.id = feedback_text.rowid "
+                    f"WHERE {' AND '.join(conditions)}")
+        # 先在子查询中排序并取前 limit 条，只为这些结果读取正文和生成摘录
+        if long_terms:
+            # BM25 只计算最近的 RANK_CANDIDATES 条匹配：常见词几乎匹配所有归档时，
+            # 为每一条计算相关度的开销随归档大小增长
+            ranked = (f"SELECT id, rank FROM (SELECT feedback_text.rowid AS id, bm25(feedback_text) AS rank {matching} "
+                      f"ORDER BY feedback_text.rowid DESC LIMIT {RANK_CANDIDATES}) ORDER BY rank LIMIT ?")
+        else:
+            ranked = f"SELECT s.id AS id, -s.started_at AS rank {matching} ORDER BY rank LIMIT ?"
+
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT s.id, s.project, s.started_at, s.duration, s.image_hashes, s.command_stats, "
+                f"{', '.join('t.' + column for column in _ARCHIVE_COLUMNS)} "
+                f"FROM ({ranked}) AS ranked "
+                f"JOIN feedback_text t ON t.rowid = ranked.id "
+                f"JOIN feedback_sessions s ON s.id = ranked.id ORDER BY ranked.rank",
+                params + [limit],
+            ).fetchall()
+
+        # 摘录在这里截取：FTS 的 snippet() 只能在 MATCH 查询中调用，需要为这几条结果再执行一遍全文查询
+        pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+        results = []
+        for row in rows:
+            matched = {}
+            for column, text in zip(_ARCHIVE_COLUMNS, row[6:9]):
+                excerpt = _excerpt(text, pattern)
+                if excerpt:
+                    matched[column] = excerpt
+            results.append({
+                "id": row[0], "project": row[1], "started_at": row[2], "duration": row[3],
+                "image_hashes": json.loads(row[4]), "command_stats": row[5] and json.loads(row[5]),
+                "snippets": matched,
+            })
+        return results
+
+    def remove_scope(self, scope: str):
+        with self._lock:
+            self._pending = {k: v for k, v in self._pending.items() if k[0] != scope}
+            self._removed_scopes.add(scope)
+            self._wakeup.notify()
+
+    def _has_pending(self) -> bool:
+        return bool(self._pending or self._removed_scopes or self._pending_history or self._pending_feedback)
+
+    def flush(self):
+        """立即提交所有待写的修改"""
+        with self._db_lock:
+            with self._lock:
+                if not self._has_pending():
+                    return
+                pending, self._pending = self._pending, {}
+                removed, self._removed_scopes = self._removed_scopes, set()
+                history, self._pending_history = self._pending_history, []
+                feedback, self._pending_feedback = self._pending_feedback, []
+            # 写入期间不持有 _lock，界面线程的 set() 不会等待磁盘
+            now = time.time()
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany("DELETE FROM settings WHERE scope = ?", [(scope,) for scope in removed])
+                    self._conn.executemany(
+                        "INSERT INTO settings (scope, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (scope, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                        [(scope, key, value, now) for (scope, key), value in pending.items()],
+                    )
+                    if history:
+                        self._conn.executemany(
+                            "INSERT INTO command_history (project, command, exit_code, duration, started_at) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            history,
+                        )
+                        self._conn.execute("DELETE FROM command_history WHERE id <= "
+                                           "(SELECT MAX(id) FROM command_history) - ?", (HISTORY_MAX_ENTRIES,))
+                    if feedback:
+                        self._archive_feedback(feedback, now)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                # 其他进程长时间持有写锁：保留修改，下次再写（之后的新值优先）
+                with self._lock:
+                    self._pending = {**pending, **self._pending}
+                    self._removed_scopes |= removed
+                    self._pending_history[:0] = history
+                    self._pending_feedback[:0] = feedback
+                print(f"写入设置失败，稍后重试: {e}", file=sys.stderr)
+
+    def _archive_feedback(self, feedback: list[tuple], now: float):
+        """在 flush 的事务中写入归档的反馈，并按保留策略删除最早的和过期的会话"""
+        for project, started_at, duration, image_hashes, command_stats, *texts in feedback:
+            cursor = self._conn.execute(
+                "INSERT INTO feedback_sessions (project, started_at, duration, image_hashes, command_stats) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (project, started_at, duration, image_hashes, command_stats),
+            )
+            self._conn.execute(
+                f"INSERT INTO feedback_text (rowid, {', '.join(_ARCHIVE_COLUMNS)}) VALUES (?, ?, ?, ?)",
+                (cursor.lastrowid, *texts),
+            )
+        expired = "id <= (SELECT MAX(id) FROM feedback_sessions) - ?"
+        params: list[Any] = [ARCHIVE_MAX_SESSIONS]
+        if ARCHIVE_MAX_AGE_DAYS > 0:
+            expired += " OR started_at < ?"
+            params.append(now - ARCHIVE_MAX_AGE_DAYS * 86400)
+        ids = [(row[0],) for row in self._conn.execute(f"SELECT id FROM feedback_sessions WHERE {expired}", params)]
+        if ids:
+            self._conn.executemany("DELETE FROM feedback_text WHERE rowid = ?", ids)
+            self._conn.executemany("DELETE FROM feedback_sessions WHERE id = ?", ids)
+
+    def _write_behind(self):
+        while True:
+            with self._lock:
+                while not self._closed and not self._has_pending():
+                    self._wakeup.wait()
+                # 从第一次修改起等待固定时间，合并这期间的其他修改
+                deadline = time.monotonic() + WRITE_BEHIND_DELAY
+                while not self._closed and deadline > time.monotonic():
+                    self._wakeup.wait(deadline - time.monotonic())
+                if self._closed:
+                    return
+            self.flush()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+_store: Optional[FeedbackStore] = None
+_store_lock = threading.Lock()
+
+
+def get_feedback_store() -> FeedbackStore:
+    """进程内共享的存储实例"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FeedbackStore()
+        return _store
+
+
+@atexit.register
+def close_feedback_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
@@ -1,31 +1,81 @@
 # Interactive Feedback MCP UI
 # Developed by Fábio Ferreira (https://x.com/fabiomlferreira)
 # Inspired by/related to dotcursorrules.com (https://dotcursorrules.com/)
+import time
+
+# --startup-profile 的计时起点：之后的导入都计入 imports 阶段
+_MODULE_STARTED = time.perf_counter()
+
 import os
 import sys
 import json
-import psutil
-import argparse
 import subprocess
 import threading
 import hashlib
-from typing import Optional, TypedDict
-
+import itertools
+import collections
+import contextlib
+import codecs
+import selectors
+import signal
+import atexit
+import shlex
+import re
+from typing import BinaryIO, Callable, Optional, TypedDict
+
+# 首次访问 PySide6 的类会创建它的全部枚举（QStyle 约 4 ms），文件对话框、缩略图读取、
+# 命令补全和旧设置导入用到的类在使用处再导入，不计入启动时间
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QCheckBox, QTextEdit, QGroupBox,
-    QFileDialog, QScrollArea, QSplitter
+    QLabel, QLineEdit, QPushButton, QCheckBox, QTextEdit, QPlainTextEdit, QGroupBox, QSpinBox, QComboBox,
+    QSplitter, QListView, QStyledItemDelegate
 )
-from PySide6.QtCore import Qt, Signal, QObject, QTimer, QSettings
-from PySide6.QtGui import QTextCursor, QIcon, QKeyEvent, QFont, QFontDatabase, QPalette, QColor, QPixmap
+from PySide6.QtCore import (
+    Qt, Signal, QObject, QTimer, QByteArray, QSize, QRect, QEvent,
+    QAbstractListModel, QModelIndex, QRunnable, QThreadPool, QStringListModel
+)
+from PySide6.QtGui import (
+    QTextCursor, QTextCharFormat, QIcon, QKeyEvent, QFont, QFontDatabase, QPalette, QColor, QPixmap, QImage,
+    QPainter
+)
+
+from feedback_protocol import ProtocolError, guess_image_mime, read_message, write_message
+from command_history import load_command_history, loaded_command_history
+from feedback_store import WINDOW_SCOPE, FeedbackStore, get_feedback_store, number_from_env, setting_value
 
 class FeedbackResult(TypedDict):
     command_logs: str
-    interactive_feedback: str
+    command_stats: Optional["CommandStats"]  # 最近一次运行命令的资源占用，未运行命令时为 None
+    text_feedback: str
+    images: list[str]
 
 class FeedbackConfig(TypedDict):
     run_command: str
     execute_automatically: bool
+    persistent_shell: bool
+    use_pty: bool
+    command_niceness: int
+    command_io_priority: str
+    command_memory_limit_mb: int
+    command_max_wall_time: int
+
+class CommandLimits(TypedDict):
+    niceness: int  # 在界面进程基础上增加的 nice 值，0 表示不调整
+    io_priority: str  # "normal"、"low" 或 "idle"
+    memory_limit_mb: int  # 每个进程的内存上限，0 表示不限制
+    max_wall_time: int  # 最长运行秒数，0 表示不限制
+
+class CommandStats(TypedDict):
+    command: str
+    exit_code: Optional[int]  # None 表示命令被停止或提交时仍在运行
+    wall_time: float  # 运行时长（秒）
+    cpu_time: float  # 整个进程树的用户态 + 内核态 CPU 时间（秒），包括已退出的子进程
+    peak_rss: int  # 进程树常驻内存之和的峰值（字节）
+    max_children: int  # 同时存活的子孙进程数的峰值
+    samples: int  # 采样次数
+
+# 默认不调整命令的优先级，也不限制内存和运行时间（命令按原样运行，不加包装命令）
+DEFAULT_COMMAND_LIMITS = CommandLimits(niceness=0, io_priority="normal", memory_limit_mb=0, max_wall_time=0)
 
 def set_dark_title_bar(widget: QWidget, dark_title_bar: bool) -> None:
     # Ensure we're on Windows
@@ -155,7 +205,81 @@ def get_light_mode_palette(app: QApplication):
     
     return lightPalette
 
-def kill_tree(process: subprocess.Popen):
+# 停止命令时 SIGTERM 之后等待进程组自行退出的时间（秒），超时后发送 SIGKILL
+KILL_GRACE_PERIOD = number_from_env("FEEDBACK_KILL_GRACE_SECONDS", 2.0)
+
+def _process_group_exists(pgid: int) -> bool:
+    """进程组中是否还有进程（包括未回收的僵尸进程），只需一次 killpg 系统调用"""
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 进程组中仍有进程（已切换用户），视为存活
+        return True
+    return True
+
+def _process_group_running(pgid: int) -> bool:
+    """
+    进程组中是否还有仍在运行的进程
+
+    已退出但尚未被回收的僵尸进程仍属于进程组；容器中 init 不及时回收孤儿时
+    不能因此一直等到宽限期结束，只把仍在运行的成员算作存活。需要遍历全部进程，
+    只在 killpg 报告进程组仍存在时偶尔调用。
+    """
+    import psutil
+    for proc in psutil.process_iter(["status"]):
+        try:
+            if proc.info["status"] != psutil.STATUS_ZOMBIE and os.getpgid(proc.pid) == pgid:
+                return True
+        except OSError:
+            continue
+    return False
+
+# 等待进程组退出时的轮询间隔（秒）：从 10ms 开始翻倍，killpg 探测最长间隔 200ms，
+# 遍历进程表排除僵尸进程的间隔最长 500ms
+POLL_INTERVAL_MIN = 0.01
+POLL_INTERVAL_MAX = 0.2
+ZOMBIE_CHECK_INTERVAL_MAX = 0.5
+
+def _wait_process_group(pgid: int, deadline: float):
+    """等待进程组中的进程全部退出（或只剩僵尸进程），最多到 deadline"""
+    interval = POLL_INTERVAL_MIN
+    zombie_interval = POLL_INTERVAL_MIN
+    next_zombie_check = time.monotonic() + zombie_interval
+    while _process_group_exists(pgid):
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now >= next_zombie_check:
+            if not _process_group_running(pgid):
+                return
+            zombie_interval = min(zombie_interval * 2, ZOMBIE_CHECK_INTERVAL_MAX)
+            next_zombie_check = now + zombie_interval
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, POLL_INTERVAL_MAX)
+
+def _terminate_process_group(process: subprocess.Popen, grace_period: float):
+    pgid = process.pid
+    deadline = time.monotonic() + grace_period
+    try:
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        pass
+    # 组长已退出，等待组内其他进程（例如忽略了 SIGTERM 的子进程）
+    _wait_process_group(pgid, deadline)
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    # SIGKILL 后回收组长，避免留下僵尸进程
+    try:
+        process.wait(timeout=1)
+    except subprocess.TimeoutExpired:
+        pass
+
+def _kill_tree_psutil(process: subprocess.Popen):
+    import psutil
     killed: list[psutil.Process] = []
     parent = psutil.Process(process.pid)
     for proc in parent.children(recursive=True):
@@ -178,6 +302,38 @@ def kill_tree(process: subprocess.Popen):
         except psutil.Error:
             pass
 
+def kill_tree(process: subprocess.Popen, grace_period: float = KILL_GRACE_PERIOD, wait: bool = False):
+    """
+    结束命令进程及其所有后代
+
+    POSIX 上命令由 start_command_process 在新会话中启动，进程组 ID 等于其 PID：
+    先向整个进程组发送 SIGTERM，宽限期内未退出再发送 SIGKILL。一次 killpg 覆盖
+    遍历期间新 fork 的进程，不需要逐个遍历进程树。升级到 SIGKILL 在后台线程中进行，
+    wait=True 时等待清理完成（例如程序退出前）。
+    Windows 没有进程组信号，仍按 psutil 遍历进程树。
+    """
+    if sys.platform == "win32":
+        _kill_tree_psutil(process)
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        # 整个进程组已经退出
+        return
+    thread = threading.Thread(target=_terminate_process_group, args=(process, grace_period), daemon=True)
+    thread.start()
+    _teardown_threads[:] = [t for t in _teardown_threads if t.is_alive()] + [thread]
+    if wait:
+        thread.join()
+
+# 尚在宽限期内的清理线程；程序退出前等待它们完成，保证 SIGKILL 一定发出
+_teardown_threads: list[threading.Thread] = []
+
+@atexit.register
+def _wait_for_teardown():
+    for thread in _teardown_threads:
+        thread.join()
+
 def get_user_environment() -> dict[str, str]:
     if sys.platform != "win32":
         return os.environ.copy()
@@ -261,6 +417,941 @@ def get_user_environment() -> dict[str, str]:
     finally:
         CloseHandle(token)
 
+class CommandOutputReader:
+    """
+    读取子进程的 stdout 和 stderr，并在子进程退出时通知
+
+    二进制管道按大块 os.read，增量 UTF-8 解码器处理跨块的多字节字符，
+    非法字节替换为 U+FFFD 而不是静默丢弃；没有换行的部分行（如进度条）读到即交付。
+    POSIX 上用一个线程的 selector 循环合并两个管道，每次回调带流标签；
+    Windows 的匿名管道不支持 select，退回为每个流一个线程。
+
+    退出检测不轮询：Linux 上把 pidfd 注册进同一个 selector，其他平台用一个阻塞在
+    wait() 上的线程。退出后最多等待 EXIT_DRAIN_TIMEOUT 秒读完管道中剩余的输出再调用
+    on_exit(returncode)，后台进程仍持有管道时不会无限推迟退出通知。
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    EXIT_DRAIN_TIMEOUT = 0.5
+
+    def __init__(self, streams: dict[str, BinaryIO], on_output: Callable[[str, str], None],
+                 process: Optional[subprocess.Popen] = None, on_exit: Optional[Callable[[int], None]] = None):
+        self.streams = streams
+        self.on_output = on_output  # on_output(tag, text)，在读取线程中调用
+        self.process = process
+        self.on_exit = on_exit  # on_exit(returncode)，在读取或等待线程中调用，只调用一次
+        self.reads = 0
+        self._threads: list[threading.Thread] = []
+        self._stream_threads: list[threading.Thread] = []
+        self._exit_reported = False
+        self._exit_lock = threading.Lock()
+
+    def start(self):
+        pidfd = None
+        if sys.platform == "win32":
+            targets = [(self._read_blocking, (tag, stream)) for tag, stream in self.streams.items()]
+        else:
+            pidfd = self._open_pidfd()
+            targets = [(self._select_loop, (pidfd,))]
+        for target, args in targets:
+            self._stream_threads.append(self._start_thread(target, args))
+        if self.process is not None and pidfd is None:
+            self._start_thread(self._wait_for_exit, ())
+
+    def _start_thread(self, target, args) -> threading.Thread:
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    def _open_pidfd(self) -> Optional[int]:
+        if self.process is None or not hasattr(os, "pidfd_open"):
+            return None
+        try:
+            return os.pidfd_open(self.process.pid)
+        except OSError:
+            # 内核不支持（Linux < 5.3）或被沙箱禁止，退回等待线程
+            return None
+
+    def is_alive(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """等待所有流读到结尾并报告退出，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not self.is_alive()
+
+    def _report_exit(self, returncode: int):
+        with self._exit_lock:
+            if self._exit_reported:
+                return
+            self._exit_reported = True
+        if self.on_exit is not None:
+            self.on_exit(returncode)
+
+    def _wait_for_exit(self):
+        returncode = self.process.wait()
+        deadline = time.monotonic() + self.EXIT_DRAIN_TIMEOUT
+        for thread in self._stream_threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._report_exit(returncode)
+
+    def _read_chunk(self, fd: int) -> bytes:
+        try:
+            data = os.read(fd, self.CHUNK_SIZE)
+        except OSError:
+            data = b""
+        self.reads += 1
+        return data
+
+    def _select_loop(self, pidfd: Optional[int] = None):
+        returncode = None
+        drain_deadline = None
+        open_streams = len(self.streams)
+        with selectors.DefaultSelector() as selector:
+            for tag, stream in self.streams.items():
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                selector.register(stream.fileno(), selectors.EVENT_READ, (tag, decoder))
+            if pidfd is not None:
+                selector.register(pidfd, selectors.EVENT_READ, None)
+
+            while selector.get_map():
+                timeout = None
+                if drain_deadline is not None:
+                    timeout = max(0.0, drain_deadline - time.monotonic())
+                events = selector.select(timeout)
+                if not events and drain_deadline is not None:
+                    # 进程已退出但管道仍被后台进程持有：先报告退出，继续读取剩余输出
+                    self._report_exit(returncode)
+                    drain_deadline = None
+                    continue
+
+                for key, _ in events:
+                    if key.data is None:
+                        # pidfd 可读表示子进程已退出
+                        selector.unregister(pidfd)
+                        os.close(pidfd)
+                        returncode = self.process.wait()
+                        if open_streams:
+                            drain_deadline = time.monotonic() + self.EXIT_DRAIN_TIMEOUT
+                        else:
+                            self._report_exit(returncode)
+                        continue
+
+                    tag, decoder = key.data
+                    data = self._read_chunk(key.fd)
+                    text = decoder.decode(data, final=not data)
+                    if text:
+                        self.on_output(tag, text)
+                    if not data:
+                        selector.unregister(key.fd)
+                        open_streams -= 1
+                        if not open_streams and returncode is not None:
+                            self._report_exit(returncode)
+                            drain_deadline = None
+        for stream in self.streams.values():
+            stream.close()
+
+    def _read_blocking(self, tag: str, stream: BinaryIO):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        fd = stream.fileno()
+        while True:
+            data = self._read_chunk(fd)
+            text = decoder.decode(data, final=not data)
+            if text:
+                self.on_output(tag, text)
+            if not data:
+                break
+        stream.close()
+
+# 伪终端默认窗口大小（列, 行），影响子进程的换行和进度条宽度
+PTY_DEFAULT_SIZE = (120, 40)
+
+# IO 优先级对应的 ionice 参数（-t：内核不支持时忽略失败，照常运行命令）
+_IONICE_ARGS = {"low": ["-c", "2", "-n", "7"], "idle": ["-c", "3"]}
+
+def _command_wrapper(limits: Optional[CommandLimits], env: dict[str, str]) -> list[str]:
+    """
+    生成在 exec 命令之前应用资源限制的包装命令前缀（POSIX），没有需要应用的限制时返回空列表
+
+    不使用 preexec_fn：界面进程有读取、采样等多个线程，fork 后在子进程中执行 Python 代码可能死锁。
+    包装命令依次 exec，PID 不变，限制由命令及其所有后代继承：
+    内存上限用 sh 的 ulimit 设置（Linux 上为 RLIMIT_DATA，不计入 JVM、Node 预留但未使用的地址空间，
+    其他平台为 RLIMIT_AS）；nice 是相对值，命令在界面进程的基础上降低优先级；
+    IO 优先级使用 ionice（util-linux，仅 Linux），找不到时保持原优先级。
+    """
+    if limits is None or sys.platform == "win32":
+        return []
+    import shutil
+    path = env.get("PATH")
+    wrapper = []
+    niceness = limits["niceness"]
+    nice = shutil.which("nice", path=path) if niceness else None
+    if nice:
+        wrapper += [nice, "-n", str(niceness)]
+    ionice_args = _IONICE_ARGS.get(limits["io_priority"])
+    ionice = shutil.which("ionice", path=path) if ionice_args and sys.platform.startswith("linux") else None
+    if ionice:
+        wrapper += [ionice, "-t", *ionice_args]
+    memory_kb = limits["memory_limit_mb"] * 1024
+    if memory_kb:
+        flag = "-d" if sys.platform.startswith("linux") else "-v"
+        wrapper = ["/bin/sh", "-c", f'ulimit {flag} {memory_kb} && exec "$@"', "sh", *wrapper]
+    return wrapper
+
+def _wrap_command(args, shell: bool, wrapper: list[str]):
+    """把包装命令前缀加到 args 前，返回新的 (args, shell)；shell=True 时改为显式执行 /bin/sh -c"""
+    if not wrapper:
+        return args, shell
+    if isinstance(args, (str, bytes, os.PathLike)):
+        args = [args]
+    if shell:
+        args = ["/bin/sh", "-c", *args]
+    return [*wrapper, *args], False
+
+def _apply_windows_limits(process: subprocess.Popen, limits: Optional[CommandLimits]):
+    """Windows 上没有包装命令，进程启动后用 psutil 调整优先级（内存上限需要作业对象，暂不支持）"""
+    if limits is None:
+        return
+    import psutil
+    try:
+        proc = psutil.Process(process.pid)
+        if limits["niceness"] >= 15:
+            proc.nice(psutil.IDLE_PRIORITY_CLASS)
+        elif limits["niceness"] > 0:
+            proc.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+        if limits["io_priority"] == "low":
+            proc.ionice(psutil.IOPRIO_LOW)
+        elif limits["io_priority"] == "idle":
+            proc.ionice(psutil.IOPRIO_VERYLOW)
+    except psutil.Error:
+        pass
+
+def start_command_process(args, cwd: str, use_pty: bool = False, shell: bool = False,
+                          stdin=subprocess.DEVNULL, pty_size: tuple[int, int] = PTY_DEFAULT_SIZE,
+                          limits: Optional[CommandLimits] = None
+                          ) -> tuple[subprocess.Popen, dict[str, BinaryIO]]:
+    """
+    启动命令进程，返回进程和待读取的输出流（流标签 -> 二进制流）
+
+    普通模式下 stdout/stderr 是两个管道；use_pty 时两者都接到同一个伪终端
+    （标签 "pty"），子进程认为输出是终端，保持行缓冲并输出颜色。伪终端仅支持 POSIX。
+    stdin 默认为 /dev/null：常驻宿主的 stdin 是帧协议管道，不能被命令读走。
+    POSIX 上命令在新会话中启动（进程组 ID 等于 PID），见 kill_tree。
+    limits 中的优先级和内存上限由命令及其所有后代继承。
+    """
+    env = get_user_environment()
+    # 新会话让命令及其所有后代处于同一个进程组，kill_tree 可以一次结束整个组
+    new_session = sys.platform != "win32"
+    args, shell = _wrap_command(args, shell, _command_wrapper(limits, env))
+    if not use_pty:
+        process = subprocess.Popen(
+            args, shell=shell, cwd=cwd, stdin=stdin,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env, bufsize=0, close_fds=True, start_new_session=new_session,
+        )
+        if sys.platform == "win32":
+            _apply_windows_limits(process, limits)
+        return process, {"stdout": process.stdout, "stderr": process.stderr}
+
+    import pty
+    import fcntl
+    import struct
+    import termios
+
+    if env.get("TERM", "dumb") == "dumb":
+        env["TERM"] = "xterm-256color"
+    master, slave = pty.openpty()
+    columns, rows = pty_size
+    fcntl.ioctl(master, termios.TIOCSWINSZ, struct.pack("HHHH", rows, columns, 0, 0))
+    try:
+        process = subprocess.Popen(
+            args, shell=shell, cwd=cwd, stdin=stdin,
+            stdout=slave, stderr=slave,
+            env=env, bufsize=0, close_fds=True, start_new_session=True,
+        )
+    except BaseException:
+        os.close(master)
+        raise
+    finally:
+        os.close(slave)
+    # 子进程全部退出后读取主端会得到 EIO，CommandOutputReader 将其视为流结束
+    return process, {"pty": os.fdopen(master, "rb", buffering=0)}
+
+class ShellRun:
+    """持久 Shell 中的一次命令执行，on_exit(run, exit_code) 在读取线程中调用"""
+
+    def __init__(self, shell: "PersistentShell", command: str,
+                 on_output: Callable[[str, str], None], on_exit: Callable[["ShellRun", int], None]):
+        self.shell = shell
+        self.command = command
+        self.on_output = on_output
+        self.on_exit = on_exit
+        import uuid
+        self.token = uuid.uuid4().hex
+        self.sentinel = f"__IFB_DONE_{self.token}_"
+        # 伪终端会把 \n 转换为 \r\n
+        self._sentinel_pattern = re.compile(re.escape(self.sentinel) + r"(-?\d+)__\r?\n")
+        self.exit_code: Optional[int] = None
+        # 每个流各自缓冲可能是哨兵前缀的尾部，所有流都读到哨兵才算结束
+        self._tails = {tag: "" for tag in shell.reader.streams}
+        self._done_streams: set[str] = set()
+
+    def script(self) -> str:
+        # 命令通过 eval 在 Shell 自身中执行（cd、export、source 对后续命令保持有效），
+        # 引号不配对等语法错误不会吞掉后面的哨兵；stdin 重定向到 /dev/null，避免命令读走后续写入的脚本
+        script = (
+            f"eval {shlex.quote(self.command)} </dev/null\n"
+            f"printf '{self.sentinel}%d__\\n' \"$?\"\n"
+        )
+        if "stderr" in self._tails:
+            script += f"printf '{self.sentinel}0__\\n' >&2\n"
+        return script
+
+    def feed(self, tag: str, text: str) -> bool:
+        """处理一个流的输出，去掉哨兵后转发；所有流都结束时返回 True"""
+        if tag in self._done_streams:
+            return False
+        buffer = self._tails[tag] + text
+        index = buffer.find(self.sentinel)
+        if index >= 0:
+            match = self._sentinel_pattern.match(buffer, index)
+            if match is None:
+                self._tails[tag] = buffer[index:]
+                output = buffer[:index]
+            else:
+                if tag != "stderr":
+                    self.exit_code = int(match.group(1))
+                self._tails[tag] = ""
+                self._done_streams.add(tag)
+                output = buffer[:index]
+        else:
+            # 保留可能是哨兵开头的尾部，等下一块输出再判断
+            keep = next((n for n in range(min(len(self.sentinel) - 1, len(buffer)), 0, -1)
+                         if self.sentinel.startswith(buffer[-n:])), 0)
+            self._tails[tag] = buffer[len(buffer) - keep:]
+            output = buffer[:len(buffer) - keep]
+        if output:
+            self.on_output(tag, output)
+        return len(self._done_streams) == len(self._tails)
+
+    def flush(self):
+        """Shell 意外退出时把缓冲的尾部原样交付"""
+        for tag, tail in self._tails.items():
+            if tail:
+                self.on_output(tag, tail)
+            self._tails[tag] = ""
+
+    def stop(self):
+        self.shell.interrupt(self)
+
+class PersistentShell:
+    """
+    按项目常驻的 Shell 会话
+
+    同一个 Shell 进程依次执行多条命令，虚拟环境激活、nvm use、source 环境文件等
+    只需执行一次，工作目录和环境变量在命令之间保留。每条命令后输出带随机令牌的哨兵行
+    标记边界和退出码。一次只执行一条命令；Shell 退出后下次使用时重新启动。
+    use_pty 时 Shell 的输出接到伪终端（stdin 仍是管道，命令不会被回显）。
+    limits 在启动 Shell 时应用，由其中执行的所有命令继承。
+    """
+
+    def __init__(self, project_directory: str, use_pty: bool = False, limits: Optional[CommandLimits] = None):
+        self.project_directory = project_directory
+        self.use_pty = use_pty
+        self.limits = limits
+        self.current: Optional[ShellRun] = None
+        self._lock = threading.Lock()
+        self.process, streams = start_command_process(
+            [self._shell_executable(), "-s"],
+            cwd=project_directory,
+            use_pty=use_pty,
+            stdin=subprocess.PIPE,
+            limits=limits,
+        )
+        self.reader = CommandOutputReader(
+            streams,
+            self._on_output,
+            process=self.process,
+            on_exit=self._on_shell_exit,
+        )
+        self.reader.start()
+        # Shell 收到 SIGTERM 时只执行空操作（捕获的信号在子进程中恢复默认处理），见 interrupt
+        try:
+            self.process.stdin.write(b"trap : TERM\n")
+            self.process.stdin.flush()
+        except OSError:
+            # Shell 已经退出，下次使用时重新启动
+            pass
+
+    @staticmethod
+    def _shell_executable() -> str:
+        # 使用用户的 POSIX 兼容 Shell（bash/zsh 等）以便 source 其配置；fish 等语法不兼容时退回 /bin/sh
+        shell = os.environ.get("SHELL", "")
+        if os.path.basename(shell) in ("bash", "zsh", "sh", "dash", "ksh") and os.path.exists(shell):
+            return shell
+        return "/bin/sh"
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def is_busy(self) -> bool:
+        return self.current is not None
+
+    def run(self, command: str, on_output: Callable[[str, str], None],
+            on_exit: Callable[[ShellRun, int], None]) -> ShellRun:
+        with self._lock:
+            if self.current is not None:
+                raise RuntimeError("Shell 正在执行其他命令")
+            run = ShellRun(self, command, on_output, on_exit)
+            self.current = run
+        try:
+            self.process.stdin.write(run.script().encode("utf-8"))
+            self.process.stdin.flush()
+        except OSError:
+            # Shell 已经退出，退出回调会结束这次执行
+            pass
+        return run
+
+    def _on_output(self, tag: str, text: str):
+        run = self.current
+        if run is None:
+            # 命令之间的输出（例如后台任务）不属于任何一次执行，丢弃
+            return
+        if run.feed(tag, text):
+            self._finish(run, run.exit_code)
+
+    def _finish(self, run: ShellRun, exit_code: int):
+        with self._lock:
+            if self.current is not run:
+                return
+            self.current = None
+        run.on_exit(run, exit_code)
+
+    def _on_shell_exit(self, returncode: int):
+        key = (self.project_directory, self.use_pty)
+        if _persistent_shells.get(key) is self:
+            del _persistent_shells[key]
+        run = self.current
+        if run is not None:
+            run.flush()
+            self._finish(run, returncode)
+
+    def interrupt(self, run: ShellRun):
+        """
+        停止正在执行的命令：向 Shell 的进程组发送 SIGTERM
+
+        命令启动的所有进程（包括遍历期间才 fork 的）都在 Shell 的进程组中，按默认处理退出；
+        Shell 自身设置了 trap : TERM，只执行空操作，会话保留给后续命令。宽限期后命令仍未
+        结束（忽略了 SIGTERM，或是 Shell 内建的循环）时关闭整个 Shell，由 kill_tree 发送 SIGKILL。
+        """
+        if self.current is not run:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            return
+        threading.Thread(target=self._close_if_still_running, args=(run,), daemon=True).start()
+
+    def _close_if_still_running(self, run: ShellRun):
+        deadline = time.monotonic() + KILL_GRACE_PERIOD
+        interval = POLL_INTERVAL_MIN
+        while self.current is run and time.monotonic() < deadline:
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            interval = min(interval * 2, POLL_INTERVAL_MAX)
+        if self.current is run:
+            self.close(grace_period=0)
+
+    def close(self, wait: bool = False, grace_period: Optional[float] = None):
+        # 先关闭 stdin：空闲的 Shell 读到 EOF 立即退出（它不会因 SIGTERM 退出）
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.is_alive():
+            kill_tree(self.process, KILL_GRACE_PERIOD if grace_period is None else grace_period, wait=wait)
+
+# 按（项目目录, 是否使用伪终端）保存的持久 Shell，常驻宿主中多次会话共用
+_persistent_shells: dict[tuple[str, bool], PersistentShell] = {}
+
+def get_persistent_shell(project_directory: str, use_pty: bool = False,
+                         limits: Optional[CommandLimits] = None) -> PersistentShell:
+    key = (project_directory, use_pty)
+    shell = _persistent_shells.get(key)
+    if shell is not None and shell.limits != limits and not shell.is_busy():
+        # 资源限制只能在启动时设置（nice 无法调回），限制变化后重新启动 Shell
+        shell.close()
+        shell = None
+    if shell is None or not shell.is_alive():
+        shell = PersistentShell(project_directory, use_pty, limits)
+        _persistent_shells[key] = shell
+    return shell
+
+@atexit.register
+def close_persistent_shells():
+    for shell in list(_persistent_shells.values()):
+        shell.close(wait=True)
+    _persistent_shells.clear()
+
+# 命令资源占用的采样间隔（秒）
+TELEMETRY_INTERVAL = number_from_env("FEEDBACK_TELEMETRY_INTERVAL", 0.5)
+
+class ResourceSampler:
+    """
+    在后台线程中按固定间隔采样命令进程树的资源占用
+
+    每次采样遍历一次根进程的子孙进程，读取 RSS 和 CPU 时间（psutil oneshot，
+    每个进程一次 /proc 读取）。CPU 时间按“存活进程自身 + 其已回收子进程”累加，
+    子进程退出并被父进程回收后它的 CPU 时间仍计入父进程的 children_user/system，
+    因此编译器等短命子进程不会丢失；只有根进程退出前最后一个采样间隔内的 CPU 时间
+    可能统计不到。
+
+    include_root=False 用于持久 Shell：Shell 进程本身及它在之前命令中累计的
+    子进程 CPU 时间不计入，只统计本次命令。
+    """
+
+    def __init__(self, pid: int, command: str, include_root: bool = True,
+                 on_sample: Optional[Callable[[CommandStats], None]] = None,
+                 interval: float = TELEMETRY_INTERVAL):
+        self.command = command
+        self.include_root = include_root
+        self.on_sample = on_sample  # on_sample(stats)，在采样线程中调用
+        self.interval = interval
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self.exit_code: Optional[int] = None
+        self._cpu_time = 0.0
+        self._peak_rss = 0
+        self._max_children = 0
+        self._samples = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._baseline = 0.0
+        import psutil
+        try:
+            self._root = psutil.Process(pid)
+            if not include_root:
+                times = self._root.cpu_times()
+                self._baseline = times.children_user + times.children_system
+        except psutil.Error:
+            self._root = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._sample():
+                return
+            if self.on_sample is not None and not self._stopped.is_set():
+                self.on_sample(self.stats())
+            self._stopped.wait(self.interval)
+        # stop() 之后在采样线程中补一次采样：持久 Shell 的根进程仍在运行，
+        # 刚结束的命令的 CPU 时间此时才计入 Shell 的 children 时间
+        if self._root is not None and self._root.is_running() and self._sample() and self.on_sample is not None:
+            self.on_sample(self.stats())
+
+    def _sample(self) -> bool:
+        """采样一次进程树，根进程已不存在时返回 False"""
+        if self._root is None:
+            return False
+        import psutil
+        try:
+            with self._root.oneshot():
+                times = self._root.cpu_times()
+                cpu = times.children_user + times.children_system - self._baseline
+                rss = 0
+                if self.include_root:
+                    cpu += times.user + times.system
+                    rss += self._root.memory_info().rss
+            descendants = self._root.children(recursive=True)
+        except psutil.Error:
+            return False
+
+        alive = 0
+        for process in descendants:
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    rss += process.memory_info().rss
+            except psutil.Error:
+                continue
+            cpu += times.user + times.system + times.children_user + times.children_system
+            alive += 1
+
+        with self._lock:
+            self._cpu_time = max(self._cpu_time, cpu)
+            self._peak_rss = max(self._peak_rss, rss)
+            self._max_children = max(self._max_children, alive)
+            self._samples += 1
+        return True
+
+    def stats(self) -> CommandStats:
+        with self._lock:
+            end = self.ended if self.ended is not None else time.monotonic()
+            return CommandStats(
+                command=self.command,
+                exit_code=self.exit_code,
+                wall_time=round(end - self.started, 3),
+                cpu_time=round(self._cpu_time, 3),
+                peak_rss=self._peak_rss,
+                max_children=self._max_children,
+                samples=self._samples,
+            )
+
+    def stop(self, exit_code: Optional[int] = None) -> CommandStats:
+        """
+        停止采样并立即返回当前统计，不在调用线程（界面线程）中遍历进程树
+
+        根进程仍在运行（持久 Shell）时采样线程随后补一次采样并通过 on_sample 报告。
+        """
+        with self._lock:
+            if self.ended is None:
+                self.ended = time.monotonic()
+                self.exit_code = exit_code
+        self._stopped.set()
+        return self.stats()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待采样线程结束（包括停止后的最后一次采样）"""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+def format_command_stats(stats: CommandStats) -> str:
+    """一行文字描述命令的资源占用，显示在控制台标题处"""
+    return (f"⏱ {stats['wall_time']:.1f} 秒 · CPU {stats['cpu_time']:.1f} 秒 · "
+            f"内存峰值 {stats['peak_rss'] / (1024 * 1024):.1f} MB · 子进程 {stats['max_children']}")
+
+THUMBNAIL_SIZE = QSize(120, 90)
+# 磁盘缩略图缓存最多保留的文件数
+THUMBNAIL_CACHE_LIMIT = 500
+
+def get_thumbnail_cache_dir() -> str:
+    from PySide6.QtCore import QStandardPaths
+    cache_root = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+    return os.path.join(cache_root, "InteractiveFeedbackMCP", "thumbnails")
+
+def _prune_thumbnail_cache(cache_dir: str):
+    entries = sorted(os.scandir(cache_dir), key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:max(0, len(entries) - THUMBNAIL_CACHE_LIMIT)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def load_thumbnail(image_path: str, size: QSize = THUMBNAIL_SIZE) -> QImage:
+    """
+    按目标尺寸解码缩略图
+
+    QImageReader 的 scaledSize 让解码器直接输出小图（JPEG 等格式在解码时降采样），
+    不会为了 120x90 的预览先解码整张大图。结果缓存在磁盘上，键为文件路径、大小、
+    修改时间和目标尺寸的哈希，文件变化后自动失效。返回 QImage，可在工作线程中调用。
+    """
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return QImage()
+
+    key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{size.width()}x{size.height()}"
+    cache_dir = get_thumbnail_cache_dir()
+    cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+    if os.path.exists(cache_path):
+        cached = QImage(cache_path)
+        if not cached.isNull():
+            return cached
+
+    from PySide6.QtGui import QImageReader
+    reader = QImageReader(image_path)
+    reader.setAutoTransform(True)
+    original_size = reader.size()
+    if original_size.isValid():
+        reader.setScaledSize(original_size.scaled(size, Qt.KeepAspectRatio))
+    thumbnail = reader.read()
+    if thumbnail.isNull():
+        return thumbnail
+    if thumbnail.width() > size.width() or thumbnail.height() > size.height():
+        # 不支持按尺寸读取的格式（或未知尺寸）再缩放一次
+        thumbnail = thumbnail.scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        if thumbnail.save(cache_path, "PNG"):
+            _prune_thumbnail_cache(cache_dir)
+    except OSError:
+        pass
+    return thumbnail
+
+IMAGE_ID_ROLE = Qt.UserRole + 1
+IMAGE_PATH_ROLE = Qt.UserRole + 2
+IMAGE_LOADING_ROLE = Qt.UserRole + 3
+
+class ThumbnailSignals(QObject):
+    # 图片 ID、缩略图（失败或已取消时为空 QImage）
+    finished = Signal(int, QImage)
+
+class ThumbnailTask(QRunnable):
+    """
+    在线程池中加载一张缩略图
+
+    source_image 不为空时（剪贴板粘贴），先把它保存为 PNG 再生成缩略图，
+    大截图的编码也不会占用界面线程。cancelled 由界面线程设置，任务在每个耗时步骤前检查。
+    """
+
+    def __init__(self, image_id: int, path: str, signals: ThumbnailSignals, source_image: Optional[QImage] = None):
+        super().__init__()
+        # 任务对象由模型持有，直到 finished 信号回到界面线程
+        self.setAutoDelete(False)
+        self.image_id = image_id
+        self.path = path
+        self.signals = signals
+        self.source_image = source_image
+        self.pasted = source_image is not None
+        self.cancelled = False
+        # 粘贴的图片写入磁盘（或放弃写入）后设置，提交反馈时只等待这一步
+        self.saved = threading.Event()
+
+    def run(self):
+        thumbnail = QImage()
+        saved = not self.cancelled and (self.source_image is None or self.source_image.save(self.path, "PNG"))
+        if saved:
+            # 已写入磁盘：释放原图内存，source_image 为空也表示 path 上的文件由本任务创建
+            self.source_image = None
+        self.saved.set()
+        if saved and not self.cancelled:
+            thumbnail = load_thumbnail(self.path)
+        self.signals.finished.emit(self.image_id, thumbnail)
+
+class ImageListModel(QAbstractListModel):
+    """
+    图片附件列表模型
+
+    每张图片有一个稳定的 ID，增删只通知视图插入或移除对应的行，
+    不再重建整个图片区域；路径集合用于常数时间去重，ID 到行号的映射让缩略图
+    加载完成时常数时间定位到行（只有删除时需要更新其后各行的行号）。
+
+    缩略图在线程池中加载：添加时先插入占位行，加载完成后通过 finished 信号
+    回到界面线程更新该行；删除或清空时取消尚未完成的任务。
+    """
+
+    # 加载失败的图片 ID 与路径
+    image_failed = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._items: list[dict] = []  # {"id", "path", "pixmap", "loading"}
+        self._paths: set[str] = set()
+        self._rows: dict[int, int] = {}  # 图片 ID -> 行号
+        self._ids = itertools.count(1)
+        self._tasks: dict[int, ThumbnailTask] = {}
+        self._thread_pool = QThreadPool(self)
+        self._signals = ThumbnailSignals(self)
+        self._signals.finished.connect(self._on_thumbnail_finished)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._items)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._items):
+            return None
+        item = self._items[index.row()]
+        if role == Qt.DisplayRole:
+            file_name = os.path.basename(item["path"])
+            return file_name[:12] + "..." if len(file_name) > 15 else file_name
+        if role == Qt.DecorationRole:
+            return item["pixmap"]
+        if role == Qt.ToolTipRole or role == IMAGE_PATH_ROLE:
+            return item["path"]
+        if role == IMAGE_ID_ROLE:
+            return item["id"]
+        if role == IMAGE_LOADING_ROLE:
+            return item["loading"]
+        return None
+
+    def _row_of(self, image_id: int) -> Optional[int]:
+        return self._rows.get(image_id)
+
+    def add_image(self, path: str, source_image: Optional[QImage] = None) -> Optional[int]:
+        """
+        追加一张图片并在后台加载缩略图，已存在时返回 None
+
+        source_image 为剪贴板图片时，由后台任务先把它保存到 path。
+        """
+        if path in self._paths:
+            return None
+        item = {"id": next(self._ids), "path": path, "pixmap": None, "loading": True}
+        row = len(self._items)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._items.append(item)
+        self._paths.add(path)
+        self._rows[item["id"]] = row
+        self.endInsertRows()
+
+        task = ThumbnailTask(item["id"], path, self._signals, source_image)
+        self._tasks[item["id"]] = task
+        self._thread_pool.start(task)
+        return item["id"]
+
+    def _cancel_task(self, image_id: int):
+        task = self._tasks.get(image_id)
+        if task is None:
+            return
+        task.cancelled = True
+        if self._thread_pool.tryTake(task):
+            # 尚未开始执行，直接丢弃；已在运行的任务等它发出 finished 后再释放
+            del self._tasks[image_id]
+
+    def _on_thumbnail_finished(self, image_id: int, thumbnail: QImage):
+        task = self._tasks.pop(image_id, None)
+        row = self._row_of(image_id)
+        if row is None:
+            # 图片已被删除；若粘贴图片在取消前已经写入磁盘，把它清理掉
+            if task is not None and task.source_image is None and task.cancelled and task.path not in self._paths:
+                try:
+                    os.remove(task.path)
+                except OSError:
+                    pass
+            return
+        if task is not None and task.cancelled:
+            # 提交反馈时取消的解码：图片仍然有效，不算加载失败
+            return
+        item = self._items[row]
+        item["loading"] = False
+        item["pixmap"] = QPixmap.fromImage(thumbnail) if not thumbnail.isNull() else None
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole, IMAGE_LOADING_ROLE])
+        if thumbnail.isNull():
+            self.image_failed.emit(image_id, item["path"])
+
+    def pending_count(self) -> int:
+        return len(self._tasks)
+
+    def wait_for_pending(self, timeout_ms: int = -1) -> bool:
+        """等待全部后台任务（包括缩略图解码）完成"""
+        return self._thread_pool.waitForDone(timeout_ms)
+
+    def wait_for_saved(self, timeout_ms: int = -1) -> bool:
+        """
+        等待粘贴的图片写入磁盘（提交反馈时），尚未完成的缩略图解码直接取消
+
+        提交后不再需要缩略图；取消排队的解码也让排在它们之后的粘贴任务尽快开始。
+        """
+        for image_id, task in list(self._tasks.items()):
+            if not task.pasted:
+                self._cancel_task(image_id)
+        deadline = None if timeout_ms < 0 else time.monotonic() + timeout_ms / 1000
+        for task in list(self._tasks.values()):
+            if task.pasted:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not task.saved.wait(remaining):
+                    return False
+        return True
+
+    def remove_image(self, image_id: int) -> Optional[str]:
+        """按 ID 移除图片并取消其缩略图任务，返回其路径"""
+        row = self._row_of(image_id)
+        if row is None:
+            return None
+        self._cancel_task(image_id)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        item = self._items.pop(row)
+        self._paths.discard(item["path"])
+        del self._rows[image_id]
+        for later_row in range(row, len(self._items)):
+            self._rows[self._items[later_row]["id"]] = later_row
+        self.endRemoveRows()
+        return item["path"]
+
+    def clear(self):
+        for image_id in list(self._tasks):
+            self._cancel_task(image_id)
+        self.beginResetModel()
+        self._items.clear()
+        self._paths.clear()
+        self._rows.clear()
+        self.endResetModel()
+
+    def paths(self) -> list[str]:
+        return [item["path"] for item in self._items]
+
+class ImageItemDelegate(QStyledItemDelegate):
+    """绘制图片缩略图、文件名和删除按钮，删除按钮点击通过 remove_requested 发出图片 ID"""
+
+    remove_requested = Signal(int)
+
+    ITEM_SIZE = QSize(140, 130)
+    FRAME_HEIGHT = 100
+    REMOVE_BUTTON_SIZE = 20
+
+    def __init__(self, dark_theme: bool, parent=None):
+        super().__init__(parent)
+        if dark_theme:
+            self.frame_border = QColor("#606063")
+            self.frame_background = QColor("#4a4a4d")
+            self.name_color = QColor("#c0c0c0")
+        else:
+            self.frame_border = QColor("#ced4da")
+            self.frame_background = QColor("#f8f9fa")
+            self.name_color = QColor("#495057")
+
+    def sizeHint(self, option, index) -> QSize:
+        return self.ITEM_SIZE
+
+    def _remove_rect(self, rect: QRect) -> QRect:
+        size = self.REMOVE_BUTTON_SIZE
+        return QRect(rect.right() - size - 4, rect.top() + 4, size, size)
+
+    def paint(self, painter: QPainter, option, index: QModelIndex):
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = option.rect.adjusted(5, 5, -5, -5)
+
+        # 缩略图边框
+        frame = QRect(rect.left(), rect.top(), rect.width(), self.FRAME_HEIGHT)
+        painter.setPen(self.frame_border)
+        painter.setBrush(self.frame_background)
+        painter.drawRoundedRect(frame, 4, 4)
+
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is not None and not pixmap.isNull():
+            x = frame.left() + (frame.width() - pixmap.width()) // 2
+            y = frame.top() + (frame.height() - pixmap.height()) // 2
+            painter.drawPixmap(x, y, pixmap)
+        elif index.data(IMAGE_LOADING_ROLE):
+            painter.setPen(self.name_color)
+            painter.drawText(frame, Qt.AlignCenter, "加载中…")
+        else:
+            painter.setPen(self.name_color)
+            painter.drawText(frame, Qt.AlignCenter, "❌\n加载失败")
+
+        # 文件名
+        font = painter.font()
+        font.setPixelSize(10)
+        painter.setFont(font)
+        painter.setPen(self.name_color)
+        name_rect = QRect(rect.left(), frame.bottom() + 4, rect.width(), rect.bottom() - frame.bottom() - 4)
+        painter.drawText(name_rect, Qt.AlignHCenter | Qt.AlignTop, index.data(Qt.DisplayRole))
+
+        # 删除按钮
+        remove_rect = self._remove_rect(option.rect)
+        from PySide6.QtWidgets import QStyle
+        hovered = bool(option.state & QStyle.State_MouseOver)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor("#bb2d3b") if hovered else QColor("#dc3545"))
+        painter.drawEllipse(remove_rect)
+        painter.setPen(QColor("white"))
+        painter.drawText(remove_rect, Qt.AlignCenter, "✕")
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        if (event.type() == QEvent.MouseButtonRelease
+                and self._remove_rect(option.rect).contains(event.position().toPoint())):
+            self.remove_requested.emit(index.data(IMAGE_ID_ROLE))
+            return True
+        return super().editorEvent(event, model, option, index)
+
 class FeedbackTextEdit(QTextEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -285,25 +1376,221 @@ class FeedbackTextEdit(QTextEdit):
         # 确保事件被接受
         event.accept()
 
+# 控制台最多保留的行数（QPlainTextEdit 的 maximumBlockCount），超出后丢弃最早的行
+CONSOLE_MAX_LINES = number_from_env("FEEDBACK_CONSOLE_MAX_LINES", 5000)
+# 返回给 MCP 的命令日志最多保留的字符数，超出后丢弃最早的输出
+LOG_BUFFER_MAX_CHARS = number_from_env("FEEDBACK_LOG_BUFFER_CHARS", 4 * 1024 * 1024)
+# 控制台刷新间隔（毫秒），期间的输出合并为一次插入
+CONSOLE_FLUSH_INTERVAL_MS = 16
+# 状态栏提示（粘贴图片、保存配置等）显示的时长（毫秒）
+STATUS_MESSAGE_TIMEOUT_MS = 5000
+# 命令输入框的补全列表最多显示的条数
+COMPLETION_LIMIT = 10
+
+class LogBuffer:
+    """
+    有容量上限的命令日志环形缓冲区
+
+    按追加的文本块保存，总字符数超过 max_chars 时从头部丢弃整块并记录丢弃量。
+    append 可以在读取线程中调用。
+    """
+
+    def __init__(self, max_chars: int = LOG_BUFFER_MAX_CHARS):
+        self.max_chars = max_chars
+        self._chunks: collections.deque[str] = collections.deque()
+        self._size = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def append(self, text: str):
+        with self._lock:
+            self._chunks.append(text)
+            self._size += len(text)
+            while self._size > self.max_chars and len(self._chunks) > 1:
+                dropped = self._chunks.popleft()
+                self._size -= len(dropped)
+                self._dropped += len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._size = 0
+            self._dropped = 0
+
+    def size(self) -> int:
+        return self._size
+
+    def text(self) -> str:
+        with self._lock:
+            body = "".join(self._chunks)
+            if self._dropped:
+                return f"[... 已省略最早的 {self._dropped} 个字符 ...]\n" + body
+            return body
+
+# ANSI 16 色（与 VS Code 终端默认配色一致）
+ANSI_COLORS = [
+    "#000000", "#cd3131", "#0dbc79", "#e5e510", "#2472c8", "#bc3fbc", "#11a8cd", "#e5e5e5",
+    "#666666", "#f14c4c", "#23d18b", "#f5f543", "#3b8eea", "#d670d6", "#29b8db", "#ffffff",
+]
+
+def ansi_256_color(index: int) -> str:
+    if index < 16:
+        return ANSI_COLORS[index]
+    if index < 232:
+        index -= 16
+        levels = [0, 95, 135, 175, 215, 255]
+        return "#{:02x}{:02x}{:02x}".format(levels[index // 36], levels[index // 6 % 6], levels[index % 6])
+    gray = 8 + (index - 232) * 10
+    return "#{0:02x}{0:02x}{0:02x}".format(gray)
+
+class AnsiParser:
+    """
+    把终端输出拆成 (文本, 样式) 片段
+
+    解析 SGR（颜色、粗体、斜体、下划线）转义序列，其余 CSI/OSC 序列（光标移动、
+    清除行、窗口标题等）直接丢弃。样式是不可变元组 (前景色, 背景色, 粗体, 斜体, 下划线)，
+    默认样式为 None，便于按样式缓存文本格式。被分块截断的转义序列保留到下一次 feed。
+    """
+
+    _ESCAPE = re.compile(r"\x1b(?:\[([0-?]*)[ -/]*([@-~])|\][^\x07\x1b]*(?:\x07|\x1b\\)|[()*+][0-~]|[@-Z\\-_=>])")
+    # 可能尚未完整的转义序列尾部
+    _PARTIAL = re.compile(r"\x1b(?:\[[0-?]*[ -/]*|\][^\x07\x1b]*\x1b?|[()*+])?$")
+
+    def __init__(self):
+        self._tail = ""
+        self._reset()
+
+    def _reset(self):
+        self.fg: Optional[str] = None
+        self.bg: Optional[str] = None
+        self.bold = False
+        self.italic = False
+        self.underline = False
+
+    def style(self) -> Optional[tuple]:
+        style = (self.fg, self.bg, self.bold, self.italic, self.underline)
+        return None if style == (None, None, False, False, False) else style
+
+    def feed(self, text: str) -> list[tuple[str, Optional[tuple]]]:
+        text = self._tail + text
+        self._tail = ""
+        if "\x1b" not in text:
+            return [(text, self.style())] if text else []
+
+        partial = self._PARTIAL.search(text)
+        if partial:
+            self._tail = text[partial.start():]
+            text = text[:partial.start()]
+
+        segments = []
+        position = 0
+        for match in self._ESCAPE.finditer(text):
+            if match.start() > position:
+                segments.append((text[position:match.start()], self.style()))
+            position = match.end()
+            if match.group(2) == "m":
+                self._apply_sgr(match.group(1))
+        if position < len(text):
+            segments.append((text[position:], self.style()))
+        return segments
+
+    def _apply_sgr(self, params: str):
+        codes = [int(code) if code.isdigit() else 0 for code in params.replace(":", ";").split(";")]
+        i = 0
+        while i < len(codes):
+            code = codes[i]
+            if code == 0:
+                self._reset()
+            elif code == 1:
+                self.bold = True
+            elif code == 3:
+                self.italic = True
+            elif code == 4:
+                self.underline = True
+            elif code == 22:
+                self.bold = False
+            elif code == 23:
+                self.italic = False
+            elif code == 24:
+                self.underline = False
+            elif 30 <= code <= 37:
+                self.fg = ANSI_COLORS[code - 30]
+            elif 90 <= code <= 97:
+                self.fg = ANSI_COLORS[code - 90 + 8]
+            elif code == 39:
+                self.fg = None
+            elif 40 <= code <= 47:
+                self.bg = ANSI_COLORS[code - 40]
+            elif 100 <= code <= 107:
+                self.bg = ANSI_COLORS[code - 100 + 8]
+            elif code == 49:
+                self.bg = None
+            elif code in (38, 48) and i + 1 < len(codes):
+                # 38;5;n 为 256 色，38;2;r;g;b 为真彩色
+                color = None
+                if codes[i + 1] == 5 and i + 2 < len(codes):
+                    color = ansi_256_color(codes[i + 2] % 256)
+                    i += 2
+                elif codes[i + 1] == 2 and i + 4 < len(codes):
+                    color = "#{:02x}{:02x}{:02x}".format(*(min(c, 255) for c in codes[i + 2:i + 5]))
+                    i += 4
+                if code == 38:
+                    self.fg = color
+                else:
+                    self.bg = color
+            i += 1
+
 class LogSignals(QObject):
-    append_log = Signal(str)
+    # 有新的控制台输出等待刷新，每个刷新周期最多发出一次
+    flush_requested = Signal()
+    # 命令进程退出：Popen 对象和退出码（从读取线程发出，排队到界面线程）
+    process_finished = Signal(object, int)
+    # 命令资源占用的一次采样：ResourceSampler 和 CommandStats（从采样线程发出）
+    telemetry_sampled = Signal(object, object)
+    # 命令历史索引已在后台构建完成
+    history_loaded = Signal()
 
 class FeedbackUI(QMainWindow):
-    def __init__(self, project_directory: str, prompt: str, dark_theme: bool = True):
+    # 窗口关闭（提交或取消）时发出，参数为 FeedbackResult 或 None
+    session_finished = Signal(object)
+
+    def __init__(self, project_directory: str, prompt: str, dark_theme: bool = True, auto_execute: bool = True):
         super().__init__()
         self.project_directory = project_directory
         self.prompt = prompt
         self.dark_theme = dark_theme  # 存储主题选择
 
         self.process: Optional[subprocess.Popen] = None
-        self.log_buffer = []
+        self.shell_run: Optional[ShellRun] = None  # 持久 Shell 模式下正在执行的命令
+        self.output_reader: Optional[CommandOutputReader] = None
+        self.sampler: Optional[ResourceSampler] = None  # 正在运行的命令的资源采样
+        self.finished_sampler: Optional[ResourceSampler] = None  # 最近一次已结束命令的采样，停止后还会补一次采样
+        self.command_stats: Optional[CommandStats] = None  # 最近一次已结束命令的资源占用
+        self.log_buffer = LogBuffer()
+        self.command_ran = False  # 本轮是否真正启动过命令；没有时不向 AI 返回命令日志
         self.feedback_result = None
+        # 待显示的控制台输出：任意线程追加，界面线程按定时器批量取出
+        self._pending_log: collections.deque[tuple[str, Optional[tuple]]] = collections.deque()
+        self._pending_log_lock = threading.Lock()
+        self._log_flush_scheduled = False
+        self._console_formats: dict[Optional[tuple], QTextCharFormat] = {}
+        self._console_line_reset = False
+        self._last_log_flush = 0.0
+        self._ansi_parsers: collections.defaultdict[str, AnsiParser] = collections.defaultdict(AnsiParser)
         self.log_signals = LogSignals()
-        self.log_signals.append_log.connect(self._append_log)
+        self.log_signals.flush_requested.connect(self._schedule_log_flush)
+        self.log_signals.process_finished.connect(self._on_process_finished)
+        self.log_signals.telemetry_sampled.connect(self._on_telemetry_sampled)
+        self.log_signals.history_loaded.connect(self._on_command_history_loaded)
+        self.history_loading = False
+        # 最长运行时间：每次运行复用同一个单次定时器
+        self.wall_time_timer = QTimer(self)
+        self.wall_time_timer.setSingleShot(True)
+        self.wall_time_timer.timeout.connect(self._on_wall_time_exceeded)
         
         # 图片相关属性
-        self.selected_images = []  # 存储选择的图片路径
-        self.image_widgets = []  # 存储图片显示组件
+        self.image_model = ImageListModel(self)  # 已选择的图片（按添加顺序）
+        self.temp_images = set()  # 粘贴产生的临时图片文件，由本窗口负责清理
 
         self.setWindowTitle("Interactive Feedback MCP")
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -320,56 +1607,127 @@ class FeedbackUI(QMainWindow):
             # 在其他系统上保持置顶行为（如果需要的话）
             self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint)
         
-        self.settings = QSettings("InteractiveFeedbackMCP", "InteractiveFeedbackMCP")
-        
+        # 窗口设置和当前项目的设置在一次查询中读出
+        self.store = get_feedback_store()
+        self.project_group_name = get_project_settings_group(project_directory)
+        settings = load_settings(self.store, [WINDOW_SCOPE, self.project_group_name])
+        window_settings = settings[WINDOW_SCOPE]
+
         # Load general UI settings for the main window (geometry, state)
-        self.settings.beginGroup("MainWindow_General")
-        geometry = self.settings.value("geometry")
+        geometry = setting_value(window_settings, "geometry", b"")
         if geometry:
-            self.restoreGeometry(geometry)
+            self.restoreGeometry(QByteArray(geometry))
         else:
             self.resize(800, 600)
             screen = QApplication.primaryScreen().geometry()
             x = (screen.width() - 800) // 2
             y = (screen.height() - 600) // 2
             self.move(x, y)
-        state = self.settings.value("windowState")
+        state = setting_value(window_settings, "windowState", b"")
         if state:
-            self.restoreState(state)
+            self.restoreState(QByteArray(state))
         
         # 加载置顶设置
-        self.stay_on_top_enabled = self.settings.value("stayOnTop", False, type=bool)
-        self.settings.endGroup() # End "MainWindow_General" group
+        self.stay_on_top_enabled = setting_value(window_settings, "stayOnTop", False)
         
         # Load project-specific settings (command, auto-execute, command section visibility)
-        self.project_group_name = get_project_settings_group(self.project_directory)
-        self.settings.beginGroup(self.project_group_name)
-        loaded_run_command = self.settings.value("run_command", "", type=str)
-        loaded_execute_auto = self.settings.value("execute_automatically", False, type=bool)
-        command_section_visible = self.settings.value("commandSectionVisible", False, type=bool)
-        self.settings.endGroup() # End project-specific group
-        
+        self._load_project_settings(settings[self.project_group_name])
+
+        self._create_ui() # self.config is used here to set initial values
+
+        # 命令区域只在需要显示时构建
+        self._apply_command_section_visibility()
+
+        set_dark_title_bar(self, True)
+
+        # 应用置顶设置（窗口由 run() 或常驻宿主负责显示）
+        if self.stay_on_top_enabled:
+            self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint)
+
+        # 宿主预先构建的窗口传入 auto_execute=False，自动执行留给 begin_session
+        if auto_execute and self.config.get("execute_automatically", False):
+            self._run_command()
+
+    def _load_project_settings(self, project_settings: Optional[dict] = None):
+        if project_settings is None:
+            self.project_group_name = get_project_settings_group(self.project_directory)
+            project_settings = self.store.load([self.project_group_name])[self.project_group_name]
+        self.project_settings = project_settings
+        loaded_run_command = setting_value(project_settings, "run_command", "")
+        loaded_execute_auto = setting_value(project_settings, "execute_automatically", False)
+        loaded_persistent_shell = setting_value(project_settings, "persistent_shell", False)
+        loaded_use_pty = setting_value(project_settings, "use_pty", False)
+        loaded_niceness = setting_value(project_settings, "command_niceness", DEFAULT_COMMAND_LIMITS["niceness"])
+        loaded_io_priority = setting_value(project_settings, "command_io_priority", DEFAULT_COMMAND_LIMITS["io_priority"])
+        loaded_memory_limit = setting_value(project_settings, "command_memory_limit_mb", DEFAULT_COMMAND_LIMITS["memory_limit_mb"])
+        loaded_max_wall_time = setting_value(project_settings, "command_max_wall_time", DEFAULT_COMMAND_LIMITS["max_wall_time"])
+        self.command_section_visible = setting_value(project_settings, "commandSectionVisible", False)
+
         self.config: FeedbackConfig = {
             "run_command": loaded_run_command,
-            "execute_automatically": loaded_execute_auto
+            "execute_automatically": loaded_execute_auto,
+            "persistent_shell": loaded_persistent_shell,
+            "use_pty": loaded_use_pty,
+            "command_niceness": loaded_niceness,
+            "command_io_priority": loaded_io_priority,
+            "command_memory_limit_mb": loaded_memory_limit,
+            "command_max_wall_time": loaded_max_wall_time,
         }
 
-        self._create_ui() # self.config is used here to set initial values
-
-        # Set command section visibility AFTER _create_ui has created relevant widgets
-        self.command_group.setVisible(command_section_visible)
-        if command_section_visible:
+    def _apply_command_section_visibility(self):
+        if self.command_section_visible:
+            self._ensure_command_section()
+        if self.command_group is not None:
+            self.command_group.setVisible(self.command_section_visible)
+        if self.command_section_visible:
             self.toggle_command_button.setText("🔼 隐藏命令区域")
         else:
             self.toggle_command_button.setText("📁 AI工作完成汇报")
 
-        set_dark_title_bar(self, True)
+    def _apply_config_to_widgets(self):
+        """把当前项目的配置填入已构建的命令区域"""
+        # 每个控件的修改都会触发 _update_config 从控件读回配置，先取一份快照
+        config = dict(self.config)
+        self.working_dir_label.setText(f"工作目录: {self._format_windows_path(self.project_directory)}")
+        self.command_entry.setText(config["run_command"])
+        self.auto_check.setChecked(config.get("execute_automatically", False))
+        self.shell_check.setChecked(config.get("persistent_shell", False))
+        self.pty_check.setChecked(config.get("use_pty", False))
+        self._apply_limits_to_widgets(config)
+        self._update_config()
+
+    def _restore_splitter_state(self):
+        splitter_state = setting_value(self.project_settings, "splitterState", b"")
+        if splitter_state:
+            self.feedback_splitter.restoreState(QByteArray(splitter_state))
 
-        # 应用置顶设置
-        if self.stay_on_top_enabled:
-            self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint)
-            self.show()
+    def begin_session(self, project_directory: str, prompt: str):
+        """在已构建的窗口上开始新一轮反馈（常驻宿主模式下复用窗口）"""
+        self._stop_command()
 
+        self.prompt = prompt
+        self.feedback_result = None
+        self.command_stats = None
+        self.finished_sampler = None
+        self.command_ran = False
+        if self.command_group is not None:
+            self.telemetry_label.clear()
+        self.clear_logs()
+        self.feedback_text.clear()
+        self.image_model.clear()
+        self.temp_images = set()
+        self.description_text.setPlainText(prompt)
+
+        if project_directory != self.project_directory:
+            # 切换项目：重新加载项目级配置
+            self.project_directory = project_directory
+            self._load_project_settings()
+            if self.command_group is not None:
+                self._apply_config_to_widgets()
+            self._apply_command_section_visibility()
+            self._restore_splitter_state()
+
+        self.feedback_text.setFocus()
         if self.config.get("execute_automatically", False):
             self._run_command()
 
@@ -736,7 +2094,7 @@ class FeedbackUI(QMainWindow):
                     }
                 """,
                 'console': """
-                    QTextEdit {
+                    QPlainTextEdit {
                         background-color: #1e1e1e;
                         color: #d4d4d4;
                         border: 1px solid #404043;
@@ -831,7 +2189,7 @@ class FeedbackUI(QMainWindow):
                     }
                 """,
                 'console': """
-                    QTextEdit {
+                    QPlainTextEdit {
                         background-color: #f8f9fa;
                         color: #212529;
                         border: 1px solid #ced4da;
@@ -950,75 +2308,8 @@ class FeedbackUI(QMainWindow):
         self.toggle_command_button.clicked.connect(self._toggle_command_section)
         layout.addWidget(self.toggle_command_button)
 
-        # Command section
-        self.command_group = QGroupBox("命令执行")
-        command_layout = QVBoxLayout(self.command_group)
-        command_layout.setSpacing(10)
-
-        # Working directory label
-        formatted_path = self._format_windows_path(self.project_directory)
-        working_dir_label = QLabel(f"工作目录: {formatted_path}")
-        working_dir_label.setStyleSheet(self._get_themed_button_style('working_dir'))
-        command_layout.addWidget(working_dir_label)
-
-        # Command input row
-        command_input_layout = QHBoxLayout()
-        command_input_layout.setSpacing(10)
-        self.command_entry = QLineEdit()
-        self.command_entry.setText(self.config["run_command"])
-        self.command_entry.setPlaceholderText("输入要执行的命令...")
-        self.command_entry.returnPressed.connect(self._run_command)
-        self.command_entry.textChanged.connect(self._update_config)
-        self.run_button = QPushButton("▶ 运行")
-        self.run_button.setMinimumWidth(80)
-        self.run_button.clicked.connect(self._run_command)
-
-        command_input_layout.addWidget(self.command_entry)
-        command_input_layout.addWidget(self.run_button)
-        command_layout.addLayout(command_input_layout)
-
-        # Auto-execute and save config row
-        auto_layout = QHBoxLayout()
-        self.auto_check = QCheckBox("下次启动时自动执行")
-        self.auto_check.setChecked(self.config.get("execute_automatically", False))
-        self.auto_check.stateChanged.connect(self._update_config)
-
-        save_button = QPushButton("💾 保存配置")
-        save_button.setStyleSheet(self._get_themed_button_style('save'))
-        save_button.clicked.connect(self._save_config)
-
-        auto_layout.addWidget(self.auto_check)
-        auto_layout.addStretch()
-        auto_layout.addWidget(save_button)
-        command_layout.addLayout(auto_layout)
-
-        # Console section (now part of command_group)
-        console_group = QGroupBox("控制台输出")
-        console_layout_internal = QVBoxLayout(console_group)
-        console_group.setMinimumHeight(200)
-
-        # Log text area
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
-        font = QFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
-        font.setPointSize(10)
-        self.log_text.setFont(font)
-        self.log_text.setStyleSheet(self._get_themed_button_style('console'))
-        console_layout_internal.addWidget(self.log_text)
-
-        # Clear button
-        button_layout = QHBoxLayout()
-        self.clear_button = QPushButton("🗑 清空日志")
-        self.clear_button.setStyleSheet(self._get_themed_button_style('danger'))
-        self.clear_button.clicked.connect(self.clear_logs)
-        button_layout.addStretch()
-        button_layout.addWidget(self.clear_button)
-        console_layout_internal.addLayout(button_layout)
-        
-        command_layout.addWidget(console_group)
-
-        self.command_group.setVisible(False) 
-        layout.addWidget(self.command_group)
+        # 命令区域默认折叠，在第一次显示或运行命令时才构建（见 _ensure_command_section）
+        self.command_group: Optional[QGroupBox] = None
 
         # Feedback section with adjustable splitter
         self.feedback_group = QGroupBox("💬 反馈区域")
@@ -1037,10 +2328,6 @@ class FeedbackUI(QMainWindow):
         description_title.setStyleSheet("font-weight: bold; font-size: 13px; margin-bottom: 5px;")
         description_layout.addWidget(description_title)
 
-        # 先创建一个临时的 QTextEdit 来获取字体度量
-        temp_text_edit = QTextEdit()
-        font_metrics = temp_text_edit.fontMetrics()
-
         # AI 工作汇报内容 - 可滚动的文本区域
         self.description_text = QTextEdit()
         self.description_text.setPlainText(self.prompt)
@@ -1093,11 +2380,7 @@ class FeedbackUI(QMainWindow):
         self.feedback_splitter.setSizes([200, 300])
         
         # 从设置中恢复分割器状态
-        self.settings.beginGroup(self.project_group_name)
-        splitter_state = self.settings.value("splitterState")
-        if splitter_state:
-            self.feedback_splitter.restoreState(splitter_state)
-        self.settings.endGroup()
+        self._restore_splitter_state()
         
         # 设置分割器的样式
         self.feedback_splitter.setHandleWidth(3)  # 根据用户反馈调整为 3px
@@ -1137,15 +2420,19 @@ class FeedbackUI(QMainWindow):
         image_button_layout.addStretch()
         image_layout.addLayout(image_button_layout)
         
-        # 图片显示区域
-        self.image_scroll_area = QScrollArea()
-        self.image_scroll_area.setWidgetResizable(True)
-        self.image_scroll_area.setMinimumHeight(80)   # 从 100 减少到 80
-        self.image_scroll_area.setMaximumHeight(90)   # 从 120 减少到 90
-        
-        self.image_container = QWidget()
-        self.image_container_layout = QHBoxLayout(self.image_container)
-        self.image_container_layout.setAlignment(Qt.AlignLeft)
+        # 图片显示区域：横向滚动的列表视图，增删图片时只更新对应的行
+        self.image_view = QListView()
+        self.image_view.setModel(self.image_model)
+        self.image_view.setFlow(QListView.LeftToRight)
+        self.image_view.setWrapping(False)
+        self.image_view.setUniformItemSizes(True)
+        self.image_view.setSelectionMode(QListView.NoSelection)
+        self.image_view.setMouseTracking(True)
+        self.image_view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.image_view.setFixedHeight(ImageItemDelegate.ITEM_SIZE.height() + 20)
+        self.image_delegate = ImageItemDelegate(self.dark_theme, self.image_view)
+        self.image_delegate.remove_requested.connect(self._remove_image)
+        self.image_view.setItemDelegate(self.image_delegate)
         
         # 默认提示标签
         self.no_image_label = QLabel("📷 尚未选择图片\n点击上方按钮添加图片")
@@ -1165,10 +2452,15 @@ class FeedbackUI(QMainWindow):
                 padding: 10px;
             """
         self.no_image_label.setStyleSheet(no_image_style)
-        self.image_container_layout.addWidget(self.no_image_label)
-        
-        self.image_scroll_area.setWidget(self.image_container)
-        image_layout.addWidget(self.image_scroll_area)
+        image_layout.addWidget(self.no_image_label)
+        image_layout.addWidget(self.image_view)
+
+        # 根据是否有图片切换提示标签和列表视图
+        self.image_model.image_failed.connect(self._on_image_failed)
+        self.image_model.rowsInserted.connect(self._update_image_placeholder)
+        self.image_model.rowsRemoved.connect(self._update_image_placeholder)
+        self.image_model.modelReset.connect(self._update_image_placeholder)
+        self._update_image_placeholder()
         
         feedback_main_layout.addWidget(image_group)
 
@@ -1178,6 +2470,161 @@ class FeedbackUI(QMainWindow):
         # Add widgets in a specific order
         layout.addWidget(self.feedback_group)
 
+        # 提示和联系信息在第一次绘制之后再构建（见 showEvent）
+        self._footer_created = False
+
+    def _create_command_section(self) -> QGroupBox:
+        """构建命令区域：命令输入、运行选项、资源限制和控制台"""
+        command_group = QGroupBox("命令执行")
+        command_layout = QVBoxLayout(command_group)
+        command_layout.setSpacing(10)
+
+        # Working directory label
+        formatted_path = self._format_windows_path(self.project_directory)
+        self.working_dir_label = QLabel(f"工作目录: {formatted_path}")
+        self.working_dir_label.setStyleSheet(self._get_themed_button_style('working_dir'))
+        command_layout.addWidget(self.working_dir_label)
+
+        # Command input row
+        command_input_layout = QHBoxLayout()
+        command_input_layout.setSpacing(10)
+        self.command_entry = QLineEdit()
+        self.command_entry.setText(self.config["run_command"])
+        self.command_entry.setPlaceholderText("输入要执行的命令...")
+        self.command_entry.returnPressed.connect(self._run_command)
+        self.command_entry.textChanged.connect(self._update_config)
+        # 补全候选由命令历史索引给出，QCompleter 只负责显示，不再自行过滤
+        self.completion_model = QStringListModel(self)
+        from PySide6.QtWidgets import QCompleter
+        self.command_completer = QCompleter(self.completion_model, self)
+        self.command_completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.command_entry.setCompleter(self.command_completer)
+        self.command_entry.textEdited.connect(self._update_command_completions)
+        self.run_button = QPushButton("▶ 运行")
+        self.run_button.setMinimumWidth(80)
+        self.run_button.clicked.connect(self._run_command)
+
+        command_input_layout.addWidget(self.command_entry)
+        command_input_layout.addWidget(self.run_button)
+        command_layout.addLayout(command_input_layout)
+
+        # Auto-execute and save config row
+        auto_layout = QHBoxLayout()
+        self.auto_check = QCheckBox("下次启动时自动执行")
+        self.auto_check.setChecked(self.config.get("execute_automatically", False))
+        self.auto_check.stateChanged.connect(self._update_config)
+
+        # 持久 Shell 依赖 POSIX Shell 的 eval 和 printf，Windows 上不提供
+        self.shell_check = QCheckBox("保持 Shell 会话")
+        self.shell_check.setToolTip("在同一个 Shell 中依次执行命令，保留工作目录、环境变量和已激活的虚拟环境")
+        self.shell_check.setChecked(self.config.get("persistent_shell", False))
+        self.shell_check.stateChanged.connect(self._update_config)
+        self.shell_check.setVisible(sys.platform != "win32")
+
+        # 伪终端同样只在 POSIX 上可用
+        self.pty_check = QCheckBox("伪终端输出")
+        self.pty_check.setToolTip("在伪终端中运行命令：输出实时逐行显示，并保留颜色")
+        self.pty_check.setChecked(self.config.get("use_pty", False))
+        self.pty_check.stateChanged.connect(self._update_config)
+        self.pty_check.setVisible(sys.platform != "win32")
+
+        save_button = QPushButton("💾 保存配置")
+        save_button.setStyleSheet(self._get_themed_button_style('save'))
+        save_button.clicked.connect(self._save_config)
+
+        auto_layout.addWidget(self.auto_check)
+        auto_layout.addWidget(self.shell_check)
+        auto_layout.addWidget(self.pty_check)
+        auto_layout.addStretch()
+        auto_layout.addWidget(save_button)
+        command_layout.addLayout(auto_layout)
+
+        # 资源限制行：CPU/IO 优先级（始终低于界面）、内存上限和最长运行时间
+        limits_layout = QHBoxLayout()
+        self.nice_spin = QSpinBox()
+        self.nice_spin.setRange(0, 19)
+        self.nice_spin.setPrefix("nice +")
+        self.nice_spin.setToolTip("命令的 CPU 优先级比界面低多少（0 表示与界面相同）")
+        self.io_combo = QComboBox()
+        for label, value in (("IO 正常", "normal"), ("IO 低", "low"), ("IO 空闲", "idle")):
+            self.io_combo.addItem(label, value)
+        self.io_combo.setToolTip("命令的磁盘 IO 优先级")
+        self.memory_spin = QSpinBox()
+        self.memory_spin.setRange(0, 1024 * 1024)
+        self.memory_spin.setSingleStep(256)
+        self.memory_spin.setSuffix(" MB")
+        self.memory_spin.setSpecialValueText("内存不限")
+        self.memory_spin.setToolTip("每个进程的内存上限（Windows 上不生效）")
+        self.wall_time_spin = QSpinBox()
+        self.wall_time_spin.setRange(0, 24 * 3600)
+        self.wall_time_spin.setSingleStep(60)
+        self.wall_time_spin.setSuffix(" 秒")
+        self.wall_time_spin.setSpecialValueText("时间不限")
+        self.wall_time_spin.setToolTip("超过该时间后自动停止命令")
+        self._apply_limits_to_widgets(self.config)
+        for spin in (self.nice_spin, self.memory_spin, self.wall_time_spin):
+            spin.valueChanged.connect(self._update_config)
+        self.io_combo.currentIndexChanged.connect(self._update_config)
+
+        limits_layout.addWidget(QLabel("资源限制:"))
+        limits_layout.addWidget(self.nice_spin)
+        limits_layout.addWidget(self.io_combo)
+        limits_layout.addWidget(self.memory_spin)
+        limits_layout.addWidget(self.wall_time_spin)
+        limits_layout.addStretch()
+        command_layout.addLayout(limits_layout)
+
+        # Console section (now part of command_group)
+        console_group = QGroupBox("控制台输出")
+        console_layout_internal = QVBoxLayout(console_group)
+        console_group.setMinimumHeight(200)
+
+        # 命令资源占用：运行时实时刷新，结束后保留最终值
+        self.telemetry_label = QLabel()
+        self.telemetry_label.setStyleSheet(self._get_themed_button_style('working_dir'))
+        console_layout_internal.addWidget(self.telemetry_label)
+
+        # Log text area
+        self.log_text = QPlainTextEdit()
+        self.log_text.setReadOnly(True)
+        self.log_text.setMaximumBlockCount(CONSOLE_MAX_LINES)
+        self.log_text.setUndoRedoEnabled(False)
+        font = QFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        font.setPointSize(10)
+        self.log_text.setFont(font)
+        self.log_text.setStyleSheet(self._get_themed_button_style('console'))
+        console_layout_internal.addWidget(self.log_text)
+
+        # Clear button
+        button_layout = QHBoxLayout()
+        self.clear_button = QPushButton("🗑 清空日志")
+        self.clear_button.setStyleSheet(self._get_themed_button_style('danger'))
+        self.clear_button.clicked.connect(self.clear_logs)
+        button_layout.addStretch()
+        button_layout.addWidget(self.clear_button)
+        console_layout_internal.addLayout(button_layout)
+        
+        command_layout.addWidget(console_group)
+        return command_group
+
+    def _ensure_command_section(self) -> QGroupBox:
+        """返回命令区域，第一次调用时构建并插入到切换按钮之下（保持隐藏）"""
+        if self.command_group is None:
+            self.command_group = self._create_command_section()
+            self.command_group.setVisible(False)
+            layout = self.centralWidget().layout()
+            layout.insertWidget(layout.indexOf(self.toggle_command_button) + 1, self.command_group)
+            # 构建之前追加的文本只写入了 log_buffer，现在补到控制台
+            self._flush_log()
+        return self.command_group
+
+    def _create_footer(self):
+        """构建窗口底部的提示和联系信息"""
+        if self._footer_created:
+            return
+        self._footer_created = True
+        layout = self.centralWidget().layout()
+
         # 提示标签
         hint_label = QLabel("💡 提示：您可以只提供文字反馈、只提供图片，或者两者都提供（支持多张图片）")
         hint_label.setAlignment(Qt.AlignCenter)
@@ -1207,20 +2654,18 @@ class FeedbackUI(QMainWindow):
         contact_label.setStyleSheet(contact_style)
         layout.addWidget(contact_label)
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self._footer_created:
+            # 排在第一次绘制之后执行
+            QTimer.singleShot(0, self._create_footer)
+
     def _toggle_command_section(self):
-        is_visible = self.command_group.isVisible()
-        self.command_group.setVisible(not is_visible)
-        if not is_visible:
-            self.toggle_command_button.setText("🔼 隐藏命令区域")
-        else:
-            self.toggle_command_button.setText("📁 AI工作完成汇报")
-        
+        self.command_section_visible = not self.command_section_visible
+        self._apply_command_section_visibility()
+
         # Immediately save the visibility state for this project
-        self.settings.beginGroup(self.project_group_name)
-        self.settings.setValue("commandSectionVisible", self.command_group.isVisible())
-        # 保存分割器状态
-        self.settings.setValue("splitterState", self.feedback_splitter.saveState())
-        self.settings.endGroup()
+        self._save_layout_state()
 
         # Adjust window height only
         new_height = self.centralWidget().sizeHint().height()
@@ -1232,6 +2677,13 @@ class FeedbackUI(QMainWindow):
         current_width = self.width()
         self.resize(current_width, new_height)
 
+    def _save_layout_state(self):
+        # 命令区域是否显示和分割器状态按项目保存
+        self.store.set_many(self.project_group_name, {
+            "commandSectionVisible": self.command_section_visible,
+            "splitterState": self.feedback_splitter.saveState(),
+        })
+
     def _toggle_stay_on_top(self):
         """切换窗口置顶状态"""
         is_checked = self.stay_on_top_check.isChecked()
@@ -1247,116 +2699,342 @@ class FeedbackUI(QMainWindow):
         self.show()
         
         # 保存置顶设置到配置中
-        self.settings.beginGroup("MainWindow_General")
-        self.settings.setValue("stayOnTop", is_checked)
-        self.settings.endGroup()
+        self.store.set(WINDOW_SCOPE, "stayOnTop", is_checked)
 
     def _update_config(self):
         self.config["run_command"] = self.command_entry.text()
         self.config["execute_automatically"] = self.auto_check.isChecked()
+        self.config["persistent_shell"] = self.shell_check.isChecked()
+        self.config["use_pty"] = self.pty_check.isChecked()
+        self.config["command_niceness"] = self.nice_spin.value()
+        self.config["command_io_priority"] = self.io_combo.currentData()
+        self.config["command_memory_limit_mb"] = self.memory_spin.value()
+        self.config["command_max_wall_time"] = self.wall_time_spin.value()
+
+    def _apply_limits_to_widgets(self, config: FeedbackConfig):
+        self.nice_spin.setValue(config["command_niceness"])
+        self.io_combo.setCurrentIndex(max(0, self.io_combo.findData(config["command_io_priority"])))
+        self.memory_spin.setValue(config["command_memory_limit_mb"])
+        self.wall_time_spin.setValue(config["command_max_wall_time"])
+
+    def _command_limits(self) -> CommandLimits:
+        return CommandLimits(
+            niceness=self.config["command_niceness"],
+            io_priority=self.config["command_io_priority"],
+            memory_limit_mb=self.config["command_memory_limit_mb"],
+            max_wall_time=self.config["command_max_wall_time"],
+        )
+
+    def _show_status(self, text: str):
+        """界面提示显示在状态栏，不写入返回给 AI 的命令日志"""
+        self.statusBar().showMessage(text, STATUS_MESSAGE_TIMEOUT_MS)
+
+    def _command_logs(self) -> str:
+        """随反馈返回的命令日志：本轮没有启动过命令时为空"""
+        return self.log_buffer.text() if self.command_ran else ""
 
     def _append_log(self, text: str):
-        self.log_buffer.append(text)
-        self.log_text.append(text.rstrip())
+        """追加一段不含转义序列的控制台文本（命令回显、退出状态等），可在读取线程中调用"""
+        self._append_segments([(text, None)])
+
+    def _append_segments(self, segments: list[tuple[str, Optional[tuple]]]):
+        """
+        追加一组 (文本, 样式) 片段，可在读取线程中调用
+
+        纯文本立即写入 log_buffer，显示则合并到下一个刷新周期：
+        每个周期只发出一次信号、只向控制台插入一次。
+        """
+        if not segments:
+            return
+        # 伪终端输出的换行是 \r\n，返回给 MCP 的日志统一为 \n
+        self.log_buffer.append("".join(text for text, _ in segments).replace("\r\n", "\n"))
+        self._pending_log.extend(segments)
+        with self._pending_log_lock:
+            if self._log_flush_scheduled:
+                return
+            self._log_flush_scheduled = True
+        self.log_signals.flush_requested.emit()
+
+    def _schedule_log_flush(self):
+        # 距离上次刷新已超过一个周期时立即刷新（零星输出无额外延迟），否则等到周期结束再合并插入
+        elapsed_ms = (time.monotonic() - self._last_log_flush) * 1000
+        QTimer.singleShot(max(0, int(CONSOLE_FLUSH_INTERVAL_MS - elapsed_ms)), self._flush_log)
+
+    def _console_format(self, style: Optional[tuple]) -> QTextCharFormat:
+        text_format = self._console_formats.get(style)
+        if text_format is None:
+            text_format = QTextCharFormat()
+            if style is not None:
+                fg, bg, bold, italic, underline = style
+                if fg:
+                    text_format.setForeground(QColor(fg))
+                if bg:
+                    text_format.setBackground(QColor(bg))
+                if bold:
+                    text_format.setFontWeight(QFont.Bold)
+                text_format.setFontItalic(italic)
+                text_format.setFontUnderline(underline)
+            self._console_formats[style] = text_format
+        return text_format
+
+    def _flush_log(self):
+        self._last_log_flush = time.monotonic()
+        with self._pending_log_lock:
+            self._log_flush_scheduled = False
+        if self.command_group is None:
+            # 命令区域尚未构建：文本已在 log_buffer 中，待显示的片段留到构建时再插入
+            return
+        pending = []
+        while self._pending_log:
+            text, style = self._pending_log.popleft()
+            pending.append((text.replace("\r\n", "\n"), style))
+        if not pending:
+            return
+
+        # 超过控制台容量的行插入后也会被丢弃，直接跳过
+        newlines = 0
+        for index in range(len(pending) - 1, -1, -1):
+            text, style = pending[index]
+            later_newlines = newlines
+            newlines += text.count("\n")
+            if newlines >= CONSOLE_MAX_LINES:
+                keep = text.split("\n")[later_newlines - CONSOLE_MAX_LINES:]
+                pending = [("\n".join(keep), style)] + pending[index + 1:]
+                break
+
+        # 输出按原样追加（部分行会在后续输出到达时接上）；单独的 \r 让后续文本覆盖当前行（进度条）
         cursor = self.log_text.textCursor()
         cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        for text, style in pending:
+            text_format = self._console_format(style)
+            for i, part in enumerate(text.split("\r")):
+                if i > 0:
+                    self._console_line_reset = True
+                if not part:
+                    continue
+                if self._console_line_reset:
+                    self._console_line_reset = False
+                    if not part.startswith("\n"):
+                        cursor.movePosition(QTextCursor.StartOfBlock, QTextCursor.KeepAnchor)
+                        cursor.removeSelectedText()
+                cursor.insertText(part, text_format)
+        cursor.endEditBlock()
         self.log_text.setTextCursor(cursor)
 
-    def _check_process_status(self):
-        if self.process and self.process.poll() is not None:
-            # Process has terminated
-            exit_code = self.process.poll()
+    def _on_command_output(self, tag: str, text: str):
+        # stdout 与 stderr 在控制台中按到达顺序合并显示，每个流各自解析 ANSI 转义序列
+        self._append_segments(self._ansi_parsers[tag].feed(text))
+
+    def _on_process_finished(self, process, exit_code: int):
+        # process 为 Popen 或 ShellRun；已被停止或被新命令取代的不再报告
+        if process is self.process:
             self._append_log(f"\n进程已退出，代码: {exit_code}\n")
-            self.run_button.setText("▶ 运行")
-            self.process = None
-            self.activateWindow()
-            self.feedback_text.setFocus()
+        elif process is self.shell_run:
+            self._append_log(f"\n命令已结束，代码: {exit_code}\n")
+        else:
+            return
+        self.wall_time_timer.stop()
+        self._finish_sampler(exit_code)
+        self.run_button.setText("▶ 运行")
+        self.process = None
+        self.shell_run = None
+        self.activateWindow()
+        self.feedback_text.setFocus()
+
+    def _on_wall_time_exceeded(self):
+        if self.process or self.shell_run:
+            self._append_log(f"\n命令运行超过 {self.config['command_max_wall_time']} 秒，已停止\n")
+            self._stop_command()
+
+    def _start_sampler(self, pid: int, command: str, include_root: bool = True):
+        sampler = ResourceSampler(
+            pid, command, include_root,
+            on_sample=lambda stats: self.log_signals.telemetry_sampled.emit(sampler, stats),
+        )
+        self.sampler = sampler
+        sampler.start()
 
-    def _run_command(self):
+    def _finish_sampler(self, exit_code: Optional[int] = None):
+        if self.sampler is None:
+            return
+        self.command_stats = self.sampler.stop(exit_code)
+        self.finished_sampler = self.sampler
+        self.sampler = None
+        self.telemetry_label.setText(format_command_stats(self.command_stats))
+        self._record_command(self.command_stats)
+
+    def _record_command(self, stats: CommandStats):
+        """把结束的命令写入命令历史，索引已构建时同时加入索引"""
+        started_at = time.time() - stats["wall_time"]
+        self.store.record_command(self.project_directory, stats["command"], stats["exit_code"],
+                                  stats["wall_time"], started_at)
+        index = loaded_command_history()
+        if index is not None:
+            index.add(stats["command"], self.project_directory, started_at, stats["exit_code"])
+
+    def _update_command_completions(self, text: str):
+        """输入时从命令历史中补全；索引第一次使用时在后台线程中构建"""
+        index = loaded_command_history()
+        if index is None:
+            if not self.history_loading:
+                self.history_loading = True
+                threading.Thread(target=self._load_command_history, name="command-history", daemon=True).start()
+            return
+        completions = index.search(text, COMPLETION_LIMIT)
+        if completions == [text.strip()]:
+            completions = []
+        self.completion_model.setStringList(completions)
+        if completions and self.command_entry.hasFocus():
+            self.command_completer.complete()
+        else:
+            self.command_completer.popup().hide()
+
+    def _load_command_history(self):
+        load_command_history(self.store)
+        self.log_signals.history_loaded.emit()
+
+    def _on_command_history_loaded(self):
+        if self.command_entry.text().strip():
+            self._update_command_completions(self.command_entry.text())
+
+    def _on_telemetry_sampled(self, sampler: ResourceSampler, stats: CommandStats):
+        if sampler is self.sampler:
+            self.telemetry_label.setText(format_command_stats(stats))
+        elif sampler is self.finished_sampler:
+            # 刚结束的命令停止后补的采样（或停止前已排队的采样）：从采样器读取最终统计
+            self.command_stats = sampler.stats()
+            self.telemetry_label.setText(format_command_stats(self.command_stats))
+        # 被取代的命令的采样不再显示
+
+    def _stop_command(self):
+        self.wall_time_timer.stop()
+        self._finish_sampler()
         if self.process:
             kill_tree(self.process)
             self.process = None
+        if self.shell_run:
+            # 只结束命令，Shell 会话保留给后续命令
+            self.shell_run.stop()
+            self.shell_run = None
+        if self.command_group is not None:
             self.run_button.setText("▶ 运行")
+
+    def _use_pty(self) -> bool:
+        return self.config.get("use_pty", False) and sys.platform != "win32"
+
+    def _console_size(self) -> tuple[int, int]:
+        """控制台可见区域能容纳的（列, 行），作为伪终端窗口大小"""
+        metrics = self.log_text.fontMetrics()
+        viewport = self.log_text.viewport()
+        columns = viewport.width() // max(1, metrics.horizontalAdvance("M"))
+        rows = viewport.height() // max(1, metrics.lineSpacing())
+        if columns < 20 or rows < 5:
+            return PTY_DEFAULT_SIZE
+        return columns, rows
+
+    def _run_in_shell(self, command: str):
+        shell = get_persistent_shell(self.project_directory, self._use_pty(), self._command_limits())
+        if shell.is_busy():
+            raise RuntimeError("此项目的 Shell 会话正在执行其他命令")
+        self.shell_run = shell.run(
+            command,
+            self._on_command_output,
+            lambda run, exit_code: self.log_signals.process_finished.emit(run, exit_code),
+        )
+        self._start_sampler(shell.process.pid, command, include_root=False)
+
+    def _run_command(self):
+        if self.process or self.shell_run:
+            self._stop_command()
             return
 
-        # Clear the log buffer but keep UI logs visible
-        self.log_buffer = []
+        # 自动执行时命令区域可能尚未构建（保持折叠，输出仍写入控制台）
+        self._ensure_command_section()
 
         command = self.command_entry.text()
         if not command:
-            self._append_log("请输入要执行的命令\n")
+            self._show_status("请输入要执行的命令")
             return
 
+        # Clear the log buffer but keep UI logs visible
+        self.log_buffer.clear()
+        self.command_ran = False
+
         self._append_log(f"$ {command}\n")
         self.run_button.setText("⏹ 停止")
+        self._ansi_parsers.clear()
 
         try:
-            self.process = subprocess.Popen(
+            if self.config["command_max_wall_time"] > 0:
+                self.wall_time_timer.start(self.config["command_max_wall_time"] * 1000)
+
+            if self.config.get("persistent_shell", False) and sys.platform != "win32":
+                self._run_in_shell(command)
+                self.command_ran = True
+                return
+
+            self.process, streams = start_command_process(
                 command,
-                shell=True,
                 cwd=self.project_directory,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env=get_user_environment(),
-                text=True,
-                bufsize=1,
-                encoding="utf-8",
-                errors="ignore",
-                close_fds=True,
+                shell=True,
+                use_pty=self._use_pty(),
+                pty_size=self._console_size(),
+                limits=self._command_limits(),
             )
 
-            def read_output(pipe):
-                for line in iter(pipe.readline, ""):
-                    self.log_signals.append_log.emit(line)
-
-            threading.Thread(
-                target=read_output,
-                args=(self.process.stdout,),
-                daemon=True
-            ).start()
-
-            threading.Thread(
-                target=read_output,
-                args=(self.process.stderr,),
-                daemon=True
-            ).start()
-
-            # Start process status checking
-            self.status_timer = QTimer()
-            self.status_timer.timeout.connect(self._check_process_status)
-            self.status_timer.start(100)  # Check every 100ms
+            process = self.process
+            self._start_sampler(process.pid, command)
+            self.output_reader = CommandOutputReader(
+                streams,
+                self._on_command_output,
+                process=process,
+                on_exit=lambda exit_code: self.log_signals.process_finished.emit(process, exit_code),
+            )
+            self.output_reader.start()
+            self.command_ran = True
 
         except Exception as e:
             self._append_log(f"运行命令时出错: {str(e)}\n")
+            self.wall_time_timer.stop()
+            self._finish_sampler()
             self.run_button.setText("▶ 运行")
 
     def _submit_feedback(self):
+        # 粘贴的图片可能仍在后台写入磁盘，等待写入完成后再收集路径（不等待缩略图解码）
+        self.image_model.wait_for_saved()
+        images = [path for path in self.image_model.paths()
+                  if path not in self.temp_images or os.path.exists(path)]
         # 收集反馈信息，包括文字和图片
-        feedback_data = {
-            'text_feedback': self.feedback_text.toPlainText().strip(),
-            'images': self.selected_images.copy()
-        }
-        
         self.feedback_result = FeedbackResult(
-            command_logs="".join(self.log_buffer),
-            interactive_feedback=json.dumps(feedback_data, ensure_ascii=False, indent=2)
+            command_logs=self._command_logs(),
+            command_stats=self._current_command_stats(),
+            text_feedback=self.feedback_text.toPlainText().strip(),
+            images=images
         )
         self.close()
 
+    def _current_command_stats(self) -> Optional[CommandStats]:
+        # 提交时命令仍在运行则附带当前的采样结果
+        if self.sampler is not None:
+            return self.sampler.stats()
+        return self.command_stats
+
     def clear_logs(self):
-        self.log_buffer = []
-        self.log_text.clear()
+        self.log_buffer.clear()
+        self._pending_log.clear()
+        self._console_line_reset = False
+        if self.command_group is not None:
+            self.log_text.clear()
 
     def _save_config(self):
-        # Save run_command and execute_automatically to QSettings under project group
-        self.settings.beginGroup(self.project_group_name)
-        self.settings.setValue("run_command", self.config["run_command"])
-        self.settings.setValue("execute_automatically", self.config["execute_automatically"])
-        self.settings.endGroup()
-        self._append_log("已保存此项目的配置。\n")
+        # Save the command config under the project scope（后台批量写入）
+        self.store.set_many(self.project_group_name, dict(self.config))
+        self._show_status("已保存此项目的配置。")
 
     def _select_images(self):
         """选择图片文件"""
+        from PySide6.QtWidgets import QFileDialog
         file_dialog = QFileDialog()
         file_paths, _ = file_dialog.getOpenFileNames(
             self,
@@ -1365,210 +3043,279 @@ class FeedbackUI(QMainWindow):
             "图片文件 (*.png *.jpg *.jpeg *.gif *.bmp *.tiff);;所有文件 (*)"
         )
         
-        if file_paths:
-            for file_path in file_paths:
-                if file_path not in self.selected_images:
-                    self.selected_images.append(file_path)
-            self._update_image_display()
+        for file_path in file_paths:
+            self.image_model.add_image(file_path)
 
     def _paste_image(self):
-        """从剪贴板粘贴图片"""
+        """从剪贴板粘贴图片，PNG 编码和缩略图生成都在后台线程中完成"""
         from PySide6.QtWidgets import QApplication
         clipboard = QApplication.clipboard()
-        pixmap = clipboard.pixmap()
+        # QImage 可以跨线程使用，QPixmap 不行
+        image = clipboard.image()
         
-        if not pixmap.isNull():
-            # 保存临时图片文件
+        if not image.isNull():
             import tempfile
             # 使用 delete=False 确保文件不会被自动删除
             temp_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
             temp_path = temp_file.name
             temp_file.close()
             
-            if pixmap.save(temp_path, 'PNG'):
-                if temp_path not in self.selected_images:
-                    self.selected_images.append(temp_path)
-                self._update_image_display()
-                self._append_log(f"已从剪贴板添加图片: {temp_path}\n")
-            else:
-                self._append_log("保存剪贴板图片失败。\n")
+            self.temp_images.add(temp_path)
+            self.image_model.add_image(temp_path, source_image=image)
+            self._show_status(f"已从剪贴板添加图片: {temp_path}")
         else:
-            self._append_log("剪贴板中没有图片。\n")
+            self._show_status("剪贴板中没有图片。")
+
+    def _on_image_failed(self, image_id: int, image_path: str):
+        """粘贴图片保存失败时移除对应条目；无法预览的普通文件保留，由服务器端处理"""
+        if image_path in self.temp_images:
+            self._remove_image(image_id)
+            self._show_status("保存剪贴板图片失败。")
 
     def _clear_images(self):
         """清空所有选择的图片"""
         # 清理临时文件
         self._cleanup_temp_images()
         
-        self.selected_images.clear()
-        self._update_image_display()
-
-    def _update_image_display(self):
-        """更新图片显示区域"""
-        # 清空当前显示的图片组件
-        for widget in self.image_widgets:
-            widget.deleteLater()
-        self.image_widgets.clear()
-        
-        if not self.selected_images:
-            # 没有图片时显示提示
-            self.no_image_label.setVisible(True)
-        else:
-            # 隐藏提示标签
-            self.no_image_label.setVisible(False)
-            
-            # 为每个图片创建显示组件
-            for i, image_path in enumerate(self.selected_images):
-                image_widget = self._create_image_widget(image_path, i)
-                self.image_container_layout.addWidget(image_widget)
-                self.image_widgets.append(image_widget)
-
-    def _create_image_widget(self, image_path: str, index: int) -> QWidget:
-        """创建单个图片显示组件"""
-        widget = QWidget()
-        layout = QVBoxLayout(widget)
-        layout.setContentsMargins(5, 5, 5, 5)
-        
-        # 图片标签
-        image_label = QLabel()
-        pixmap = QPixmap(image_path)
-        
-        if not pixmap.isNull():
-            # 缩放图片到合适大小
-            scaled_pixmap = pixmap.scaled(120, 90, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-            image_label.setPixmap(scaled_pixmap)
-        else:
-            image_label.setText("❌\n加载失败")
-            image_label.setAlignment(Qt.AlignCenter)
-        
-        # 根据主题设置图片标签样式
-        if self.dark_theme:
-            image_label_style = """
-                QLabel {
-                    border: 1px solid #606063;
-                    border-radius: 4px;
-                    background-color: #4a4a4d;
-                    padding: 5px;
-                }
-            """
-            name_label_style = """
-                color: #c0c0c0;
-                font-size: 10px;
-                margin: 2px 0px;
-            """
-        else:
-            image_label_style = """
-                QLabel {
-                    border: 1px solid #ced4da;
-                    border-radius: 4px;
-                    background-color: #f8f9fa;
-                    padding: 5px;
-                }
-            """
-            name_label_style = """
-                color: #495057;
-                font-size: 10px;
-                margin: 2px 0px;
-            """
-        
-        image_label.setStyleSheet(image_label_style)
-        image_label.setMinimumSize(130, 100)
-        image_label.setAlignment(Qt.AlignCenter)
-        
-        # 文件名标签
-        file_name = os.path.basename(image_path)
-        if len(file_name) > 15:
-            file_name = file_name[:12] + "..."
-        name_label = QLabel(file_name)
-        name_label.setAlignment(Qt.AlignCenter)
-        name_label.setStyleSheet(name_label_style)
-        
-        # 删除按钮
-        remove_button = QPushButton("❌")
-        remove_button.setFixedSize(20, 20)
-        remove_button.setStyleSheet("""
-            QPushButton {
-                background-color: #dc3545;
-                border: none;
-                border-radius: 10px;
-                font-size: 10px;
-                color: white;
-            }
-            QPushButton:hover {
-                background-color: #bb2d3b;
-            }
-        """)
-        remove_button.clicked.connect(lambda: self._remove_image(index))
-        
-        # 布局
-        layout.addWidget(image_label)
-        layout.addWidget(name_label)
-        layout.addWidget(remove_button, alignment=Qt.AlignCenter)
-        
-        widget.setMaximumWidth(140)
-        return widget
+        self.image_model.clear()
 
-    def _remove_image(self, index: int):
-        """删除指定索引的图片"""
-        if 0 <= index < len(self.selected_images):
-            image_path = self.selected_images[index]
-            
-            # 如果是临时文件，删除它
-            import tempfile
-            if tempfile.gettempdir() in image_path:
-                try:
-                    os.remove(image_path)
-                except:
-                    pass
+    def _update_image_placeholder(self):
+        """没有图片时显示提示标签，否则显示图片列表"""
+        has_images = self.image_model.rowCount() > 0
+        self.no_image_label.setVisible(not has_images)
+        self.image_view.setVisible(has_images)
+
+    def _remove_image(self, image_id: int):
+        """删除指定 ID 的图片"""
+        image_path = self.image_model.remove_image(image_id)
             
-            self.selected_images.pop(index)
-            self._update_image_display()
+        # 如果是粘贴产生的临时文件，删除它
+        if image_path in self.temp_images:
+            self.temp_images.discard(image_path)
+            try:
+                os.remove(image_path)
+            except:
+                pass
 
     def closeEvent(self, event):
         # Save general UI settings for the main window (geometry, state)
-        self.settings.beginGroup("MainWindow_General")
-        self.settings.setValue("geometry", self.saveGeometry())
-        self.settings.setValue("windowState", self.saveState())
-        self.settings.endGroup()
+        self.store.set_many(WINDOW_SCOPE, {
+            "geometry": self.saveGeometry(),
+            "windowState": self.saveState(),
+        })
 
         # Save project-specific command section visibility (this is now slightly redundant due to immediate save in toggle, but harmless)
-        self.settings.beginGroup(self.project_group_name)
-        self.settings.setValue("commandSectionVisible", self.command_group.isVisible())
-        # 保存分割器状态
-        self.settings.setValue("splitterState", self.feedback_splitter.saveState())
-        self.settings.endGroup()
+        self._save_layout_state()
 
         # 只有在没有提交反馈的情况下才清理临时图片文件
         # 如果已经提交反馈，临时文件应该保留给 MCP 使用
         if not self.feedback_result:
             self._cleanup_temp_images()
 
-        if self.process:
-            kill_tree(self.process)
+        self._stop_command()
         super().closeEvent(event)
+        self.session_finished.emit(self.feedback_result)
     
     def _cleanup_temp_images(self):
-        """清理临时图片文件"""
-        import tempfile
-        for image_path in self.selected_images:
-            if tempfile.gettempdir() in image_path:
-                try:
-                    os.remove(image_path)
-                except:
-                    pass
+        """清理粘贴产生的临时图片文件"""
+        for image_path in self.temp_images:
+            try:
+                os.remove(image_path)
+            except:
+                pass
+        self.temp_images.clear()
 
     def run(self) -> FeedbackResult:
         self.show()
         QApplication.instance().exec()
 
         if self.process:
-            kill_tree(self.process)
+            kill_tree(self.process, wait=True)
 
         if not self.feedback_result:
-            return FeedbackResult(command_logs="".join(self.log_buffer), interactive_feedback="")
+            return FeedbackResult(command_logs=self._command_logs(), command_stats=self._current_command_stats(),
+                                  text_feedback="", images=[])
 
         return self.feedback_result
 
+class HostSignals(QObject):
+    request_received = Signal(dict)
+
+class FeedbackHost(QObject):
+    """常驻反馈界面宿主
+
+    由 MCP 服务器启动一次（--host），在同一个 QApplication 中复用反馈窗口：
+    每轮反馈从 stdin 读取一条请求帧并显示窗口，用户提交或关闭后把结果帧
+    （图片以二进制帧附带）写回 stdout，窗口隐藏后放回空闲池等待下一轮。
+    帧格式见 feedback_protocol。
+    """
+
+    def __init__(self, dark_theme: bool = True):
+        super().__init__()
+        self.signals = HostSignals()
+        self.signals.request_received.connect(self._handle_request)
+        self.idle_windows: dict[bool, list[FeedbackUI]] = {True: [], False: []}
+        self.active_sessions: dict[str, FeedbackUI] = {}
+
+        # 预先构建一个窗口，让第一轮反馈也无需等待界面构建；此时还没有请求，
+        # 不自动执行命令，等第一轮反馈在 begin_session 中按请求的项目运行
+        self.idle_windows[dark_theme].append(self._create_window(os.getcwd(), "", dark_theme, auto_execute=False))
+
+    def start(self):
+        threading.Thread(target=self._read_requests, daemon=True).start()
+
+    def _read_requests(self):
+        while True:
+            try:
+                message = read_message(sys.stdin.buffer)
+            except (ValueError, OSError):
+                break
+            if message is None:
+                break
+            self.signals.request_received.emit(message[0])
+        # stdin 关闭表示服务器已退出
+        self.signals.request_received.emit({"op": "quit"})
+
+    def _create_window(self, project_directory: str, prompt: str, dark_theme: bool,
+                       auto_execute: bool = True) -> FeedbackUI:
+        app = QApplication.instance()
+        window = FeedbackUI(project_directory, prompt, dark_theme, auto_execute)
+        window.setPalette(get_dark_mode_palette(app) if dark_theme else get_light_mode_palette(app))
+        window.session_finished.connect(lambda result, w=window: self._finish_session(w, result))
+        return window
+
+    def _handle_request(self, request: dict):
+        op = request.get("op")
+        if op == "show":
+            self._show_session(request)
+        elif op == "cancel":
+            window = self.active_sessions.get(request.get("id"))
+            if window:
+                window.close()
+        elif op == "quit":
+            self.shutdown()
+
+    def _show_session(self, request: dict):
+        session_id = request["id"]
+        project_directory = request.get("project_directory") or os.getcwd()
+        prompt = request.get("prompt", "")
+        dark_theme = request.get("theme", "dark") == "dark"
+
+        idle = self.idle_windows[dark_theme]
+        if idle:
+            window = idle.pop()
+            window.begin_session(project_directory, prompt)
+        else:
+            window = self._create_window(project_directory, prompt, dark_theme)
+
+        self.active_sessions[session_id] = window
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    def _finish_session(self, window: FeedbackUI, result: Optional[FeedbackResult]):
+        session_id = next((sid for sid, w in self.active_sessions.items() if w is window), None)
+        if session_id is None:
+            return
+        del self.active_sessions[session_id]
+        self.idle_windows[window.dark_theme].append(window)
+
+        if not result:
+            result = FeedbackResult(command_logs=window._command_logs(),
+                                    command_stats=window._current_command_stats(), text_feedback="", images=[])
+
+        # 图片原始字节直接作为二进制帧发送，服务器无需再按路径读取
+        image_paths = [path for path in result["images"] if os.path.isfile(path)]
+        image_errors = []
+        while True:
+            try:
+                write_message(sys.stdout.buffer, {
+                    "id": session_id,
+                    "command_logs": result["command_logs"],
+                    "command_stats": result["command_stats"],
+                    "text_feedback": result["text_feedback"],
+                    "images": [
+                        {"name": os.path.basename(path), "mime_type": guess_image_mime(path)}
+                        for path in image_paths
+                    ],
+                    "image_errors": image_errors,
+                }, image_paths)
+                break
+            except ProtocolError as e:
+                self._abort_stream(e)
+                return
+            except OSError as e:
+                if e.filename not in image_paths:
+                    # 写入输出流失败，流可能已经错位
+                    self._abort_stream(e)
+                    return
+                # 图片在发送前被删除或无法读取：此时还没有写入任何帧，去掉它重新发送，
+                # 文字反馈照常返回，失败原因随结果告诉服务器
+                print(f"图片无法读取，不随反馈发送: {e.filename}: {e.strerror}", file=sys.stderr)
+                image_paths.remove(e.filename)
+                image_errors.append({"name": os.path.basename(e.filename), "error": e.strerror or str(e)})
+
+        # 图片已经随结果发出，粘贴产生的临时文件不再需要
+        window._cleanup_temp_images()
+
+    def _abort_stream(self, error: Exception):
+        """
+        结果帧只写出了一部分，输出流已错位：立即退出宿主
+
+        不关闭其他窗口（关闭会把它们的结果写入已错位的流）。服务器读到不完整的
+        消息后只让这一轮反馈失败，其他仍在等待的会话由服务器重启宿主后重新显示。
+        """
+        print(f"发送反馈失败: {error}", file=sys.stderr)
+        # 把已写出的帧头交给服务器，它据此知道是哪一轮反馈没有传完
+        with contextlib.suppress(OSError):
+            sys.stdout.buffer.flush()
+        sys.stderr.flush()
+        os._exit(1)
+
+    def shutdown(self):
+        for window in list(self.active_sessions.values()):
+            window.close()
+        QApplication.instance().quit()
+
+def create_application(dark_theme: bool = True) -> QApplication:
+    """创建（或取得已有的）QApplication，应用主题调色板和 Fusion 样式"""
+    app = QApplication.instance() or QApplication()
+    app.setPalette(get_dark_mode_palette(app) if dark_theme else get_light_mode_palette(app))
+    app.setStyle("Fusion")
+    return app
+
+def run_feedback_host(dark_theme: bool = True) -> int:
+    app = create_application(dark_theme)
+    # 会话之间窗口只是隐藏，宿主进程需要一直运行
+    app.setQuitOnLastWindowClosed(False)
+
+    host = FeedbackHost(dark_theme)
+    host.start()
+    return app.exec()
+
+def _import_qsettings(store: FeedbackStore):
+    """把旧版本保存在 QSettings 中的设置导入存储（只执行一次）"""
+    from PySide6.QtCore import QSettings
+    settings = QSettings("InteractiveFeedbackMCP", "InteractiveFeedbackMCP")
+    imported: dict[str, dict] = collections.defaultdict(dict)
+    for key in settings.allKeys():
+        scope, _, name = key.partition("/")
+        value = settings.value(key)
+        if name and value is not None:
+            imported[scope][name] = value
+    for scope, values in imported.items():
+        store.set_many(scope, values)
+    store.set(WINDOW_SCOPE, "qsettingsImported", True)
+    store.flush()
+
+def load_settings(store: FeedbackStore, scopes: list[str]) -> dict[str, dict]:
+    """一次读出多个作用域的设置；首次使用存储时先导入旧的 QSettings"""
+    settings = store.load(scopes)
+    if WINDOW_SCOPE in settings and not setting_value(settings[WINDOW_SCOPE], "qsettingsImported", False):
+        _import_qsettings(store)
+        settings = store.load(scopes)
+    return settings
+
 def get_project_settings_group(project_dir: str) -> str:
     # Create a safe, unique group name from the project directory path
     # Using only the last component + hash of full path to keep it somewhat readable but unique
@@ -1577,15 +3324,7 @@ def get_project_settings_group(project_dir: str) -> str:
     return f"{basename}_{full_hash}"
 
 def feedback_ui(project_directory: str, prompt: str, output_file: Optional[str] = None, dark_theme: bool = True) -> Optional[FeedbackResult]:
-    app = QApplication.instance() or QApplication()
-    
-    # 根据主题选择应用相应的调色板
-    if dark_theme:
-        app.setPalette(get_dark_mode_palette(app))
-    else:
-        app.setPalette(get_light_mode_palette(app))
-    
-    app.setStyle("Fusion")
+    create_application(dark_theme)
     ui = FeedbackUI(project_directory, prompt, dark_theme)
     result = ui.run()
 
@@ -1593,25 +3332,88 @@ def feedback_ui(project_directory: str, prompt: str, output_file: Optional[str]
         # Ensure the directory exists
         os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else ".", exist_ok=True)
         # Save the result to the output file
-        with open(output_file, "w") as f:
-            json.dump(result, f)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
         return None
 
     return result
 
-if __name__ == "__main__":
+# 启动预算（毫秒）：从模块开始导入到反馈窗口第一次绘制完成，不含解释器自身的启动；
+# 只作为 --startup-profile 报告的目标，实际耗时取决于机器
+STARTUP_BUDGET_MS = number_from_env("FEEDBACK_STARTUP_BUDGET_MS", 250.0)
+
+class _FirstPaintProbe(QObject):
+    """记录窗口是否已收到第一次绘制事件"""
+    painted = False
+
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint:
+            self.painted = True
+        return False
+
+def run_startup_profile(project_directory: str, prompt: str, dark_theme: bool = True) -> int:
+    """
+    --startup-profile：按正常启动的路径创建应用并显示反馈窗口，第一次绘制完成后
+    打印各阶段耗时（imports、QApplication、UI build、first paint）并退出
+    """
+    phases = [("imports", time.perf_counter() - _MODULE_STARTED)]
+
+    started = time.perf_counter()
+    app = create_application(dark_theme)
+    phases.append(("QApplication", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    ui = FeedbackUI(project_directory, prompt, dark_theme)
+    phases.append(("UI build", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    probe = _FirstPaintProbe()
+    ui.installEventFilter(probe)
+    ui.show()
+    while not probe.painted:
+        app.processEvents()
+    # 窗口的绘制事件先于子控件，处理完这一轮事件才算整个窗口绘制完成
+    app.processEvents()
+    phases.append(("first paint", time.perf_counter() - started))
+    ui.hide()
+
+    total = sum(duration for _, duration in phases) * 1000
+    print("启动耗时：")
+    for name, duration in phases:
+        print(f"  {name:<14}{duration * 1000:8.1f} ms")
+    verdict = "在预算内" if total <= STARTUP_BUDGET_MS else "超出预算"
+    print(f"  {'total':<14}{total:8.1f} ms（预算 {STARTUP_BUDGET_MS:.0f} ms，{verdict}）")
+    return 0
+
+def main():
+    import argparse
     parser = argparse.ArgumentParser(description="Run the feedback UI")
     parser.add_argument("--project-directory", default=os.getcwd(), help="The project directory to run the command in")
     parser.add_argument("--prompt", default="I implemented the changes you requested.", help="The prompt to show to the user")
     parser.add_argument("--output-file", help="Path to save the feedback result as JSON")
     parser.add_argument("--theme", choices=['dark', 'light'], default='dark', help="UI theme: dark or light (default: dark)")
+    parser.add_argument("--host", action="store_true", help="Run as a long-lived UI host serving requests from stdin")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="Print a startup phase breakdown (imports, QApplication, UI build, first paint) and exit")
     args = parser.parse_args()
 
     # 将主题参数转换为布尔值
     dark_theme = args.theme == 'dark'
+
+    if args.startup_profile:
+        sys.exit(run_startup_profile(args.project_directory, args.prompt, dark_theme))
+    if args.host:
+        sys.exit(run_feedback_host(dark_theme))
     
     result = feedback_ui(args.project_directory, args.prompt, args.output_file, dark_theme)
     if result:
         print(f"\nLogs collected: \n{result['command_logs']}")
-        print(f"\nFeedback received:\n{result['interactive_feedback']}")
+        if result['command_stats']:
+            print(f"\nCommand stats: {format_command_stats(result['command_stats'])}")
+        print(f"\nFeedback received:\n{result['text_feedback']}")
+        for image_path in result['images']:
+            print(f"Image: {image_path}")
     sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -5,26 +5,1041 @@ AI调用时会汇报工作内容，用户可以提供文本反馈和/或图片
 
 import os
 import sys
-import subprocess
-import tempfile
-import json
+import asyncio
+import itertools
+import time
+import uuid
+import io
 import base64
+import gzip
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import List, Union
+from typing import AsyncIterator, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 from mcp.server.fastmcp import FastMCP
-from mcp.types import TextContent, ImageContent
+from mcp.types import TextContent, ImageContent, EmbeddedResource, BlobResourceContents
+
+from feedback_protocol import IncompleteMessageError, ProtocolError, encode_message, read_message_async
+from feedback_store import get_feedback_store, number_from_env
+
+
+# 宿主进程导入的本仓库模块
+HOST_MODULES = ("feedback_ui", "feedback_protocol", "feedback_store", "command_history")
+
+# 以导入模块的方式启动宿主：直接运行 feedback_ui.py 时 __main__ 每次都要重新编译源码，
+# 导入则使用 __pycache__ 中的字节码
+HOST_BOOTSTRAP = "import sys; sys.path.insert(0, sys.argv.pop(1)); import feedback_ui; feedback_ui.main()"
+
+
+def precompile_host_modules(package_dir: str):
+    """
+    把宿主用到的模块预先编译到 __pycache__（已是最新的跳过，只比较时间戳）
+
+    设置了 PYTHONDONTWRITEBYTECODE 时导入不会写字节码，宿主每次启动都要重新编译；
+    目录不可写时编译失败不影响启动，只是回到按源码编译。
+    """
+    import compileall
+    for name in HOST_MODULES:
+        compileall.compile_file(os.path.join(package_dir, name + ".py"), quiet=2)
+
+
+class HostExitedError(RuntimeError):
+    """常驻宿主进程在会话进行中退出"""
+
+
+class FeedbackTransferError(RuntimeError):
+    """宿主在发送某一轮反馈的结果时失败（不会重新显示窗口）"""
+
+
+class FeedbackHost:
+    """
+    常驻反馈界面宿主进程的客户端
+
+    服务器只启动一次 `feedback_ui --host`，之后每轮反馈都通过宿主的
+    stdin/stdout 以帧协议（见 feedback_protocol）发送请求、接收结果，
+    图片作为二进制帧随结果一起到达。窗口在会话之间
+    只是隐藏，省去了解释器启动、PySide6 导入和界面构建的开销。
+    宿主进程崩溃时，下一次请求（或正在等待的请求）会自动重启它。
+
+    所有 I/O 都基于 asyncio 子进程，等待用户反馈时不会阻塞事件循环，
+    多个请求可以同时等待各自的会话结果。
+    """
+
+    def __init__(self, package_dir: str, theme: str = "light"):
+        self.package_dir = package_dir
+        self.theme = theme
+        self._start_lock = asyncio.Lock()
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._pending: Dict[str, Tuple[asyncio.Future, asyncio.subprocess.Process]] = {}
+        self._ids = itertools.count(1)
+        self._reader_tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """确保宿主进程正在运行（服务器启动时调用可提前预热）"""
+        await self._ensure_started()
+
+    async def _ensure_started(self) -> asyncio.subprocess.Process:
+        async with self._start_lock:
+            if self._process is None or self._process.returncode is not None:
+                await asyncio.to_thread(precompile_host_modules, self.package_dir)
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, '-c', HOST_BOOTSTRAP, self.package_dir, '--host', '--theme', self.theme,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                )
+                task = asyncio.create_task(self._read_results(process))
+                self._reader_tasks.add(task)
+                task.add_done_callback(self._reader_tasks.discard)
+                self._process = process
+            return self._process
+
+    async def _read_results(self, process: asyncio.subprocess.Process):
+        while True:
+            try:
+                received = await read_message_async(process.stdout, IMAGE_SPOOL_THRESHOLD)
+            except IncompleteMessageError as e:
+                # 宿主在发送这一轮结果时退出：只让这一轮失败，其他会话按宿主退出处理并重试
+                pending = self._pending.get(e.message.get('id'))
+                if pending and not pending[0].done():
+                    pending[0].set_exception(FeedbackTransferError(f"反馈结果传输失败: {e}"))
+                self._kill(process)
+                break
+            except (ProtocolError, ValueError, OSError) as e:
+                # 输出流已错位无法再可靠解析，或图片无法暂存（例如磁盘已满）：结束宿主，
+                # 下面唤醒等待它的请求，下一次请求会重启宿主
+                print(f"读取反馈界面宿主的结果失败: {e}", file=sys.stderr)
+                self._kill(process)
+                break
+            if received is None:
+                break
+
+            message, blobs = received
+            pending = self._pending.get(message.get('id'))
+            if pending and not pending[0].done():
+                pending[0].set_result({
+                    'command_logs': message.get('command_logs', ''),
+                    'command_stats': message.get('command_stats'),
+                    'text_feedback': message.get('text_feedback', ''),
+                    'image_errors': message.get('image_errors', []),
+                    'images': [
+                        dict(meta, data=data)
+                        for meta, data in zip(message.get('images', []), blobs)
+                    ],
+                })
+
+        # 宿主进程退出：唤醒所有仍在等待它的请求
+        await process.wait()
+        for future, owner in self._pending.values():
+            if owner is process and not future.done():
+                future.set_exception(HostExitedError("反馈界面宿主进程异常退出"))
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process):
+        # 宿主可能已经自行退出
+        with suppress(ProcessLookupError):
+            process.kill()
+
+    def _send(self, process: asyncio.subprocess.Process, message: dict):
+        process.stdin.write(encode_message(message))
+
+    async def request(self, project_directory: str, prompt: str, theme: str, timeout: float) -> Optional[dict]:
+        """显示反馈窗口并等待结果，宿主崩溃时重启并重试一次"""
+        for _ in range(2):
+            session_id = str(next(self._ids))
+            future = asyncio.get_running_loop().create_future()
+            process = await self._ensure_started()
+            self._pending[session_id] = (future, process)
+            try:
+                try:
+                    self._send(process, {
+                        'op': 'show',
+                        'id': session_id,
+                        'project_directory': project_directory,
+                        'prompt': prompt,
+                        'theme': theme,
+                    })
+                    await process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    process.kill()
+                    continue
+                return await asyncio.wait_for(future, timeout)
+            except HostExitedError:
+                continue
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # 调用被取消或超时：立即关闭该会话的窗口
+                self.cancel(session_id)
+                raise
+            finally:
+                self._pending.pop(session_id, None)
+
+        raise HostExitedError("反馈界面宿主进程异常退出")
+
+    def cancel(self, session_id: str):
+        process = self._process
+        if process and process.returncode is None:
+            try:
+                self._send(process, {'op': 'cancel', 'id': session_id})
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    async def stop(self):
+        process = self._process
+        self._process = None
+        if process and process.returncode is None:
+            # 关闭 stdin 后宿主会自行退出
+            process.stdin.close()
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                process.kill()
+
+
+@dataclass
+class FeedbackRound:
+    """一轮反馈的请求和耗时，随结果写入反馈归档"""
+
+    project_directory: str
+    prompt: str
+    started_at: float = field(default_factory=time.time)
+    duration: float = 0.0
+
+    def finish(self):
+        self.duration = time.time() - self.started_at
+
+
+class FeedbackSession:
+    """后台反馈会话：由 start_feedback 创建，结果保留到被取回或过期"""
+
+    def __init__(self, session_id: str, task: asyncio.Task, feedback_round: FeedbackRound):
+        self.session_id = session_id
+        self.task = task
+        self.feedback_round = feedback_round
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self._items: Optional[asyncio.Future] = None
+
+    def mark_finished(self):
+        self.finished_at = time.monotonic()
+        self.feedback_round.finish()
+
+    def feedback_items(self) -> asyncio.Future:
+        """
+        把已完成会话的结果转换为 MCP 内容（只转换并归档一次）
+
+        并发的 await_feedback 调用共享同一个 Future，结果不会被重复归档，
+        图片的临时数据也只被读取一次。
+        """
+        if self._items is None:
+            self._items = asyncio.ensure_future(asyncio.to_thread(
+                _build_feedback_items, self.task.result(), None, None, self.feedback_round))
+        return self._items
+
+    def discard_result(self):
+        """关闭未被取回的结果中图片的临时数据（会话过期或被清理时）"""
+        if self._items is not None or not self.task.done() or self.task.cancelled() or self.task.exception():
+            return
+        for image in (self.task.result() or {}).get('images', []):
+            if hasattr(image['data'], 'close'):
+                image['data'].close()
+
+    @property
+    def status(self) -> str:
+        if not self.task.done():
+            return "pending"
+        if self.task.cancelled() or isinstance(self.task.exception(), asyncio.TimeoutError):
+            return "cancelled"
+        if self.task.exception() is not None:
+            return "failed"
+        return "completed"
+
+
+class FeedbackSessionTable:
+    """
+    反馈会话表
+
+    start_feedback 立即返回会话 ID，窗口在后台等待用户；poll_feedback 和
+    await_feedback 按 ID 查询或长轮询结果。已完成的会话在结果被取回后删除，
+    未被取回的结果在 result_ttl 秒后过期。
+    """
+
+    def __init__(self, host: FeedbackHost, session_timeout: float = 3600, result_ttl: float = 3600):
+        self.host = host
+        self.session_timeout = session_timeout
+        self.result_ttl = result_ttl
+        self._sessions: Dict[str, FeedbackSession] = {}
+
+    def start(self, project_directory: str, prompt: str, theme: str) -> str:
+        self._purge_expired()
+        session_id = uuid.uuid4().hex[:12]
+        task = asyncio.create_task(
+            self.host.request(project_directory, prompt, theme, timeout=self.session_timeout)
+        )
+        session = FeedbackSession(session_id, task, FeedbackRound(project_directory, prompt))
+        task.add_done_callback(lambda _: session.mark_finished())
+        self._sessions[session_id] = session
+        return session_id
+
+    def get(self, session_id: str) -> Optional[FeedbackSession]:
+        self._purge_expired()
+        return self._sessions.get(session_id)
+
+    async def wait(self, session_id: str, timeout: float) -> Optional[FeedbackSession]:
+        """等待会话完成，超过 timeout 秒仍未完成时返回而不取消会话"""
+        session = self.get(session_id)
+        if session is None:
+            return None
+        await asyncio.wait({session.task}, timeout=timeout)
+        return session
+
+    def pop(self, session_id: str) -> Optional[FeedbackSession]:
+        return self._sessions.pop(session_id, None)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if session.finished_at is not None and now - session.finished_at > self.result_ttl:
+                session.discard_result()
+                del self._sessions[session_id]
+
+    def cancel_all(self):
+        for session in self._sessions.values():
+            session.task.cancel()
+            session.discard_result()
+        self._sessions.clear()
+
+
+feedback_host = FeedbackHost(os.path.dirname(os.path.abspath(__file__)))
+feedback_sessions = FeedbackSessionTable(feedback_host)
+
+
+@asynccontextmanager
+async def feedback_host_lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """服务器启动时预热常驻反馈界面宿主，退出时关闭它"""
+    await feedback_host.start()
+    try:
+        yield
+    finally:
+        feedback_sessions.cancel_all()
+        await feedback_host.stop()
+
 
 # 创建MCP服务器
 mcp = FastMCP(
     "交互式反馈收集器",
-    dependencies=["PySide6", "pillow"]
+    dependencies=["PySide6", "pillow"],
+    lifespan=feedback_host_lifespan
 )
 
 
+@dataclass
+class ImagePolicy:
+    """
+    图片负载策略：在 base64 编码前缩放并重新编码图片
+
+    可通过环境变量配置：
+        FEEDBACK_IMAGE_MAX_EDGE      长边最大像素，默认 1568
+        FEEDBACK_IMAGE_FORMAT        auto / jpeg / webp / png，默认 auto（按内容选择）
+        FEEDBACK_IMAGE_LOSSY_FORMAT  auto 模式下照片类图片使用的格式，jpeg 或 webp
+        FEEDBACK_IMAGE_QUALITY       有损编码质量 1-100，默认 85
+        FEEDBACK_IMAGE_BUDGET        单次响应所有图片 base64 数据的总字节预算，默认 5 MB
+    """
+
+    max_long_edge: int = 1568
+    format: str = "auto"
+    lossy_format: str = "jpeg"
+    quality: int = 85
+    byte_budget: int = 5 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "ImagePolicy":
+        policy = cls()
+        # 每个变量单独解析，格式不正确的只影响自己
+        policy.max_long_edge = max(1, number_from_env("FEEDBACK_IMAGE_MAX_EDGE", policy.max_long_edge))
+        policy.quality = min(100, max(1, number_from_env("FEEDBACK_IMAGE_QUALITY", policy.quality)))
+        policy.byte_budget = max(1, number_from_env("FEEDBACK_IMAGE_BUDGET", policy.byte_budget))
+        image_format = os.environ.get("FEEDBACK_IMAGE_FORMAT", policy.format).lower()
+        if image_format in ("auto", "jpeg", "webp", "png"):
+            policy.format = image_format
+        lossy_format = os.environ.get("FEEDBACK_IMAGE_LOSSY_FORMAT", policy.lossy_format).lower()
+        if lossy_format in ("jpeg", "webp"):
+            policy.lossy_format = lossy_format
+        return policy
+
+
+# 超出预算时依次尝试的缩放比例
+_POLICY_SCALES = (1.0, 0.75, 0.5, 0.35, 0.25)
+# 无需重新编码即可直接返回的格式
+_PASSTHROUGH_FORMATS = {"JPEG": "jpeg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+_FORMAT_MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png", "gif": "image/gif"}
+
+
+def _base64_size(size: int) -> int:
+    return (size + 2) // 3 * 4
+
+
+def _format_bytes(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f} MB"
+    return f"{size / 1024:.1f} KB"
+
+
+def _choose_image_format(img, policy: ImagePolicy) -> str:
+    """按内容选择编码格式：透明或色彩较少的截图用 PNG，照片类用有损格式"""
+    if policy.format != "auto":
+        return policy.format
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        return "png"
+    sample = img.copy()
+    sample.thumbnail((256, 256))
+    if sample.convert("RGB").getcolors(4096) is not None:
+        return "png"
+    return policy.lossy_format
+
+
+def _encode_pil_image(img, image_format: str, quality: int) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    if image_format == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            # JPEG 不支持透明通道，合成到白色背景上
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            img = background
+        img.save(buffer, "JPEG", quality=quality, optimize=True)
+    elif image_format == "webp":
+        img.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+        img.save(buffer, "PNG", compress_level=6)
+    return buffer.getvalue()
+
+
+# 流式处理图片时每次读取的块大小（3 的倍数，保证分块 base64 可以直接拼接）
+_STREAM_CHUNK_SIZE = 3 * 256 * 1024
+# 从宿主接收的图片超过该大小时落盘，不在内存中整体保留
+IMAGE_SPOOL_THRESHOLD = 1024 * 1024
+
+
+def _image_source(image: dict) -> BinaryIO:
+    """返回定位到开头的图片数据流；data 可以是 bytes 或（临时）文件对象"""
+    data = image['data']
+    if isinstance(data, (bytes, bytearray)):
+        return io.BytesIO(data)
+    data.seek(0)
+    return data
+
+
+def _stream_size(stream: BinaryIO) -> int:
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+
+def _iter_stream_chunks(stream: BinaryIO) -> Iterator[bytes]:
+    stream.seek(0)
+    while True:
+        chunk = stream.read(_STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _base64_from_stream(stream: BinaryIO) -> str:
+    """分块增量 base64 编码，只在内存中保留当前块和已编码的输出"""
+    return "".join(base64.b64encode(chunk).decode('ascii') for chunk in _iter_stream_chunks(stream))
+
+
+def _apply_image_policy(image: dict, policy: ImagePolicy, byte_limit: int) -> dict:
+    """
+    按策略处理单张图片，返回最终数据和尺寸信息
+
+    byte_limit 是这张图片可用的 base64 字节数；原图已满足策略时 data 为原始数据流
+    （不复制），否则逐级缩小尺寸和质量直到满足限制，data 为重新编码后的字节。
+    全部尝试都超出限制时 data 为 None。
+    degraded 表示结果因 byte_limit 而比不限预算时更差（用于判断缓存能否复用）。
+    """
+    source = _image_source(image)
+    original_size = _stream_size(source)
+    processed = {
+        'name': image.get('name', ''),
+        'original_size': original_size,
+        'original_dims': None,
+        'original_format': None,
+        'data': None,
+        'mime_type': image.get('mime_type', 'image/png'),
+        'final_dims': None,
+        'format': None,
+        'degraded': True,
+    }
+
+    try:
+        from PIL import Image, ImageOps
+        # Image.open 只读取文件头，像素数据在真正需要时才解码
+        img = Image.open(source)
+        processed['original_dims'] = img.size
+        processed['original_format'] = img.format
+    except Exception:
+        # 没有 Pillow 或无法解码：在预算内时原样返回
+        if _base64_size(original_size) <= byte_limit:
+            processed.update(data=source, degraded=False)
+        return processed
+
+    width, height = img.size
+    long_edge = max(width, height)
+    source_format = _PASSTHROUGH_FORMATS.get(img.format)
+    passthrough = bool(source_format
+                       and long_edge <= policy.max_long_edge
+                       and policy.format in ("auto", source_format))
+    if passthrough and _base64_size(original_size) <= byte_limit:
+        processed.update(data=source, mime_type=_FORMAT_MIME_TYPES[source_format],
+                         final_dims=img.size, format=source_format, degraded=False)
+        return processed
+
+    target_edge = min(long_edge, policy.max_long_edge)
+    if img.format == "JPEG":
+        # JPEG 可以在解码时直接按目标尺寸降采样
+        img.draft("RGB", (target_edge, target_edge))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    image_format = _choose_image_format(img, policy)
+    formats = [image_format] if image_format != "png" else ["png", policy.lossy_format]
+    qualities = [policy.quality]
+    if policy.quality > 50:
+        qualities.append(max(40, policy.quality - 25))
+
+    first_attempt = not passthrough
+    for scale in _POLICY_SCALES:
+        edge = max(1, int(target_edge * scale))
+        resized = img.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        for candidate_format in formats:
+            for quality in (qualities if candidate_format != "png" else [policy.quality]):
+                encoded = _encode_pil_image(resized, candidate_format, quality)
+                if _base64_size(len(encoded)) <= byte_limit:
+                    processed.update(data=encoded, mime_type=_FORMAT_MIME_TYPES[candidate_format],
+                                     final_dims=resized.size, format=candidate_format,
+                                     degraded=not first_attempt)
+                    return processed
+                first_attempt = False
+
+    return processed
+
+
+class ImagePayloadCache:
+    """
+    按内容寻址的图片负载 LRU 缓存
+
+    键为图片内容的 SHA-256 加上影响编码结果的策略参数，值为最终的 base64 数据，
+    按总字节数淘汰最久未使用的条目。用户在多轮反馈中重复提交同一截图时，
+    无需再次解码、缩放和编码。容量可通过 FEEDBACK_IMAGE_CACHE_BYTES 配置（默认 64 MB）。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[dict, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(data: Union[bytes, BinaryIO], policy: ImagePolicy) -> tuple:
+        if isinstance(data, (bytes, bytearray)):
+            digest = hashlib.sha256(data).digest()
+        else:
+            hasher = hashlib.sha256()
+            for chunk in _iter_stream_chunks(data):
+                hasher.update(chunk)
+            digest = hasher.digest()
+        return (digest, policy.max_long_edge, policy.format, policy.lossy_format, policy.quality)
+
+    def get(self, key: tuple, byte_limit: int) -> Optional[dict]:
+        """
+        查找可直接复用的结果
+
+        条目在 limit 预算下生成；若它没有因预算降级，则对任何能容纳它的预算都有效；
+        若已降级，只在新预算不大于原预算时有效（此时重新处理也会得到同样的结果）。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                processed, limit = entry
+                size = len(processed['base64']) if processed['base64'] is not None else None
+                fits = size is not None and size <= byte_limit
+                if processed['degraded']:
+                    fits = (fits or processed['base64'] is None) and byte_limit <= limit
+                if fits:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return processed
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, processed: dict, byte_limit: int):
+        size = len(processed['base64'] or "")
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0]['base64'] or "")
+            self._entries[key] = (processed, byte_limit)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted['base64'] or "")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._size}
+
+
+def _cache_size_from_env() -> int:
+    try:
+        return int(os.environ.get("FEEDBACK_IMAGE_CACHE_BYTES", 64 * 1024 * 1024))
+    except ValueError:
+        return 64 * 1024 * 1024
+
+
+image_payload_cache = ImagePayloadCache(_cache_size_from_env())
+
+
+def _process_image(image: dict, policy: ImagePolicy, byte_limit: int) -> dict:
+    """按策略处理图片并编码为 base64，优先复用缓存中的结果"""
+    key = ImagePayloadCache.make_key(image['data'], policy)
+    cached = image_payload_cache.get(key, byte_limit)
+    if cached is not None:
+        return dict(cached, name=image.get('name', ''))
+
+    processed = _apply_image_policy(image, policy, byte_limit)
+    processed['sha256'] = key[0].hex()
+    data = processed.pop('data')
+    if data is None:
+        processed['final_size'] = None
+        processed['base64'] = None
+    elif isinstance(data, bytes):
+        processed['final_size'] = len(data)
+        processed['base64'] = base64.b64encode(data).decode('ascii')
+    else:
+        # 原图透传：直接从数据流分块编码，不生成完整的原始字节副本
+        processed['final_size'] = processed['original_size']
+        processed['base64'] = _base64_from_stream(data)
+    image_payload_cache.put(key, processed, byte_limit)
+    return processed
+
+
+def _image_worker_count() -> int:
+    try:
+        return max(1, int(os.environ.get("FEEDBACK_IMAGE_WORKERS", min(4, os.cpu_count() or 1))))
+    except ValueError:
+        return min(4, os.cpu_count() or 1)
+
+
+# 图片解码、缩放和编码主要在 Pillow 的 C 代码中进行并释放 GIL，使用线程池即可并行
+image_worker_pool = ThreadPoolExecutor(max_workers=_image_worker_count(), thread_name_prefix="feedback-image")
+
+
+def _process_image_job(image: dict, policy: ImagePolicy, byte_limit: int) -> Tuple[Optional[dict], Optional[Exception]]:
+    """线程池任务：单张图片的错误只影响它自己的结果"""
+    try:
+        return _process_image(image, policy, byte_limit), None
+    except Exception as e:
+        return None, e
+
+
+def _initial_image_share(images: List[dict], policy: ImagePolicy) -> int:
+    return policy.byte_budget // len(images) if images else 0
+
+
+def _submit_image_jobs(images: List[dict], policy: ImagePolicy, share: int) -> List[Future]:
+    return [image_worker_pool.submit(_process_image_job, image, policy, share) for image in images]
+
+
+def _collect_image_jobs(images: List[dict], policy: ImagePolicy,
+                        futures: List[Future]) -> List[Tuple[Optional[dict], Optional[Exception]]]:
+    """
+    按提交顺序收集结果，并重新分配未用完的预算
+
+    第一轮每张图片并行处理，分到预算的平均份额；之后把未用完的预算平均分给
+    因预算降级或被省略的图片，再并行处理一轮。
+    """
+    outcomes = [future.result() for future in futures]
+
+    used = sum(len(processed['base64'] or "") for processed, error in outcomes if processed)
+    retry = [index for index, (processed, error) in enumerate(outcomes) if processed and processed['degraded']]
+    leftover = policy.byte_budget - used
+    if retry and leftover > 0:
+        extra = leftover // len(retry)
+        retry_futures = {
+            index: image_worker_pool.submit(
+                _process_image_job, images[index], policy,
+                len(outcomes[index][0]['base64'] or "") + extra
+            )
+            for index in retry
+        }
+        for index, future in retry_futures.items():
+            processed, error = future.result()
+            if processed is not None:
+                outcomes[index] = (processed, error)
+
+    return outcomes
+
+
+def _describe_processed_image(processed: dict) -> str:
+    original = _format_bytes(processed['original_size'])
+    if processed['original_dims']:
+        width, height = processed['original_dims']
+        original = f"{width}x{height} {processed['original_format']} {original}"
+    if processed['base64'] is None:
+        return f"{processed['name']}: {original} → 超出字节预算，已省略"
+    final = _format_bytes(processed['final_size'])
+    if processed['final_dims']:
+        width, height = processed['final_dims']
+        final = f"{width}x{height} {processed['format'].upper()} {final}"
+    return f"{processed['name']}: {original} → {final}"
+
+
+@dataclass
+class LogPolicy:
+    """
+    命令日志返回策略：用户在界面中运行的命令输出按字节预算摘要后返回
+
+    日志在预算内时原样返回；超出预算时先合并重复和相似的行，仍超出时依次保留
+    错误行及其上下文、开头和结尾，中间注明省略的行号范围。可通过环境变量配置：
+        FEEDBACK_LOG_BUDGET             返回的日志文本的字节预算，默认 32 KB
+        FEEDBACK_LOG_ATTACH             日志被摘要时是否附带 gzip + base64 的完整日志，默认 0
+        FEEDBACK_LOG_ATTACHMENT_BUDGET  附件 base64 数据的字节上限，默认 1 MB
+    """
+
+    byte_budget: int = 32 * 1024
+    attach_full_log: bool = False
+    attachment_budget: int = 1024 * 1024
+
+    @classmethod
+    def from_env(cls) -> "LogPolicy":
+        policy = cls()
+        policy.byte_budget = max(1024, number_from_env("FEEDBACK_LOG_BUDGET", policy.byte_budget))
+        policy.attachment_budget = max(1, number_from_env("FEEDBACK_LOG_ATTACHMENT_BUDGET", policy.attachment_budget))
+        policy.attach_full_log = os.environ.get("FEEDBACK_LOG_ATTACH", "0").lower() in ("1", "true", "yes")
+        return policy
+
+
+_LOG_DIGITS = re.compile(r"\d+")
+_LOG_ERROR_LINE = re.compile(
+    r"\b(error|errors|fatal|failed|failure|exception|traceback|panic|segmentation fault|undefined reference)\b"
+    r"|错误|失败|异常",
+    re.IGNORECASE,
+)
+# 统计类的“0 errors”“0 failed”不算错误
+_LOG_ZERO_COUNT = re.compile(r"\b0 (errors?|failed|failures?)\b", re.IGNORECASE)
+# 错误行前后保留的上下文行数
+_LOG_ERROR_CONTEXT = (1, 2)
+# 超出预算时各部分占预算的比例：错误行、开头，其余给结尾
+_LOG_ERROR_SHARE = 0.4
+_LOG_HEAD_SHARE = 0.2
+
+
+def _is_log_error_line(text: str) -> bool:
+    return bool(_LOG_ERROR_LINE.search(text)) and not _LOG_ZERO_COUNT.search(text)
+
+
+def _collapse_log_lines(lines: List[str]) -> List[Tuple[int, str]]:
+    """
+    合并连续的重复行和只有数字不同的相似行（进度、下载计数等）
+
+    返回 (原始行号, 文本) 列表：完全相同的连续行保留一行并注明重复次数，
+    三行以上的相似行只保留首尾两行。错误行只合并完全相同的重复，
+    不会被当作相似行省略（例如 FAILED test_2 和 FAILED test_7 都要保留）。
+    """
+    collapsed = []
+    keys = [line if _is_log_error_line(line) else _LOG_DIGITS.sub("#", line) for line in lines]
+    start = 0
+    while start < len(lines):
+        end = start + 1
+        while end < len(lines) and keys[end] == keys[start]:
+            end += 1
+        run = end - start
+        if run == 1:
+            collapsed.append((start + 1, lines[start]))
+        elif lines[start] == lines[end - 1] and len(set(lines[start:end])) == 1:
+            collapsed.append((start + 1, f"{lines[start]}  [重复 {run} 次]"))
+        elif run == 2:
+            collapsed.append((start + 1, lines[start]))
+            collapsed.append((start + 2, lines[start + 1]))
+        else:
+            collapsed.append((start + 1, lines[start]))
+            collapsed.append((start + 2, f"... [省略 {run - 2} 条相似的行]"))
+            collapsed.append((end, lines[end - 1]))
+        start = end
+    return collapsed
+
+
+def _error_line_indexes(entries: List[Tuple[int, str]]) -> List[int]:
+    """错误行及其上下文在 entries 中的下标（有序、去重）；Traceback 保留到异常所在行"""
+    selected = set()
+    before, after = _LOG_ERROR_CONTEXT
+    index = 0
+    while index < len(entries):
+        text = entries[index][1]
+        if not _is_log_error_line(text):
+            index += 1
+            continue
+        end = index + after
+        if text.startswith("Traceback"):
+            # 调用栈各行都有缩进，第一条没有缩进的行是异常本身
+            end = index + 1
+            while end < len(entries) and entries[end][1][:1] in (" ", "\t"):
+                end += 1
+        selected.update(range(max(0, index - before), min(len(entries), end + 1)))
+        index = end + 1 if text.startswith("Traceback") else index + 1
+    return sorted(selected)
+
+
+def _take_log_lines(entries: List[Tuple[int, str]], budget: int, from_end: bool = False,
+                    numbered: bool = False) -> List[Tuple[int, str]]:
+    """从开头（或结尾）按字节预算取整行，超长的单行截断"""
+    taken = []
+    used = 0
+    for line_number, text in (reversed(entries) if from_end else entries):
+        line = f"L{line_number}: {text}" if numbered else text
+        size = len(line.encode("utf-8")) + 1
+        if used + size > budget:
+            if not taken and budget > 64:
+                # 单行就超出预算（如压缩过的 JS），保留能放下的部分
+                line = line.encode("utf-8")[:budget - 32].decode("utf-8", "ignore") + " ...[行已截断]"
+                taken.append((line_number, line))
+            break
+        taken.append((line_number, line))
+        used += size
+    if from_end:
+        taken.reverse()
+    return taken
+
+
+def _join_log_section(entries: List[Tuple[int, str]]) -> str:
+    """拼接一段日志，行号不连续处注明省略"""
+    lines = []
+    previous = None
+    for line_number, text in entries:
+        if previous is not None and line_number > previous + 1:
+            lines.append(f"... [省略第 {previous + 1}-{line_number - 1} 行]")
+        lines.append(text)
+        previous = line_number
+    return "\n".join(lines)
+
+
+def _summarize_command_logs(logs: str, policy: LogPolicy) -> Tuple[str, bool]:
+    """按策略摘要命令日志，返回 (文本, 是否被摘要)"""
+    # 进度条用 \r 原地刷新，只保留每行最后的状态
+    lines = [line.rsplit("\r", 1)[-1] for line in logs.rstrip("\n").split("\n")]
+    total_bytes = len(logs.encode("utf-8"))
+    header = f"命令输出（共 {len(lines)} 行，{_format_bytes(total_bytes)}）"
+
+    full_text = "\n".join(lines)
+    if len(full_text.encode("utf-8")) <= policy.byte_budget:
+        return f"{header}：\n{full_text}", False
+
+    entries = _collapse_log_lines(lines)
+    full_text = "\n".join(text for _, text in entries)
+    if len(full_text.encode("utf-8")) <= policy.byte_budget:
+        return f"{header}，已合并重复和相似的行：\n{full_text}", True
+
+    # 预留标题和分隔行占用的字节
+    budget = policy.byte_budget - 256
+    sections = []
+    error_indexes = _error_line_indexes(entries)
+    if error_indexes:
+        errors = _take_log_lines([entries[i] for i in error_indexes], int(budget * _LOG_ERROR_SHARE), numbered=True)
+        sections.append(f"== 错误相关的行（{len(errors)}/{len(error_indexes)}）==\n" + _join_log_section(errors))
+        budget -= sum(len(text.encode("utf-8")) + 1 for _, text in errors)
+
+    head = _take_log_lines(entries, int(policy.byte_budget * _LOG_HEAD_SHARE))
+    remaining = budget - sum(len(text.encode("utf-8")) + 1 for _, text in head)
+    tail = _take_log_lines(entries[len(head):], remaining, from_end=True)
+    sections.append("== 开头与结尾 ==\n" + _join_log_section(head + tail))
+
+    summary = f"{header}，超出 {_format_bytes(policy.byte_budget)} 预算，以下为摘要：\n" + "\n\n".join(sections)
+    return summary, True
+
+
+def _build_log_items(logs: str, policy: Optional[LogPolicy] = None) -> List[Union[TextContent, EmbeddedResource]]:
+    """把命令日志转换为 MCP 内容：预算内的文本摘要，以及可选的完整日志压缩附件"""
+    policy = policy or LogPolicy.from_env()
+    if not logs.strip():
+        return []
+    summary, truncated = _summarize_command_logs(logs, policy)
+    items = [TextContent(type="text", text=summary)]
+    if not (truncated and policy.attach_full_log):
+        return items
+
+    compressed = gzip.compress(logs.encode("utf-8"), compresslevel=6)
+    if _base64_size(len(compressed)) > policy.attachment_budget:
+        items.append(TextContent(
+            type="text",
+            text=f"完整日志压缩后 {_format_bytes(len(compressed))}，超出附件预算 {_format_bytes(policy.attachment_budget)}，未附带"
+        ))
+        return items
+    items.append(EmbeddedResource(
+        type="resource",
+        resource=BlobResourceContents(
+            uri=f"feedback://command-logs/{datetime.now().strftime('%Y%m%d-%H%M%S')}.log.gz",
+            mimeType="application/gzip",
+            blob=base64.b64encode(compressed).decode("ascii"),
+        ),
+    ))
+    return items
+
+
+def _describe_command_stats(stats: dict) -> str:
+    """用户在界面中运行的命令的资源占用概况"""
+    if stats.get('exit_code') is None:
+        status = "未正常结束（被停止或提交时仍在运行）"
+    else:
+        status = f"退出代码 {stats['exit_code']}"
+    wall_time = stats.get('wall_time', 0.0)
+    cpu_time = stats.get('cpu_time', 0.0)
+    utilization = f"，平均占用 {cpu_time / wall_time:.0%} CPU" if wall_time > 0 else ""
+    return (
+        f"命令性能概况：{stats.get('command', '')}\n"
+        f"状态：{status}\n"
+        f"运行时长：{wall_time:.2f} 秒\n"
+        f"CPU 时间：{cpu_time:.2f} 秒{utilization}\n"
+        f"内存峰值：{_format_bytes(stats.get('peak_rss', 0))}\n"
+        f"子进程峰值：{stats.get('max_children', 0)} 个\n"
+        f"采样次数：{stats.get('samples', 0)}"
+    )
+
+
+def _build_feedback_items(feedback_result: dict, policy: Optional[ImagePolicy] = None,
+                          log_policy: Optional[LogPolicy] = None,
+                          feedback_round: Optional[FeedbackRound] = None) -> List[Union[TextContent, ImageContent, EmbeddedResource]]:
+    """把反馈界面的结果转换为 MCP 内容对象列表；给出 feedback_round 时同时写入反馈归档"""
+    policy = policy or ImagePolicy.from_env()
+
+    # 先把图片提交到线程池，文字内容在图片处理的同时构建
+    images = feedback_result.get('images', [])
+    pending_images = _submit_image_jobs(images, policy, _initial_image_share(images, policy))
+
+    # 构建返回内容列表
+    feedback_items = []
+
+    # 获取当前时间戳
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # 添加文字反馈
+    text_feedback = feedback_result.get('text_feedback', '').strip()
+    if text_feedback:
+        feedback_items.append(TextContent(
+            type="text",
+            text=f"用户文字反馈：{text_feedback}\n提交时间：{timestamp}"
+        ))
+
+    # 添加用户在界面中运行的命令的输出（按字节预算摘要）和资源占用
+    log_items = _build_log_items(feedback_result.get('command_logs', ''), log_policy)
+    feedback_items.extend(log_items)
+    command_stats = feedback_result.get('command_stats')
+    if command_stats:
+        feedback_items.append(TextContent(type="text", text=_describe_command_stats(command_stats)))
+
+    # 添加图片反馈：图片在线程池中并行缩放、重新编码，结果按原顺序排列
+    try:
+        outcomes = _collect_image_jobs(images, policy, pending_images)
+    finally:
+        # 释放所有图片的临时数据
+        for image in images:
+            if hasattr(image['data'], 'close'):
+                image['data'].close()
+
+    # 宿主无法读取的图片（被删除或没有权限）没有随结果发送
+    for image_error in feedback_result.get('image_errors', []):
+        feedback_items.append(TextContent(
+            type="text",
+            text=f"图片加载失败 ({image_error.get('name', '')}): {image_error.get('error', '')}"
+        ))
+
+    image_report = []
+    image_hashes = []
+    for image, (processed, error) in zip(images, outcomes):
+        if error is not None:
+            # 如果图片处理失败，添加错误信息
+            feedback_items.append(TextContent(
+                type="text",
+                text=f"图片加载失败 ({image.get('name', '')}): {str(error)}"
+            ))
+            continue
+
+        image_report.append(_describe_processed_image(processed))
+        image_hashes.append(processed['sha256'])
+        if processed['base64'] is None:
+            continue
+
+        feedback_items.append(ImageContent(
+            type="image",
+            data=processed['base64'],
+            mimeType=processed['mime_type']
+        ))
+
+    if image_report:
+        cache_stats = image_payload_cache.stats()
+        image_report.append(f"缓存命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次")
+        feedback_items.append(TextContent(
+            type="text",
+            text="图片处理（原始 → 最终）：\n" + "\n".join(image_report)
+        ))
+
+    # 如果没有任何反馈内容，添加默认信息
+    if not feedback_items:
+        feedback_items.append(TextContent(
+            type="text",
+            text=f"用户未提供反馈内容\n提交时间：{timestamp}"
+        ))
+
+    if feedback_round is not None:
+        # 归档的是返回给 AI 的日志摘要，而不是完整日志；归档失败不影响本轮反馈的返回
+        try:
+            get_feedback_store().record_feedback(
+                os.path.normpath(feedback_round.project_directory), feedback_round.prompt, text_feedback,
+                log_items[0].text if log_items else "", image_hashes, command_stats,
+                feedback_round.started_at, feedback_round.duration,
+            )
+        except Exception as e:
+            print(f"归档反馈失败: {e}", file=sys.stderr)
+
+    return feedback_items
+
+
+def _normalize_feedback_args(project_directory: str, summary: str, theme: str) -> Tuple[str, str, str]:
+    """补全项目目录、汇报内容和主题参数的默认值"""
+    # 如果没有指定项目目录，使用当前工作目录
+    if not project_directory:
+        project_directory = os.getcwd()
+
+    # 确保项目目录存在
+    if not os.path.exists(project_directory):
+        project_directory = os.getcwd()
+
+    # 验证主题参数
+    if theme not in ['light', 'dark']:
+        theme = 'light'
+
+    return project_directory, summary or "AI助手工作完成，请提供反馈。", theme
+
+
 @mcp.tool()
-def interactive_feedback(project_directory: str = "", summary: str = "", theme: str = "light") -> List[Union[TextContent, ImageContent]]:
+async def interactive_feedback(project_directory: str = "", summary: str = "", theme: str = "light") -> List[Union[TextContent, ImageContent, EmbeddedResource]]:
     """
     启动交互式反馈界面，收集用户的文字和图片反馈。
     使用PySide6界面，支持明亮和暗黑主题。
@@ -38,132 +1053,147 @@ def interactive_feedback(project_directory: str = "", summary: str = "", theme:
         包含用户反馈内容的列表，可能包含文本和图片内容对象
     """
     try:
-        # 如果没有指定项目目录，使用当前工作目录
-        if not project_directory:
-            project_directory = os.getcwd()
-        
-        # 确保项目目录存在
-        if not os.path.exists(project_directory):
-            project_directory = os.getcwd()
-            
-        # 验证主题参数
-        if theme not in ['light', 'dark']:
-            theme = 'light'
-            
-        # 构建命令
-        script_path = os.path.join(os.path.dirname(__file__), 'feedback_ui.py')
-        cmd = [
-            sys.executable, script_path,
-            '--project-directory', project_directory,
-            '--prompt', summary or "AI助手工作完成，请提供反馈。",
-            '--theme', theme
-        ]
-        
-        # 创建临时文件保存结果
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_file:
-            temp_output = temp_file.name
-            cmd.extend(['--output-file', temp_output])
-        
+        project_directory, prompt, theme = _normalize_feedback_args(project_directory, summary, theme)
+        feedback_round = FeedbackRound(project_directory, prompt)
+
         try:
-            # 运行反馈界面
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-            
-            # 检查是否成功创建了输出文件
-            if os.path.exists(temp_output):
-                with open(temp_output, 'r', encoding='utf-8') as f:
-                    feedback_result = json.load(f)
-                    
-                # 清理临时文件
-                os.unlink(temp_output)
-                
-                # 解析反馈内容
-                interactive_feedback_str = feedback_result.get('interactive_feedback', '{}')
-                try:
-                    feedback_data = json.loads(interactive_feedback_str)
-                except json.JSONDecodeError:
-                    feedback_data = {}
-                
-                # 构建返回内容列表
-                feedback_items = []
-                
-                # 获取当前时间戳
-                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # 添加文字反馈
-                text_feedback = feedback_data.get('text_feedback', '').strip()
-                if text_feedback:
-                    feedback_items.append(TextContent(
-                        type="text",
-                        text=f"用户文字反馈：{text_feedback}\n提交时间：{timestamp}"
-                    ))
-                
-                # 添加图片反馈
-                images = feedback_data.get('images', [])
-                if images:
-                    for image_path in images:
-                        try:
-                            if os.path.exists(image_path):
-                                # 读取图片文件
-                                with open(image_path, 'rb') as img_file:
-                                    image_data = img_file.read()
-                                
-                                # 将图片数据编码为 base64
-                                base64_data = base64.b64encode(image_data).decode('utf-8')
-                                
-                                # 根据文件扩展名确定格式
-                                file_ext = Path(image_path).suffix.lower()
-                                if file_ext in ['.jpg', '.jpeg']:
-                                    media_type = 'image/jpeg'
-                                elif file_ext == '.png':
-                                    media_type = 'image/png'
-                                elif file_ext == '.gif':
-                                    media_type = 'image/gif'
-                                elif file_ext in ['.bmp']:
-                                    media_type = 'image/bmp'
-                                else:
-                                    media_type = 'image/png'  # 默认为 PNG
-                                
-                                feedback_items.append(ImageContent(
-                                    type="image",
-                                    data=base64_data,
-                                    mimeType=media_type
-                                ))
-                                
-                        except Exception as e:
-                            # 如果图片读取失败，添加错误信息
-                            feedback_items.append(TextContent(
-                                type="text",
-                                text=f"图片加载失败 ({os.path.basename(image_path)}): {str(e)}"
-                            ))
-                
-                # 如果没有任何反馈内容，添加默认信息
-                if not feedback_items:
-                    feedback_items.append(TextContent(
-                        type="text",
-                        text=f"用户未提供反馈内容\n提交时间：{timestamp}"
-                    ))
-                
-                return feedback_items
-            else:
-                # 如果没有输出文件，表示用户可能取消了
-                return []
-                
-        except subprocess.TimeoutExpired:
-            # 清理临时文件
-            if os.path.exists(temp_output):
-                os.unlink(temp_output)
+            # 在常驻宿主中显示反馈界面
+            feedback_result = await feedback_host.request(project_directory, prompt, theme, timeout=600)
+        except asyncio.TimeoutError:
             raise Exception("反馈界面超时（10分钟）")
-            
         except Exception as e:
-            # 清理临时文件
-            if os.path.exists(temp_output):
-                os.unlink(temp_output)
             raise Exception(f"启动反馈界面失败: {str(e)}")
+
+        if feedback_result is None:
+            # 没有结果，表示用户可能取消了
+            return []
+
+        feedback_round.finish()
+        return await asyncio.to_thread(_build_feedback_items, feedback_result, None, None, feedback_round)
             
     except Exception as e:
         return []
 
 
+@mcp.tool()
+def start_feedback(project_directory: str = "", summary: str = "", theme: str = "light") -> str:
+    """
+    在后台打开反馈界面并立即返回会话 ID，不等待用户操作。
+    之后用 poll_feedback 查询状态，或用 await_feedback 等待结果。
+
+    Args:
+        project_directory: 项目目录路径，默认为当前工作目录
+        summary: AI工作汇报内容
+        theme: 界面主题，'light'(明亮)或'dark'(暗黑)，默认明亮主题
+
+    Returns:
+        反馈会话 ID
+    """
+    project_directory, prompt, theme = _normalize_feedback_args(project_directory, summary, theme)
+    return feedback_sessions.start(project_directory, prompt, theme)
+
+
+@mcp.tool()
+def poll_feedback(session_id: str) -> str:
+    """
+    查询反馈会话状态，立即返回。
+
+    Args:
+        session_id: start_feedback 返回的会话 ID
+
+    Returns:
+        pending（等待用户）、completed（可用 await_feedback 取回）、
+        cancelled（超时或被取消）、failed（界面启动失败）或 unknown（不存在或已过期）
+    """
+    session = feedback_sessions.get(session_id)
+    return session.status if session else "unknown"
+
+
+@mcp.tool()
+async def await_feedback(session_id: str, timeout_seconds: float = 300) -> List[Union[TextContent, ImageContent, EmbeddedResource]]:
+    """
+    等待反馈会话完成并取回结果，最多等待 timeout_seconds 秒。
+    超时不会关闭反馈窗口，可以再次调用继续等待。结果取回后会话即被删除。
+
+    Args:
+        session_id: start_feedback 返回的会话 ID
+        timeout_seconds: 本次调用最长等待秒数，默认 300 秒
+
+    Returns:
+        用户反馈内容列表；会话仍在进行时返回一条说明状态的文本
+    """
+    session = await feedback_sessions.wait(session_id, max(0.0, timeout_seconds))
+    if session is None:
+        return [TextContent(type="text", text=f"反馈会话不存在或已过期: {session_id}")]
+
+    status = session.status
+    if status == "pending":
+        elapsed = time.monotonic() - session.started_at
+        return [TextContent(
+            type="text",
+            text=f"反馈会话 {session_id} 仍在等待用户（已等待 {elapsed:.0f} 秒），请稍后再次调用 await_feedback"
+        )]
+
+    feedback_sessions.pop(session_id)
+    if status == "cancelled":
+        return [TextContent(type="text", text=f"反馈会话 {session_id} 已超时或被取消")]
+    if status == "failed":
+        return [TextContent(type="text", text=f"启动反馈界面失败: {session.task.exception()}")]
+
+    if session.task.result() is None:
+        return []
+    # shield：本次调用被取消时转换仍然完成，其他等待同一会话的调用照常取回
+    return await asyncio.shield(session.feedback_items())
+
+
+_ARCHIVE_COLUMN_LABELS = {"prompt": "汇报", "feedback": "反馈", "command_logs": "命令输出"}
+
+
+def _format_feedback_history(results: List[dict], elapsed: float) -> str:
+    """把反馈归档的搜索结果格式化为文本"""
+    lines = [f"找到 {len(results)} 条相关的历史反馈（查询用时 {elapsed * 1000:.1f} ms）："]
+    for rank, result in enumerate(results, 1):
+        details = [datetime.fromtimestamp(result['started_at']).strftime("%Y-%m-%d %H:%M"), result['project'],
+                   f"用户用时 {result['duration']:.0f} 秒"]
+        if result['image_hashes']:
+            details.append(f"图片 {len(result['image_hashes'])} 张")
+        if result['command_stats']:
+            details.append(f"命令退出码 {result['command_stats'].get('exit_code')}")
+        lines.append("")
+        lines.append(f"{rank}. " + " · ".join(details))
+        for column, snippet in result['snippets'].items():
+            snippet = " ".join(snippet.split())
+            lines.append(f"   {_ARCHIVE_COLUMN_LABELS[column]}：{snippet}")
+    return "\n".join(lines)
+
+
+@mcp.tool()
+def search_feedback_history(query: str, project: str = "", limit: int = 10) -> str:
+    """
+    在以往各轮交互式反馈的归档中全文搜索，回忆用户之前说过的话。
+    归档包含 AI 的汇报内容、用户的文字反馈和返回过的命令输出摘要。
+
+    Args:
+        query: 搜索词，多个词用空格分隔，结果需包含全部搜索词
+        project: 只搜索该项目目录下的反馈，默认搜索所有项目
+        limit: 最多返回的条数，默认 10
+
+    Returns:
+        按相关度排序的历史反馈及匹配处的摘录（以 ** 标出）
+    """
+    if not query.strip():
+        return "请提供搜索词"
+    start = time.perf_counter()
+    try:
+        project = os.path.normpath(project) if project else None
+        results = get_feedback_store().search_feedback(query, project, max(1, min(limit, 50)))
+    except Exception as e:
+        return f"搜索反馈历史失败: {str(e)}"
+    if not results:
+        return f"没有找到包含“{query}”的历史反馈"
+    return _format_feedback_history(results, time.perf_counter() - start)
+
+
 @mcp.tool()
 def get_image_info(image_path: str) -> str:
     """
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+测试命令历史：运行记录写入数据库，按 frecency 跨项目排序；
+前缀、词前缀和模糊匹配三种补全，数万条历史下每次查询低于 1 毫秒；命令输入框弹出补全
+"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ["INTERACTIVE_FEEDBACK_HOME"] = tempfile.mkdtemp()
+
+import command_history
+from command_history import CommandHistoryIndex, HistoryEntry
+from feedback_store import FeedbackStore
+
+HISTORY_SIZE = 50_000
+
+
+def make_history(size: int = HISTORY_SIZE) -> list[HistoryEntry]:
+    """生成 size 条不重复的命令，运行次数和最近使用时间随机"""
+    random.seed(0)
+    tools = ["npm run", "yarn", "pnpm", "cargo", "go", "python -m", "pytest", "make", "docker compose",
+             "git", "kubectl", "uv run", "node", "bash"]
+    verbs = ["build", "test", "lint", "dev", "start", "check", "fmt", "clippy", "install", "up -d",
+             "logs -f", "status", "push", "apply -f k8s/", "serve"]
+    now = time.time()
+    commands: dict[str, HistoryEntry] = {}
+    while len(commands) < size:
+        argument = random.choice(["", "--watch", "-v", "--release", f"tests/test_{random.randint(0, 3000)}.py",
+                                  f"packages/app-{random.randint(0, 500)}", f"-k test_{random.randint(0, 9999)}"])
+        command = f"{random.choice(tools)} {random.choice(verbs)} {argument}".strip()
+        if command in commands:
+            command += f" --port {random.randint(1000, 9999)}"
+        commands[command] = HistoryEntry(command=command, project=f"/src/project_{len(commands) % 40}",
+                                         count=random.randint(1, 20), last_used=now - random.random() * 60 * 86400,
+                                         successes=1)
+    return list(commands.values())
+
+
+def test_record_and_load():
+    """运行记录按命令汇总：次数、成功次数、最近一次运行的项目"""
+    path = os.path.join(tempfile.mkdtemp(), "feedback.db")
+    store = FeedbackStore(path)
+    store.record_command("/src/a", "make test", 0, 1.5, started_at=100.0)
+    store.record_command("/src/b", "make test", 2, 0.5, started_at=200.0)
+    store.record_command("/src/a", "make lint", None, 3.0, started_at=150.0)
+    store.close()
+
+    rows = {row["command"]: row for row in FeedbackStore(path).load_command_history()}
+    assert rows["make test"] == {"command": "make test", "project": "/src/b", "count": 2,
+                                 "last_used": 200.0, "successes": 1}
+    assert rows["make lint"]["successes"] == 0
+    print("✅ 命令运行记录写入数据库并按命令汇总")
+
+
+def test_matching_and_ranking():
+    """前缀匹配在前，其次是词前缀和模糊匹配，同组内按 frecency 排序"""
+    now = time.time()
+    index = CommandHistoryIndex([
+        HistoryEntry(command="npm run build", project="/a", count=3, last_used=now - 60, successes=3),
+        HistoryEntry(command="npm run build:prod", project="/b", count=10, last_used=now - 40 * 86400, successes=10),
+        HistoryEntry(command="pytest tests/test_parser.py -x", project="/a", count=2, last_used=now, successes=1),
+        HistoryEntry(command="docker compose up -d", project="/c", count=1, last_used=now, successes=1),
+    ], now=now)
+    # 3 次 × 最近一小时（×4）高于 10 次 × 一个月前（×0.25）
+    assert index.search("npm") == ["npm run build", "npm run build:prod"]
+    assert index.search("test pars") == ["pytest tests/test_parser.py -x"]
+    assert index.search("dcud") == ["docker compose up -d"]
+    assert index.search("dckrcmpsup") == []  # 超过 FUZZY_MAX_CHARS 的输入不做模糊匹配
+    assert index.search("  ") == [] and index.search("zzz") == []
+
+    index.add("npm run build:prod", "/a", now, 0)
+    index.add("npm test", "/d", now, 1)
+    assert index.search("npm run") == ["npm run build:prod", "npm run build"]  # 刚运行过，排名上升
+    assert index.search("npm t") == ["npm test"]
+    assert index.search("nt")[0] == "npm test"
+    print("✅ 匹配分组和 frecency 排序正确")
+
+
+def test_lookup_benchmark():
+    """数万条历史中每次查询（含模糊匹配和没有结果的查询）都低于 1 毫秒"""
+    # 300 条共享前缀 “zz” 但很久以前只运行过一次的命令：前缀匹配很多，却都排在最后
+    history = make_history()
+    rare = [HistoryEntry(command=f"zz task-{i}", project="/src/rare", count=1, last_used=time.time() - 365 * 86400,
+                         successes=1) for i in range(300)]
+    start = time.perf_counter()
+    index = CommandHistoryIndex(history + rare)
+    print(f"📊 {len(index)} 条命令构建索引用时 {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    queries = ["n", "npm run b", "nrb", "cargo cl", "zzz", "zz", "pytest tests/test_2999", "kdq",
+               "test_2999", "test 29", "dcud", "npm clippy", "docker push --release"]
+    worst = 0.0
+    for query in queries:
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            index.search(query)
+            timings.append(time.perf_counter() - start)
+        median = sorted(timings)[len(timings) // 2]
+        worst = max(worst, median)
+        print(f"📊 {query!r:26} {median * 1000:.3f} ms")
+    assert index.search("cargo cl")[0].startswith("cargo clippy")
+    assert all("test_2999" in command for command in index.search("test_2999"))
+    assert len(index.search("zz")) == 10 and all(command.startswith("zz task-") for command in index.search("zz"))
+    assert worst < 0.001, f"最慢的查询用时 {worst * 1000:.2f} ms"
+    print("✅ 所有查询低于 1 毫秒")
+
+
+def test_completer_in_command_entry():
+    """运行过的命令在输入时出现在补全列表中，索引在第一次输入时于后台构建"""
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication()
+    from feedback_ui import FeedbackUI
+
+    def run_until(condition, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+        assert condition(), "等待超时"
+
+    command_history._index = None
+    ui = FeedbackUI(tempfile.mkdtemp(), "测试命令补全", dark_theme=True)
+    ui._ensure_command_section().setVisible(True)
+    ui.show()
+
+    command = f'"{sys.executable}" -c "print(42)"'
+    ui.command_entry.setText(command)
+    ui._run_command()
+    run_until(lambda: ui.process is None)
+
+    ui.command_entry.setText('"')
+    ui.command_entry.textEdited.emit('"')
+    run_until(lambda: command_history.loaded_command_history() is not None)
+    run_until(lambda: ui.completion_model.stringList() == [command])
+
+    # 索引构建后运行的命令直接加入索引
+    second = f'"{sys.executable}" -c "print(43)"'
+    ui.command_entry.setText(second)
+    ui._run_command()
+    run_until(lambda: ui.process is None)
+    ui._update_command_completions("print 43")
+    assert ui.completion_model.stringList() == [second]
+    ui.close()
+    print("✅ 命令输入框从历史中补全")
+
+
+if __name__ == "__main__":
+    test_record_and_load()
+    test_matching_and_ranking()
+    test_lookup_benchmark()
+    test_completer_in_command_entry()
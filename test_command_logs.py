@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+测试命令日志返回流水线：重复行合并、错误行提取、开头/结尾窗口、字节预算和完整日志压缩附件
+"""
+
+import os
+import sys
+import gzip
+import base64
+import random
+import time
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from server import LogPolicy, _build_feedback_items, _build_log_items
+
+
+def make_build_log(lines: int = 50_000) -> str:
+    """生成一段很长的构建日志：进度条、重复行、一处编译错误和一个 Python 调用栈"""
+    random.seed(0)
+    words = "compiling linking module object symbol resolve optimize emit".split()
+    output = ["$ make -j8"]
+    output += [f"Downloading dependency {i}/2000\r" + f"Downloaded dependency {i}/2000" for i in range(2000)]
+    output += ["warning: unused variable 'tmp'"] * 500
+    output += [" ".join(random.choice(words) for _ in range(10)) for _ in range(lines)]
+    output[len(output) - lines // 2] = "src/parser.c:120:7: error: expected ';' before '}' token"
+    output += [
+        "Traceback (most recent call last):",
+        '  File "tools/gen.py", line 42, in <module>',
+        "    main()",
+        "KeyError: 'target'",
+        "0 errors, 12 warnings",
+        "进程已退出，代码: 2",
+    ]
+    return "\n".join(output) + "\n"
+
+
+def test_small_log_returned_verbatim():
+    """预算内的日志原样返回，不附带压缩文件"""
+    logs = "$ pytest -q\n....\n4 passed in 0.12s\n进程已退出，代码: 0\n"
+    items = _build_log_items(logs, LogPolicy(attach_full_log=True))
+    assert len(items) == 1
+    assert items[0].text.endswith("4 passed in 0.12s\n进程已退出，代码: 0")
+    assert _build_log_items("  \n", LogPolicy()) == []
+    print("✅ 小日志原样返回")
+
+
+def test_repeated_lines_collapsed():
+    """超出预算时连续重复的行注明次数，只有数字不同的相似行只保留首尾"""
+    logs = "start\n" + "retrying...\n" * 100 + "".join(f"step {i} of 300\n" for i in range(300)) + "done\n"
+    text = _build_log_items(logs, LogPolicy(byte_budget=2048))[0].text
+    assert "已合并重复和相似的行" in text
+    assert "retrying...  [重复 100 次]" in text
+    assert "step 0 of 300\n... [省略 298 条相似的行]\nstep 299 of 300" in text
+    assert text.endswith("done")
+    print("✅ 重复行和相似行被合并")
+
+
+def test_similar_error_lines_kept():
+    """预算内的相似行不合并；超出预算需要合并时，只有数字不同的错误行也不会被省略"""
+    failures = [f"FAILED tests/test_app.py::test_{i} - AssertionError" for i in (1, 2, 7, 9)]
+    logs = "$ pytest -q\n" + "\n".join(failures) + "\n4 failed in 0.31s\n"
+    text = _build_log_items(logs, LogPolicy())[0].text
+    assert text.endswith(logs.rstrip("\n")) and "省略" not in text
+
+    padding = "".join(f"collecting item {i}\n" for i in range(300))
+    text = _build_log_items(padding + logs, LogPolicy(byte_budget=2048))[0].text
+    assert "已合并重复和相似的行" in text
+    for failure in failures:
+        assert failure in text
+    print("✅ 相似的错误行都被保留")
+
+
+def test_large_log_within_budget():
+    """超大日志按预算摘要：错误行及上下文、开头和结尾都保留，注明省略的行号"""
+    logs = make_build_log()
+    policy = LogPolicy(byte_budget=16 * 1024)
+    start = time.perf_counter()
+    items = _build_log_items(logs, policy)
+    elapsed = time.perf_counter() - start
+    text = items[0].text
+    size = len(text.encode("utf-8"))
+
+    print(f"📊 {len(logs.encode('utf-8')) / 1024 / 1024:.1f} MB 日志摘要为 {size / 1024:.1f} KB，用时 {elapsed * 1000:.0f} ms")
+    assert size <= policy.byte_budget
+    assert "超出 16.0 KB 预算" in text
+    assert "error: expected ';' before '}' token" in text
+    assert "KeyError: 'target'" in text and '  File "tools/gen.py", line 42' in text
+    assert f"L{1 + 2000 + 500 + 50_000 // 2 + 1}: src/parser.c:120:7: error" in text  # 行号对应原始日志
+    assert text.split("== 开头与结尾 ==\n")[1].startswith("$ make -j8\nDownloaded dependency 0/2000")
+    assert text.endswith("进程已退出，代码: 2")
+    assert "... [省略第" in text
+    assert "0 errors, 12 warnings" not in text.split("== 开头与结尾 ==")[0]
+    assert len(items) == 1
+    print("✅ 超大日志按预算摘要")
+
+
+def test_full_log_attachment():
+    """开启附件时完整日志以 gzip + base64 附带，超出附件预算时只给出说明"""
+    logs = make_build_log(20_000)
+    items = _build_log_items(logs, LogPolicy(byte_budget=8 * 1024, attach_full_log=True))
+    assert len(items) == 2
+    resource = items[1].resource
+    assert resource.mimeType == "application/gzip" and str(resource.uri).endswith(".log.gz")
+    assert gzip.decompress(base64.b64decode(resource.blob)).decode("utf-8") == logs
+    print(f"📊 完整日志 {len(logs) / 1024:.0f} KB → 附件 {len(resource.blob) / 1024:.0f} KB")
+
+    items = _build_log_items(logs, LogPolicy(byte_budget=8 * 1024, attach_full_log=True, attachment_budget=1024))
+    assert len(items) == 2 and items[1].type == "text" and "超出附件预算" in items[1].text
+    print("✅ 完整日志附件受预算限制")
+
+
+def test_logs_in_feedback_items():
+    """反馈结果中的命令日志出现在返回内容中，位于文字反馈之后"""
+    result = {"text_feedback": "构建失败了", "command_logs": make_build_log(5_000), "images": []}
+    items = _build_feedback_items(result, log_policy=LogPolicy(byte_budget=4096))
+    assert items[0].text.startswith("用户文字反馈：构建失败了")
+    assert items[1].text.startswith("命令输出（共")
+    assert len(items[1].text.encode("utf-8")) <= 4096
+    print("✅ 命令日志随反馈返回")
+
+
+def test_policy_from_env():
+    """每个环境变量单独解析：格式不正确的变量使用默认值，不影响其他变量；预算不小于下限"""
+    names = ("FEEDBACK_LOG_BUDGET", "FEEDBACK_LOG_ATTACHMENT_BUDGET", "FEEDBACK_LOG_ATTACH")
+    saved = {name: os.environ.get(name) for name in names}
+    try:
+        os.environ.update(FEEDBACK_LOG_BUDGET="32k", FEEDBACK_LOG_ATTACHMENT_BUDGET="2048", FEEDBACK_LOG_ATTACH="1")
+        policy = LogPolicy.from_env()
+        assert policy.byte_budget == LogPolicy().byte_budget
+        assert policy.attachment_budget == 2048 and policy.attach_full_log
+        os.environ.update(FEEDBACK_LOG_BUDGET="0", FEEDBACK_LOG_ATTACHMENT_BUDGET="-5")
+        policy = LogPolicy.from_env()
+        assert policy.byte_budget == 1024 and policy.attachment_budget == 1
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    print("✅ 环境变量逐个解析，无效值使用默认值")
+
+
+if __name__ == "__main__":
+    test_small_log_returned_verbatim()
+    test_repeated_lines_collapsed()
+    test_similar_error_lines_kept()
+    test_large_log_within_budget()
+    test_full_log_attachment()
+    test_logs_in_feedback_items()
+    test_policy_from_env()
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+测试命令执行：子进程退出立即报告（不轮询），多次运行不遗留定时器；
+持久 Shell 模式下命令之间保留工作目录和环境变量；伪终端模式下输出实时到达并渲染颜色；停止命令时整个进程组被清理，不留孤儿进程；按项目设置的优先级、内存上限和最长运行时间生效；
+命令的 CPU 时间、内存峰值和子进程数被采样，实时显示并随反馈结果返回
+"""
+
+import gc
+import os
+import re
+import sys
+import time
+import threading
+import tempfile
+import signal
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QTextCursor
+
+app = QApplication.instance() or QApplication()
+
+import feedback_ui
+from feedback_ui import FeedbackUI, get_persistent_shell, kill_tree, start_command_process
+import psutil
+
+
+def run_until(condition, timeout: float = 30.0):
+    # 之前关闭的窗口在界面线程中回收，避免后台线程触发的垃圾回收在其他线程中析构 Qt 对象
+    gc.collect()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.0005)
+    assert condition(), "等待超时"
+
+
+def make_window(title: str) -> FeedbackUI:
+    ui = FeedbackUI(os.getcwd(), title, dark_theme=True)
+    ui._ensure_command_section().setVisible(True)
+    ui.show()
+    return ui
+
+
+def test_exit_notification():
+    """子进程退出后立即收到通知，重复运行不产生新的定时器"""
+    ui = make_window("测试退出通知")
+    timers_before = len(ui.findChildren(QTimer))
+
+    for _ in range(20):
+        ui.command_entry.setText(f'"{sys.executable}" -c "pass"')
+        ui._run_command()
+        run_until(lambda: ui.process is None)
+
+    assert not hasattr(ui, "status_timer")
+    assert len(ui.findChildren(QTimer)) == timers_before
+    assert "进程已退出，代码: 0" in ui.log_text.toPlainText()
+    ui.close()
+    print("✅ 20 次运行均立即报告退出，没有遗留定时器")
+
+
+def test_exit_latency():
+    """子进程打印退出前的时间戳，测量从退出到界面线程收到通知的延迟"""
+    ui = make_window("测试退出延迟")
+    latencies = []
+    for _ in range(10):
+        received = []
+        ui.log_signals.process_finished.connect(lambda *_: received.append(time.time()))
+        ui.command_entry.setText(f'"{sys.executable}" -c "import time; print(time.time(), flush=True)"')
+        ui._run_command()
+        run_until(lambda: bool(received))
+        ui.log_signals.process_finished.disconnect()
+        ui.log_signals.process_finished.connect(ui._on_process_finished)
+        run_until(lambda: ui.process is None)
+        printed = float(ui.log_buffer.text().split("\n")[1])
+        latencies.append(received[0] - printed)
+
+    latencies.sort()
+    median = latencies[len(latencies) // 2]
+    print(f"📊 退出通知延迟中位数 {median * 1000:.1f} ms，最大 {latencies[-1] * 1000:.1f} ms（旧实现轮询间隔 100 ms）")
+    # 延迟只做报告；是否依赖轮询由 test_exit_notification 检查定时器，这里只防止通知丢失或卡住
+    assert all(latency < 5 for latency in latencies), latencies
+    ui.close()
+    print("✅ 每次退出都收到通知")
+
+
+def test_background_child_holds_pipe():
+    """后台子进程继续持有管道时，父进程退出仍会及时报告"""
+    ui = make_window("测试后台子进程")
+    ui.command_entry.setText("sleep 30 & echo started $!")
+    start = time.perf_counter()
+    ui._run_command()
+    run_until(lambda: ui.process is None, timeout=60)
+    elapsed = time.perf_counter() - start
+    match = re.search(r"started (\d+)", ui.log_buffer.text())
+    assert match, ui.log_buffer.text()
+    # 报告退出时后台子进程仍在运行，说明没有等待管道关闭
+    background = int(match.group(1))
+    assert alive(background)
+    os.kill(background, signal.SIGKILL)
+    ui.close()
+    print(f"✅ 后台子进程持有管道时 {elapsed:.2f}s 内报告退出")
+
+
+def running_in_group(pgid: int) -> list[int]:
+    """进程组中仍在运行（不含僵尸进程）的 PID"""
+    pids = []
+    for proc in psutil.process_iter(["status"]):
+        try:
+            if proc.info["status"] != psutil.STATUS_ZOMBIE and os.getpgid(proc.pid) == pgid:
+                pids.append(proc.pid)
+        except OSError:
+            continue
+    return pids
+
+
+def run_in_window(ui: FeedbackUI, command: str) -> str:
+    """在窗口中执行一条命令并返回这次的日志"""
+    ui.command_entry.setText(command)
+    ui._run_command()
+    run_until(lambda: ui.process is None and ui.shell_run is None)
+    return ui.log_buffer.text()
+
+
+def test_persistent_shell():
+    """持久 Shell 中 cd/export 在命令之间保留，退出码正确，部分行输出不被哨兵吞掉"""
+    project = tempfile.mkdtemp()
+    ui = FeedbackUI(project, "测试持久 Shell", dark_theme=True)
+    ui._ensure_command_section()
+    ui.shell_check.setChecked(True)
+    ui.show()
+
+    run_in_window(ui, "mkdir -p sub && cd sub && export IFB_TEST_VALUE=kept")
+    logs = run_in_window(ui, 'pwd; echo "value=$IFB_TEST_VALUE"; printf "no newline"')
+    assert "no newline\n命令已结束，代码: 0" in logs, logs
+    assert os.path.join(os.path.realpath(project), "sub") in logs
+    assert "value=kept" in logs
+    assert "__IFB_DONE_" not in logs
+
+    assert "命令已结束，代码: 7" in run_in_window(ui, "sh -c 'exit 7'")
+
+    # 语法错误不会让会话卡住
+    assert "命令已结束，代码:" in run_in_window(ui, 'echo "unterminated')
+
+    # 冷启动与热会话的启动耗时对比：模拟一次较慢的环境准备
+    shell = get_persistent_shell(project, False, ui._command_limits())
+    timings = []
+    for _ in range(10):
+        start = time.perf_counter()
+        run_in_window(ui, "true")
+        timings.append(time.perf_counter() - start)
+    ui.shell_check.setChecked(False)
+    cold = []
+    for _ in range(10):
+        start = time.perf_counter()
+        run_in_window(ui, "true")
+        cold.append(time.perf_counter() - start)
+    print(f"📊 每条命令平均耗时：持久 Shell {sum(timings) / 10 * 1000:.1f} ms，新进程 {sum(cold) / 10 * 1000:.1f} ms")
+    assert get_persistent_shell(project, False, ui._command_limits()) is shell
+
+    # 停止长时间运行的命令后，Shell 会话仍然可用
+    ui.shell_check.setChecked(True)
+    ui.command_entry.setText("sleep 30")
+    ui._run_command()
+    time.sleep(0.2)
+    ui._run_command()
+    assert ui.shell_run is None
+    run_until(lambda: not shell.is_busy())
+    logs = run_in_window(ui, 'echo "after stop $IFB_TEST_VALUE"')
+    assert "after stop kept" in logs
+
+    # 停止时整个进程组收到信号：命令放到后台的进程也被结束，Shell 自身保留
+    ui.command_entry.setText("(sleep 300 &); sleep 30")
+    ui._run_command()
+    time.sleep(0.2)
+    ui._run_command()
+    run_until(lambda: not shell.is_busy())
+    run_until(lambda: running_in_group(shell.process.pid) == [shell.process.pid])
+    assert shell.is_alive()
+
+    # 不产生子进程的内建循环不响应 SIGTERM：宽限期后关闭整个 Shell
+    grace, feedback_ui.KILL_GRACE_PERIOD = feedback_ui.KILL_GRACE_PERIOD, 0.2
+    try:
+        ui.command_entry.setText("while :; do :; done")
+        ui._run_command()
+        time.sleep(0.2)
+        ui._run_command()
+        run_until(lambda: not shell.is_alive())
+    finally:
+        feedback_ui.KILL_GRACE_PERIOD = grace
+    assert "after restart kept" not in run_in_window(ui, 'echo "after restart $IFB_TEST_VALUE"')
+    ui.close()
+    feedback_ui.close_persistent_shells()
+    print("✅ 持久 Shell 保留状态并正确报告退出码")
+
+
+def measure_display_latency(ui: FeedbackUI, use_pty: bool) -> list:
+    """子进程每 50ms 打印一次时间戳（不主动 flush），返回每行的（打印时间，插入控制台时间）"""
+    ui.pty_check.setChecked(use_pty)
+    ui.shell_check.setChecked(False)
+    lines = []
+    original_flush = ui._flush_log
+
+    def timed_flush():
+        now = time.time()
+        for text, _ in list(ui._pending_log):
+            for line in text.splitlines():
+                if line.startswith("t="):
+                    lines.append((float(line[2:]), now))
+        original_flush()
+
+    ui._flush_log = timed_flush
+    script = "import time\nfor _ in range(10):\n    print(f't={time.time()}')\n    time.sleep(0.05)"
+    ui.command_entry.setText(f'"{sys.executable}" -c "{script}"')
+    ui._run_command()
+    run_until(lambda: ui.process is None and not ui._pending_log)
+    ui._flush_log = original_flush
+    assert len(lines) == 10, lines
+    return lines
+
+
+def test_pty_latency():
+    """管道模式下 Python 子进程块缓冲，输出在退出时才到达；伪终端下逐行实时到达"""
+    ui = make_window("测试伪终端延迟")
+    # 子进程使用默认的缓冲策略
+    os.environ.pop("PYTHONUNBUFFERED", None)
+    pipe_lines = measure_display_latency(ui, use_pty=False)
+    pty_lines = measure_display_latency(ui, use_pty=True)
+    pipe = [shown - printed for printed, shown in pipe_lines]
+    pty = [shown - printed for printed, shown in pty_lines]
+    print(f"📊 打印到显示的平均延迟：管道 {sum(pipe) / len(pipe) * 1000:.0f} ms（最大 {max(pipe) * 1000:.0f} ms），"
+          f"伪终端 {sum(pty) / len(pty) * 1000:.1f} ms（最大 {max(pty) * 1000:.1f} ms）")
+    # 只比较先后顺序：管道模式下第一行要等最后一行打印后才显示，伪终端下在此之前就已显示
+    assert pipe_lines[0][1] >= pipe_lines[-1][0]
+    assert pty_lines[0][1] < pty_lines[-1][0]
+    ui.close()
+    print("✅ 伪终端输出实时到达")
+
+
+def test_pty_colors():
+    """伪终端模式下子进程看到终端，颜色渲染到控制台，返回的日志不含转义序列"""
+    ui = make_window("测试伪终端颜色")
+    ui.pty_check.setChecked(True)
+    logs = run_in_window(ui, f'"{sys.executable}" -c "import sys; print(sys.stdout.isatty())"; '
+                             "printf '\\033[1;31mred\\033[0m plain\\n'; printf '10%%\\r100%%\\n'")
+    assert "True" in logs
+    assert "red plain" in logs and "\x1b" not in logs, repr(logs)
+    run_until(lambda: not ui._pending_log)
+    app.processEvents()
+
+    # QTextCursor.charFormat() 返回光标前一个字符的格式
+    text = ui.log_text.toPlainText()
+    position = text.index("\nred plain") + 1
+    cursor = QTextCursor(ui.log_text.document())
+    cursor.setPosition(position + 1)
+    assert cursor.charFormat().foreground().color().name() == "#cd3131"
+    assert cursor.charFormat().fontWeight() > 400
+    cursor.setPosition(position + len("red p"))
+    assert cursor.charFormat().foreground().color().name() != "#cd3131"
+    # \r 让进度输出覆盖当前行
+    assert "100%" in ui.log_text.toPlainText().splitlines()
+    assert "10%" not in ui.log_text.toPlainText().splitlines()
+
+    # 持久 Shell 同样可以接到伪终端
+    ui.shell_check.setChecked(True)
+    logs = run_in_window(ui, "test -t 1 && echo on-tty; sh -c 'exit 3'")
+    assert "on-tty" in logs and "命令已结束，代码: 3" in logs, logs
+    ui.close()
+    feedback_ui.close_persistent_shells()
+    print("✅ 伪终端颜色渲染正常")
+
+
+# 启动 20 个子进程（其中一半忽略 SIGTERM），并持续 fork 新的 sleep 进程，把所有 PID 写入文件
+TREE_SCRIPT = """
+import os, signal, subprocess, sys, time
+pids = []
+for i in range(20):
+    pre = (lambda: signal.signal(signal.SIGTERM, signal.SIG_IGN)) if i % 2 else None
+    pids.append(subprocess.Popen(["sleep", "60"], preexec_fn=pre).pid)
+with open(sys.argv[1], "w") as f:
+    f.write(" ".join(map(str, pids)))
+while True:
+    subprocess.Popen(["sleep", "60"])
+    time.sleep(0.01)
+"""
+
+
+def spawn_tree(tmp_dir: str):
+    pid_file = os.path.join(tmp_dir, "pids")
+    script = os.path.join(tmp_dir, "tree.py")
+    with open(script, "w") as f:
+        f.write(TREE_SCRIPT)
+    process, streams = start_command_process(f'"{sys.executable}" "{script}" "{pid_file}"', cwd=tmp_dir, shell=True)
+    for stream in streams.values():
+        stream.close()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(pid_file) or not open(pid_file).read():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    time.sleep(0.2)
+    return process
+
+
+def alive(pid: int) -> bool:
+    # 孤儿进程被 init 收养后可能短暂保持僵尸状态，已不占用资源，视为已结束
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+def wait_gone(pids, timeout: float = 1.0) -> list:
+    """SIGKILL 是异步送达的，等待进程真正结束"""
+    deadline = time.monotonic() + timeout
+    while any(alive(pid) for pid in pids) and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return [pid for pid in pids if alive(pid)]
+
+
+def test_process_group_teardown():
+    """SIGTERM 整个进程组，宽限期后 SIGKILL 忽略信号的进程；测量停止耗时并确认没有孤儿进程"""
+    tmp_dir = tempfile.mkdtemp()
+    process = spawn_tree(tmp_dir)
+    members = [proc.pid for proc in psutil.Process(process.pid).children(recursive=True)] + [process.pid]
+    assert len(members) > 20
+
+    start = time.perf_counter()
+    kill_tree(process, grace_period=0.5, wait=True)
+    elapsed = time.perf_counter() - start
+    remaining = wait_gone(members)
+    group_left = [proc.pid for proc in psutil.process_iter() if alive(proc.pid) and _pgid(proc.pid) == process.pid]
+    print(f"📊 停止 {len(members)} 个进程（一半忽略 SIGTERM）耗时 {elapsed * 1000:.0f} ms（宽限期 500 ms）")
+    assert not remaining and not group_left, (remaining, group_left)
+
+    # 没有忽略 SIGTERM 的进程时不需要等待宽限期
+    process, streams = start_command_process("sleep 60 & sleep 60 & wait", cwd=tmp_dir, shell=True)
+    time.sleep(0.2)
+    start = time.perf_counter()
+    kill_tree(process, grace_period=5, wait=True)
+    elapsed = time.perf_counter() - start
+    print(f"📊 响应 SIGTERM 的进程树停止耗时 {elapsed * 1000:.1f} ms")
+    assert elapsed < 1
+
+    # 等待宽限期时只偶尔遍历进程表排除僵尸进程，平时只用 killpg 探测
+    process, streams = start_command_process("(trap '' TERM; sleep 60) & wait", cwd=tmp_dir, shell=True)
+    time.sleep(0.2)
+    real_process_iter = psutil.process_iter
+    scans = []
+    psutil.process_iter = lambda *args, **kwargs: scans.append(1) or real_process_iter(*args, **kwargs)
+    try:
+        kill_tree(process, grace_period=2, wait=True)
+    finally:
+        psutil.process_iter = real_process_iter
+    print(f"📊 2 s 宽限期内遍历进程表 {len(scans)} 次")
+    assert 0 < len(scans) <= 10
+
+    # 对比：旧的 psutil 逐个遍历进程树
+    process = spawn_tree(tmp_dir)
+    start = time.perf_counter()
+    feedback_ui._kill_tree_psutil(process)
+    elapsed = time.perf_counter() - start
+    process.wait()
+    survivors = [proc.pid for proc in psutil.process_iter() if alive(proc.pid) and _pgid(proc.pid) == process.pid]
+    print(f"📊 对比 psutil 遍历：耗时 {elapsed * 1000:.1f} ms，遗留 {len(survivors)} 个进程")
+    if survivors:
+        os.killpg(process.pid, signal.SIGKILL)
+    print("✅ 进程组清理完整，没有孤儿进程")
+
+
+def _pgid(pid: int):
+    try:
+        return os.getpgid(pid)
+    except OSError:
+        return None
+
+
+LIMITS_SCRIPT = """
+import os, resource, psutil
+print("nice", os.nice(0))
+print("ionice", int(psutil.Process().ionice().ioclass))
+print("data", resource.getrlimit(resource.RLIMIT_DATA)[0] // (1024 * 1024))
+try:
+    block = bytearray(512 * 1024 * 1024)
+    print("alloc ok")
+except MemoryError:
+    print("alloc failed")
+"""
+
+
+def test_resource_limits():
+    """nice 相对界面进程增加，IO 优先级和内存上限生效，超过最长运行时间自动停止，设置按项目保存"""
+    project = tempfile.mkdtemp()
+    script = os.path.join(project, "limits.py")
+    with open(script, "w") as f:
+        f.write(LIMITS_SCRIPT)
+
+    ui = FeedbackUI(project, "测试资源限制", dark_theme=True)
+    ui._ensure_command_section()
+    ui.show()
+    # 默认不调整优先级和资源限制，命令按原样启动，不加包装命令
+    assert feedback_ui._command_wrapper(ui._command_limits(), dict(os.environ)) == []
+    assert feedback_ui._wrap_command("echo hi", True, []) == ("echo hi", True)
+    ui.nice_spin.setValue(7)
+    ui.io_combo.setCurrentIndex(ui.io_combo.findData("idle"))
+    ui.memory_spin.setValue(256)
+    logs = run_in_window(ui, f'"{sys.executable}" "{script}"')
+    values = dict(line.split(" ", 1) for line in logs.splitlines() if line.split(" ")[0] in ("nice", "ionice", "data", "alloc"))
+    assert int(values["nice"]) == os.nice(0) + 7, values
+    assert int(values["ionice"]) == int(psutil.IOPRIO_CLASS_IDLE)
+    assert int(values["data"]) == 256
+    assert values["alloc"] == "failed"
+
+    ui.io_combo.setCurrentIndex(ui.io_combo.findData("low"))
+    logs = run_in_window(ui, f'"{sys.executable}" "{script}"')
+    assert f"ionice {int(psutil.IOPRIO_CLASS_BE)}" in logs, logs
+    ui.io_combo.setCurrentIndex(ui.io_combo.findData("idle"))
+
+    # 持久 Shell 中执行的命令同样继承这些限制
+    ui.shell_check.setChecked(True)
+    logs = run_in_window(ui, f'"{sys.executable}" "{script}"')
+    assert f"nice {os.nice(0) + 7}" in logs and "alloc failed" in logs, logs
+    ui.shell_check.setChecked(False)
+
+    ui.wall_time_spin.setValue(1)
+    start = time.perf_counter()
+    logs = run_in_window(ui, "sleep 30")
+    elapsed = time.perf_counter() - start
+    # 只检查在 sleep 结束之前就被停止，不对停止耗时设严格上限
+    assert 0.9 < elapsed < 20, elapsed
+    assert "命令运行超过 1 秒，已停止" in logs
+
+    ui._save_config()
+    ui.close()
+    reopened = FeedbackUI(project, "测试资源限制", dark_theme=True)
+    reopened._ensure_command_section()
+    assert reopened.nice_spin.value() == 7
+    assert reopened.io_combo.currentData() == "idle"
+    assert reopened.memory_spin.value() == 256
+    assert reopened.wall_time_spin.value() == 1
+    reopened.store.remove_scope(reopened.project_group_name)
+    reopened.close()
+    feedback_ui.close_persistent_shells()
+    print(f"✅ 资源限制生效，超时命令在 {elapsed:.2f}s 后停止")
+
+
+TELEMETRY_SCRIPT = """
+import sys, subprocess
+child = "import time; block = b'x' * (80 * 1024 * 1024)\\nwhile time.process_time() < 0.6: pass\\ntime.sleep(1.2)"
+children = [subprocess.Popen([sys.executable, "-c", child]) for _ in range(2)]
+for process in children:
+    process.wait()
+"""
+
+
+def test_command_telemetry():
+    """子进程的 CPU 时间和内存计入统计，运行中实时显示，结果中附带性能概况；持久 Shell 不计入之前的命令"""
+    from server import _build_feedback_items
+
+    project = tempfile.mkdtemp()
+    script = os.path.join(project, "telemetry.py")
+    with open(script, "w") as f:
+        f.write(TELEMETRY_SCRIPT)
+
+    ui = FeedbackUI(project, "测试资源采样", dark_theme=True)
+    ui._ensure_command_section()
+    ui.show()
+    ui.command_entry.setText(f'"{sys.executable}" "{script}"')
+    ui._run_command()
+    run_until(lambda: ui.telemetry_label.text() != "")
+    live = ui.telemetry_label.text()
+    run_until(lambda: ui.process is None)
+
+    stats = ui.command_stats
+    print(f"📊 {feedback_ui.format_command_stats(stats)}，采样 {stats['samples']} 次")
+    assert stats["exit_code"] == 0
+    assert stats["cpu_time"] >= 1.0, stats
+    assert stats["peak_rss"] >= 160 * 1024 * 1024, stats
+    assert stats["max_children"] >= 2, stats
+    assert stats["wall_time"] >= stats["cpu_time"] / psutil.cpu_count() and "CPU" in live
+
+    ui._submit_feedback()
+    result = ui.feedback_result
+    assert result["command_stats"] == stats
+    texts = [item.text for item in _build_feedback_items(dict(result, images=[])) if item.type == "text"]
+    assert any(text.startswith("命令性能概况") and "退出代码 0" in text for text in texts), texts
+
+    # 持久 Shell：第二次运行只统计本次命令
+    ui = FeedbackUI(project, "测试资源采样", dark_theme=True)
+    ui._ensure_command_section()
+    ui.shell_check.setChecked(True)
+    for _ in range(2):
+        run_in_window(ui, f'"{sys.executable}" "{script}"')
+        # 停止后的最后一次采样在采样线程中进行，结果随后送回界面线程
+        assert ui.finished_sampler.wait(5)
+        app.processEvents()
+        assert ui.command_stats["exit_code"] == 0
+        assert 1.0 <= ui.command_stats["cpu_time"] < 2.5, ui.command_stats
+        assert ui.command_stats["max_children"] >= 2
+    ui.store.remove_scope(ui.project_group_name)
+    ui.close()
+    feedback_ui.close_persistent_shells()
+
+    # stop() 立即返回，停止后的采样在采样线程中进行，不占用界面线程
+    sampler = feedback_ui.ResourceSampler(os.getpid(), "self", interval=60)
+    sampled_on = []
+    sample = sampler._sample
+    sampler._sample = lambda: sampled_on.append(threading.current_thread()) or sample()
+    sampler.start()
+    stats = sampler.stop(0)
+    assert stats["exit_code"] == 0 and sampler.wait(5)
+    assert sampled_on and threading.main_thread() not in sampled_on, sampled_on
+    print("✅ 命令资源占用被采样并随结果返回")
+
+
+if __name__ == "__main__":
+    test_exit_notification()
+    test_exit_latency()
+    if sys.platform != "win32":
+        test_background_child_holds_pipe()
+        test_persistent_shell()
+        test_pty_latency()
+        test_pty_colors()
+        test_process_group_teardown()
+        test_resource_limits()
+    test_command_telemetry()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+测试控制台输出的读取与批量渲染：子进程输出按块读取并增量解码，
+命令大量输出时按帧合并插入，控制台行数和日志缓冲区都有上限，并给出每秒处理的行数
+"""
+
+import os
+import sys
+import time
+import threading
+import subprocess
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+
+app = QApplication.instance() or QApplication()
+
+from feedback_ui import FeedbackUI, LogBuffer, CommandOutputReader, CONSOLE_MAX_LINES
+
+
+def drain(ui: FeedbackUI, condition, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+    app.processEvents()
+    assert condition(), "等待超时"
+
+
+def test_log_buffer_cap():
+    """日志缓冲区超过容量时丢弃最早的输出，并在开头注明省略量"""
+    buffer = LogBuffer(max_chars=1000)
+    for i in range(1000):
+        buffer.append(f"line {i:04d}\n")
+    assert buffer.size() <= 1000
+    text = buffer.text()
+    assert text.startswith("[... 已省略最早的")
+    assert text.endswith("line 0999\n")
+    print("✅ 日志缓冲区容量受限")
+
+
+def read_command(code: str) -> tuple:
+    """用 CommandOutputReader 读取一段 Python 代码的输出，返回 [(tag, text)] 和读取次数"""
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    received = []
+    reader = CommandOutputReader({"stdout": process.stdout, "stderr": process.stderr},
+                                 lambda tag, text: received.append((tag, text)))
+    reader.start()
+    assert reader.join(timeout=60)
+    process.wait()
+    return received, reader.reads
+
+
+def test_output_reader():
+    """部分行立即交付，跨块的多字节字符正确解码，非法字节不被丢弃，stdout/stderr 带标签"""
+    code = (
+        "import sys, time\n"
+        "out = sys.stdout.buffer\n"
+        "out.write(b'progress 50%'); out.flush(); time.sleep(0.3)\n"
+        "out.write('\\r完成'.encode()[:2]); out.flush(); time.sleep(0.1)\n"
+        "out.write('\\r完成'.encode()[2:] + b'\\n\\xff\\n'); out.flush()\n"
+        "sys.stderr.buffer.write(b'warning\\n')\n"
+    )
+    received, _ = read_command(code)
+    stdout = "".join(text for tag, text in received if tag == "stdout")
+    stderr = "".join(text for tag, text in received if tag == "stderr")
+    assert received[0] == ("stdout", "progress 50%"), received[0]
+    assert stdout == "progress 50%\r完成\n\ufffd\n", repr(stdout)
+    assert stderr == "warning\n"
+    print("✅ 输出读取器处理部分行、多字节字符和非法字节")
+
+
+def test_reader_throughput():
+    """与逐行 readline 线程对比读取吞吐量和唤醒次数"""
+    lines = 500_000
+    code = f"import sys\nfor i in range({lines}): sys.stdout.write(f'line {{i}} of build output\\n')"
+
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True,
+                               bufsize=1, encoding="utf-8", errors="ignore")
+    readline_calls = sum(1 for _ in iter(process.stdout.readline, ""))
+    process.wait()
+    readline_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    received, reads = read_command(code)
+    chunk_time = time.perf_counter() - start
+    assert "".join(text for _, text in received).count("\n") == lines
+
+    print(f"📊 {lines} 行：readline {readline_time:.2f}s / {readline_calls} 次回调，"
+          f"分块读取 {chunk_time:.2f}s / {reads} 次读取（{lines / chunk_time:,.0f} 行/秒）")
+    # 子进程按自身缓冲区大小（通常 4–8 KB）写入，每次读取至少合并一次写入的所有行
+    assert reads < readline_calls / 5
+    print("✅ 分块读取减少唤醒次数")
+
+
+def test_threaded_throughput():
+    """两个线程各输出 100k 行，控制台刷新次数远少于行数，行数不超过上限"""
+    ui = FeedbackUI(os.getcwd(), "测试控制台输出", dark_theme=True)
+    ui._ensure_command_section().setVisible(True)
+    ui.show()
+    ui.clear_logs()
+
+    flushes = [0]
+    original_flush = ui._flush_log
+
+    def counting_flush():
+        flushes[0] += 1
+        original_flush()
+
+    ui._flush_log = counting_flush
+
+    lines_per_thread = 100_000
+
+    def produce(tag):
+        for i in range(lines_per_thread):
+            ui._append_log(f"[{tag}] build step {i}: compiling module_{i % 97}.c\n")
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=produce, args=(tag,)) for tag in ("out", "err")]
+    for thread in threads:
+        thread.start()
+    drain(ui, lambda: not any(t.is_alive() for t in threads) and not ui._pending_log)
+    elapsed = time.perf_counter() - start
+
+    total = lines_per_thread * len(threads)
+    print(f"📊 {total} 行输出用时 {elapsed:.2f}s（{total / elapsed:,.0f} 行/秒），控制台刷新 {flushes[0]} 次")
+    assert flushes[0] < total / 100
+    assert ui.log_text.blockCount() <= CONSOLE_MAX_LINES
+    assert ui.log_buffer.size() <= ui.log_buffer.max_chars
+    assert ui.log_text.toPlainText().rstrip().endswith(f"build step {lines_per_thread - 1}: compiling module_{(lines_per_thread - 1) % 97}.c")
+    ui.close()
+    print("✅ 控制台输出按帧合并")
+
+
+def test_command_output():
+    """运行真实命令，输出完整出现在控制台和返回的日志中"""
+    ui = FeedbackUI(os.getcwd(), "测试命令输出", dark_theme=False)
+    ui._ensure_command_section().setVisible(True)
+    ui.show()
+    ui.command_entry.setText(f'"{sys.executable}" -c "for i in range(50000): print(i)"')
+
+    start = time.perf_counter()
+    ui._run_command()
+    drain(ui, lambda: ui.process is None and not ui._pending_log)
+    elapsed = time.perf_counter() - start
+
+    logs = ui.log_buffer.text()
+    assert "49999\n" in logs
+    assert "进程已退出" not in logs.split("49999")[0]
+    assert "进程已退出，代码: 0" in ui.log_text.toPlainText()
+    print(f"📊 命令输出 50000 行用时 {elapsed:.2f}s（{50000 / elapsed:,.0f} 行/秒）")
+    ui.close()
+    print("✅ 命令输出完整")
+
+
+if __name__ == "__main__":
+    test_log_buffer_cap()
+    test_output_reader()
+    test_reader_throughput()
+    test_threaded_throughput()
+    test_command_output()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+测试反馈归档：每轮反馈写入全文索引，search_feedback_history 按相关度返回摘录，
+中文短词也能命中，数千轮归档中查询在毫秒级完成，保留策略限制归档大小
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import sqlite3
+import tempfile
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["INTERACTIVE_FEEDBACK_HOME"] = tempfile.mkdtemp()
+
+import feedback_store
+from feedback_store import FeedbackStore
+import server
+from server import FeedbackRound, _build_feedback_items, search_feedback_history
+
+SESSIONS = 3000
+
+
+def make_store() -> FeedbackStore:
+    return FeedbackStore(os.path.join(tempfile.mkdtemp(), "feedback.db"))
+
+
+def fill_archive(store: FeedbackStore, sessions: int = SESSIONS):
+    """生成 sessions 轮反馈，其中一轮提到登录页面的时区问题"""
+    random.seed(0)
+    words = ("重构 解析器 缓存 测试 构建 日志 接口 数据库 迁移 按钮 样式 文档 性能 内存 "
+             "refactor parser cache build deploy timeout retry webpack pytest").split()
+    now = time.time()
+    for index in range(sessions):
+        feedback = " ".join(random.choice(words) for _ in range(30))
+        if index == sessions // 2:
+            feedback = "登录页面的时间显示错了，服务器用的是 UTC，要按用户的时区 Asia/Shanghai 显示"
+        store.record_feedback(
+            f"/src/project_{index % 8}", f"完成了第 {index} 轮修改：" + " ".join(random.choice(words) for _ in range(20)),
+            feedback, "$ pytest -q\n" + " ".join(random.choice(words) for _ in range(200)),
+            [f"{index:064x}"] if index % 5 == 0 else [], {"exit_code": index % 3, "wall_time": 1.0},
+            now - (sessions - index) * 60, 30.0,
+        )
+    store.flush()
+
+
+def test_search_ranking_and_filters():
+    """多个词同时匹配，按项目过滤；两个汉字的短词逐条查找子串"""
+    store = make_store()
+    fill_archive(store, 200)
+
+    results = store.search_feedback("时区 Shanghai")
+    assert len(results) == 1
+    assert results[0]["project"] == "/src/project_4"
+    assert "**Shanghai**" in results[0]["snippets"]["feedback"]
+    assert results[0]["command_stats"]["exit_code"] == 100 % 3
+
+    assert store.search_feedback("Shanghai", project="/src/project_4")
+    assert not store.search_feedback("Shanghai", project="/src/project_5")
+    assert "**时区**" in store.search_feedback("时区")[0]["snippets"]["feedback"]
+    assert len(store.search_feedback("webpack", limit=5)) == 5
+    assert store.search_feedback("   ") == [] and store.search_feedback('"unbalanced') == []
+
+    # 短词和全文索引一样不区分大小写
+    store.record_feedback("/src/project_0", "汇报", "Ok，就这样合并", "", [], None, time.time(), 1.0)
+    assert "**Ok**" in store.search_feedback("ok")[0]["snippets"]["feedback"]
+    assert store.search_feedback("SHANGHAI")[0]["project"] == "/src/project_4"
+    store.close()
+    print("✅ 搜索结果按相关度排序，支持项目过滤和中文短词，不区分大小写")
+
+
+def test_search_latency():
+    """数千轮归档中，全文索引查询在毫秒级完成"""
+    store = make_store()
+    start = time.perf_counter()
+    fill_archive(store)
+    print(f"📊 写入 {SESSIONS} 轮反馈用时 {time.perf_counter() - start:.2f} s，"
+          f"数据库 {os.path.getsize(store.path) / 1024 / 1024:.1f} MB")
+
+    for query in ("Shanghai", "登录页面", "webpack timeout", "时区"):
+        timings = []
+        for _ in range(10):
+            start = time.perf_counter()
+            results = store.search_feedback(query)
+            timings.append(time.perf_counter() - start)
+        median = sorted(timings)[len(timings) // 2]
+        print(f"📊 {query!r:20} {len(results):2} 条结果，{median * 1000:.2f} ms")
+        if query != "时区":  # 短词不经过全文索引，逐条查找
+            assert median < 0.02, f"查询用时 {median * 1000:.1f} ms"
+    store.close()
+    print("✅ 全文索引查询在毫秒级完成")
+
+
+def test_retention():
+    """超出会话数上限或保留天数的最早的反馈被删除，全文索引同步清理"""
+    store = make_store()
+    max_sessions, max_days = feedback_store.ARCHIVE_MAX_SESSIONS, feedback_store.ARCHIVE_MAX_AGE_DAYS
+    feedback_store.ARCHIVE_MAX_SESSIONS, feedback_store.ARCHIVE_MAX_AGE_DAYS = 50, 1
+    try:
+        now = time.time()
+        store.record_feedback("/p", "旧的汇报", "很久以前的反馈 ancient", "", [], None, now - 3 * 86400, 5.0)
+        for index in range(80):
+            store.record_feedback("/p", f"汇报 {index}", f"反馈 number{index:03d}", "", [], None, now, 5.0)
+        store.flush()
+        with store._db_lock:
+            counts = [store._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                      for table in ("feedback_sessions", "feedback_text")]
+        assert counts == [50, 50], counts
+        assert not store.search_feedback("ancient")
+        assert not store.search_feedback("number029") and store.search_feedback("number030")
+    finally:
+        feedback_store.ARCHIVE_MAX_SESSIONS, feedback_store.ARCHIVE_MAX_AGE_DAYS = max_sessions, max_days
+    store.close()
+    print("✅ 保留策略限制归档大小")
+
+
+def test_feedback_round_archived():
+    """返回给 AI 的反馈被归档，可通过 MCP 工具搜索到"""
+    feedback_round = FeedbackRound("/src/shop", "已修复购物车结算时的精度问题")
+    feedback_round.finish()
+    result = {
+        "text_feedback": "金额还是差一分钱，检查 Decimal 的舍入模式",
+        "command_logs": "$ pytest tests/test_cart.py\nFAILED tests/test_cart.py::test_total - AssertionError\n",
+        "command_stats": {"command": "pytest", "exit_code": 1, "wall_time": 0.8},
+        "images": [{"name": "screenshot.png", "data": b"not really a png", "mime_type": "image/png"}],
+    }
+    _build_feedback_items(result, feedback_round=feedback_round)
+
+    text = asyncio.run(asyncio.to_thread(search_feedback_history, "舍入模式", "/src/shop/"))
+    assert text.startswith("找到 1 条相关的历史反馈"), text
+    assert "**舍入模式**" in text and "图片 1 张" in text and "命令退出码 1" in text
+    assert "test_cart" in search_feedback_history("Decimal test_total")
+    assert search_feedback_history("舍入模式", "/src/other").startswith("没有找到")
+    print(text)
+    print("✅ 反馈归档可通过 search_feedback_history 搜索")
+
+
+def test_archive_failure_keeps_feedback():
+    """归档写入失败（例如数据库被锁）时，反馈照常返回给 AI"""
+    def locked_store():
+        raise sqlite3.OperationalError("database is locked")
+
+    feedback_round = FeedbackRound("/src/shop", "汇报")
+    feedback_round.finish()
+    original, server.get_feedback_store = server.get_feedback_store, locked_store
+    try:
+        items = _build_feedback_items({"text_feedback": "数据库锁住时的反馈", "command_logs": "", "images": []},
+                                      feedback_round=feedback_round)
+    finally:
+        server.get_feedback_store = original
+    assert any("数据库锁住时的反馈" in item.text for item in items)
+    print("✅ 归档失败时反馈照常返回")
+
+
+def test_session_result_archived_once():
+    """并发的 await_feedback 共享同一份结果，只归档一次；过期未取回的结果释放图片临时文件"""
+    class FakeHost:
+        def __init__(self, result_factory):
+            self.result_factory = result_factory
+
+        async def request(self, project_directory, prompt, theme, timeout):
+            return self.result_factory()
+
+    async def run():
+        table = server.FeedbackSessionTable(FakeHost(lambda: {
+            "text_feedback": "并发取回的反馈只归档一次", "command_logs": "", "images": [],
+        }))
+        original, server.feedback_sessions = server.feedback_sessions, table
+        try:
+            session_id = table.start("/src/concurrent", "汇报", "light")
+            first, second = await asyncio.gather(server.await_feedback(session_id, 5),
+                                                 server.await_feedback(session_id, 5))
+        finally:
+            server.feedback_sessions = original
+        assert first is second and any("并发取回的反馈" in item.text for item in first)
+
+        spools = []
+
+        def result_with_spool():
+            spool = tempfile.SpooledTemporaryFile(max_size=16)
+            spool.write(b"x" * 64)
+            spools.append(spool)
+            return {"text_feedback": "", "command_logs": "",
+                    "images": [{"name": "a.png", "data": spool, "mime_type": "image/png"}]}
+
+        table = server.FeedbackSessionTable(FakeHost(result_with_spool), result_ttl=0)
+        session_id = table.start("/src/concurrent", "汇报", "light")
+        await table.wait(session_id, 5)
+        await asyncio.sleep(0.01)
+        assert table.get(session_id) is None and spools[0].closed
+
+    asyncio.run(run())
+    assert search_feedback_history("并发取回", "/src/concurrent").startswith("找到 1 条")
+    print("✅ 并发取回的会话结果只归档一次，过期结果释放临时文件")
+
+
+def test_without_trigram():
+    """SQLite 不支持 trigram 时使用默认分词器，所有搜索词逐条查找子串"""
+    feedback_store._TRIGRAM_AVAILABLE = False
+    try:
+        store = make_store()
+    finally:
+        feedback_store._TRIGRAM_AVAILABLE = True
+    with store._db_lock:
+        sql = store._conn.execute("SELECT sql FROM sqlite_master WHERE name = 'feedback_text'").fetchone()[0]
+    assert "trigram" not in sql and not store._trigram
+    fill_archive(store, 200)
+    assert len(store.search_feedback("时区 Shanghai")) == 1
+    assert "**Shanghai**" in store.search_feedback("Shanghai")[0]["snippets"]["feedback"]
+    assert len(store.search_feedback("webpack", limit=5)) == 5
+    store.close()
+    print("✅ 没有 trigram 分词器时退回子串查找")
+
+
+def test_migration_failure_falls_back_to_memory():
+    """其他进程持有写锁导致迁移失败时退回内存数据库，界面照常启动"""
+    path = os.path.join(tempfile.mkdtemp(), "feedback.db")
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("PRAGMA journal_mode=WAL")
+    holder.execute("BEGIN IMMEDIATE")
+    timeout, feedback_store.BUSY_TIMEOUT = feedback_store.BUSY_TIMEOUT, 0.1
+    try:
+        store = FeedbackStore(path)
+    finally:
+        feedback_store.BUSY_TIMEOUT = timeout
+        holder.execute("ROLLBACK")
+        holder.close()
+    store.set("scope", "key", "value")
+    store.flush()
+    assert store.get("scope", "key") == "value"
+    store.record_feedback("/p", "汇报", "内存中的反馈 fallback", "", [], None, time.time(), 1.0)
+    assert store.search_feedback("fallback")
+    store.close()
+    print("✅ 迁移失败时退回内存数据库")
+
+
+if __name__ == "__main__":
+    test_search_ranking_and_filters()
+    test_search_latency()
+    test_retention()
+    test_feedback_round_archived()
+    test_archive_failure_keeps_feedback()
+    test_session_result_archived_once()
+    test_without_trigram()
+    test_migration_failure_falls_back_to_memory()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+测试宿主与服务器之间的帧协议：结果一次编码，图片以二进制帧传输
+"""
+
+import io
+import os
+import sys
+import asyncio
+import tempfile
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ["INTERACTIVE_FEEDBACK_HOME"] = tempfile.mkdtemp()
+
+from feedback_protocol import encode_message, read_message, read_message_async, write_message
+
+
+def test_frame_roundtrip():
+    """JSON 帧与二进制帧的往返编码"""
+    image_bytes = os.urandom(3 * 1024 * 1024 + 7)
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
+        f.write(image_bytes)
+        image_path = f.name
+
+    try:
+        stream = io.BytesIO()
+        stream.write(encode_message({"op": "show", "id": "1", "prompt": "你好"}))
+        write_message(stream, {"id": "1", "text_feedback": "反馈"}, [image_path])
+
+        stream.seek(0)
+        request, blobs = read_message(stream)
+        assert request["prompt"] == "你好" and blobs == []
+        result, blobs = read_message(stream)
+        assert result["text_feedback"] == "反馈"
+        assert blobs == [image_bytes]
+        assert read_message(stream) is None
+
+        # asyncio 读取端与同步读取端结果一致
+        async def read_async():
+            reader = asyncio.StreamReader()
+            reader.feed_data(stream.getvalue())
+            reader.feed_eof()
+            first = await read_message_async(reader)
+            second = await read_message_async(reader)
+            third = await read_message_async(reader)
+            return first, second, third
+
+        first, second, third = asyncio.run(read_async())
+        assert first[0]["op"] == "show"
+        assert second[1] == [image_bytes]
+        assert third is None
+        print("✅ 帧协议往返编码正确")
+    finally:
+        os.remove(image_path)
+
+
+def test_changed_files():
+    """文件在发送前被删除时不写入任何帧；传输中被截断时报错，而不是补零发送损坏的图片"""
+    from feedback_protocol import ProtocolError
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "shot.png")
+    with open(path, "wb") as f:
+        f.write(os.urandom(3 * 1024 * 1024))
+
+    stream = io.BytesIO()
+    try:
+        write_message(stream, {"id": "1"}, [path, os.path.join(directory, "missing.png")])
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("缺失的文件应当报错")
+    assert stream.getvalue() == b""
+
+    class TruncatingStream(io.BytesIO):
+        """写入第一个数据块后截断源文件，模拟传输过程中文件被改写"""
+
+        def write(self, data):
+            if len(data) >= 1024 * 1024:
+                os.truncate(path, 1024)
+            return super().write(data)
+
+    try:
+        write_message(TruncatingStream(), {"id": "2"}, [path])
+    except ProtocolError:
+        pass
+    else:
+        raise AssertionError("被截断的文件应当报错")
+    print("✅ 图片文件变化时不发送补零的数据")
+
+
+def test_incomplete_message():
+    """流在二进制帧传完之前结束时报告是哪条消息，而不是当作正常的流结束"""
+    from feedback_protocol import IncompleteMessageError, encode_frame, FRAME_BLOB
+
+    stream = io.BytesIO()
+    write_message(stream, {"id": "3"}, [])
+    complete = stream.getvalue()
+    # 声明一个二进制帧，但只写出一部分就结束
+    truncated = complete.replace(b'"blobs":0', b'"blobs":1') + encode_frame(FRAME_BLOB, b"x" * 100)[:40]
+
+    async def read_async():
+        reader = asyncio.StreamReader()
+        reader.feed_data(truncated)
+        reader.feed_eof()
+        return await read_message_async(reader, spool_threshold=16)
+
+    try:
+        asyncio.run(read_async())
+    except IncompleteMessageError as e:
+        assert e.message["id"] == "3"
+    else:
+        raise AssertionError("不完整的消息应当报错")
+    print("✅ 不完整的消息带着消息 ID 报错")
+
+
+def test_spool_failure_wakes_pending_requests():
+    """暂存图片失败（例如磁盘已满）时结束宿主并唤醒等待中的请求，而不是让它们等到超时"""
+    from unittest import mock
+    import server
+
+    class FakeProcess:
+        def __init__(self, stdout):
+            self.stdout = stdout
+            self.returncode = None
+
+        def kill(self):
+            self.returncode = -9
+
+        async def wait(self):
+            return self.returncode
+
+    image_path = os.path.join(tempfile.mkdtemp(), "big.png")
+    with open(image_path, "wb") as f:
+        f.write(os.urandom(server.IMAGE_SPOOL_THRESHOLD + 1))
+    stream = io.BytesIO()
+    write_message(stream, {"id": "1", "images": [{"name": "big.png"}]}, [image_path])
+
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(stream.getvalue())
+        reader.feed_eof()
+        process = FakeProcess(reader)
+        host = server.FeedbackHost(os.getcwd())
+        future = asyncio.get_running_loop().create_future()
+        host._pending["1"] = (future, process)
+        with mock.patch("tempfile.SpooledTemporaryFile.write", side_effect=OSError(28, "No space left on device")):
+            await asyncio.wait_for(host._read_results(process), 5)
+        return process, future
+
+    process, future = asyncio.run(scenario())
+    assert process.returncode == -9
+    assert isinstance(future.exception(), server.HostExitedError)
+    print("✅ 暂存失败时等待中的请求立即失败")
+
+
+def test_host_result_frames():
+    """宿主在提交后把文字和图片字节写成一条结果消息"""
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtGui import QImage, QColor
+    import feedback_ui
+
+    app = QApplication.instance() or QApplication()
+    app.setQuitOnLastWindowClosed(False)
+
+    image = QImage(64, 48, QImage.Format_RGB32)
+    image.fill(QColor(200, 30, 30))
+    image_path = os.path.join(tempfile.mkdtemp(), "shot.png")
+    image.save(image_path, "PNG")
+
+    output = io.BytesIO()
+    real_stdout = sys.stdout
+    wrapper = io.TextIOWrapper(output, encoding="utf-8")
+    sys.stdout = wrapper
+    try:
+        host = feedback_ui.FeedbackHost(dark_theme=False)
+        host._handle_request({"op": "show", "id": "7", "project_directory": os.getcwd(),
+                              "prompt": "测试", "theme": "light"})
+        window = host.active_sessions["7"]
+        window.feedback_text.setPlainText("看起来不错")
+        window.image_model.add_image(image_path)
+        window._submit_feedback()
+        wrapper.flush()
+    finally:
+        sys.stdout = real_stdout
+        wrapper.detach()
+
+    output.seek(0)
+    message, blobs = read_message(output)
+    assert message["id"] == "7"
+    assert message["text_feedback"] == "看起来不错"
+    assert message["images"][0]["mime_type"] == "image/png"
+    with open(image_path, "rb") as f:
+        assert blobs == [f.read()]
+    # 窗口隐藏后回到空闲池等待复用
+    assert "7" not in host.active_sessions
+    assert host.idle_windows[False]
+    print("✅ 宿主结果帧包含文字与图片字节")
+
+
+def test_unreadable_image_keeps_feedback():
+    """无法读取的图片被去掉并记录原因，文字反馈照常发送"""
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtGui import QImage, QColor
+    import feedback_ui
+
+    app = QApplication.instance() or QApplication()
+    app.setQuitOnLastWindowClosed(False)
+
+    image = QImage(16, 16, QImage.Format_RGB32)
+    image.fill(QColor(30, 200, 30))
+    directory = tempfile.mkdtemp()
+    readable_path = os.path.join(directory, "ok.png")
+    locked_path = os.path.join(directory, "locked.png")
+    image.save(readable_path, "PNG")
+    image.save(locked_path, "PNG")
+
+    real_write_message = feedback_ui.write_message
+
+    def write_message_denied(stream, message, blob_paths=None):
+        # 以 root 运行时 chmod 不起作用，直接模拟打开文件时的权限错误
+        if locked_path in (blob_paths or []):
+            raise PermissionError(13, "Permission denied", locked_path)
+        return real_write_message(stream, message, blob_paths)
+
+    output = io.BytesIO()
+    real_stdout = sys.stdout
+    wrapper = io.TextIOWrapper(output, encoding="utf-8")
+    sys.stdout = wrapper
+    feedback_ui.write_message = write_message_denied
+    try:
+        host = feedback_ui.FeedbackHost(dark_theme=False)
+        host._handle_request({"op": "show", "id": "9", "project_directory": os.getcwd(),
+                              "prompt": "测试", "theme": "light"})
+        window = host.active_sessions["9"]
+        window.feedback_text.setPlainText("图片有一张打不开")
+        window.image_model.add_image(locked_path)
+        window.image_model.add_image(readable_path)
+        window._submit_feedback()
+        wrapper.flush()
+    finally:
+        feedback_ui.write_message = real_write_message
+        sys.stdout = real_stdout
+        wrapper.detach()
+
+    output.seek(0)
+    message, blobs = read_message(output)
+    assert message["text_feedback"] == "图片有一张打不开"
+    assert [image["name"] for image in message["images"]] == ["ok.png"]
+    assert message["image_errors"] == [{"name": "locked.png", "error": "Permission denied"}]
+    assert len(blobs) == 1
+    print("✅ 无法读取的图片不影响文字反馈")
+
+
+def test_prewarmed_window_waits_for_request():
+    """预先构建的窗口不自动执行命令，第一轮请求到达时才在请求的项目中运行（命令读不到宿主的 stdin）"""
+    import time
+    from PySide6.QtWidgets import QApplication
+    import feedback_ui
+    from feedback_store import get_feedback_store
+
+    app = QApplication.instance() or QApplication()
+    app.setQuitOnLastWindowClosed(False)
+
+    project = tempfile.mkdtemp()
+    get_feedback_store().set_many(feedback_ui.get_project_settings_group(project), {
+        "run_command": f'"{sys.executable}" -c "import os, sys; print(os.getcwd(), repr(sys.stdin.read()))"',
+        "execute_automatically": True,
+    })
+    cwd = os.getcwd()
+    os.chdir(project)
+    try:
+        host = feedback_ui.FeedbackHost(dark_theme=False)
+    finally:
+        os.chdir(cwd)
+    window = host.idle_windows[False][0]
+    assert window.process is None and window.log_buffer.text() == ""
+
+    host._handle_request({"op": "show", "id": "8", "project_directory": project, "prompt": "测试", "theme": "light"})
+    assert host.active_sessions["8"] is window
+    deadline = time.monotonic() + 30
+    while (window.process is not None or "''" not in window.log_buffer.text()) and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+    assert f"{os.path.realpath(project)} ''" in window.log_buffer.text(), window.log_buffer.text()
+    window.hide()
+    print("✅ 预先构建的窗口在第一轮请求时才自动执行命令")
+
+
+if __name__ == "__main__":
+    test_frame_roundtrip()
+    test_changed_files()
+    test_incomplete_message()
+    test_spool_failure_wakes_pending_requests()
+    test_host_result_frames()
+    test_unreadable_image_keeps_feedback()
+    test_prewarmed_window_waits_for_request()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+测试图片区域的模型/视图实现：逐张添加数百张图片时每次只增量插入一行，
+缩略图在后台线程加载，批量添加大图时界面保持响应
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import Qt, QElapsedTimer, QTimer
+from PySide6.QtGui import QImage, QColor
+
+app = QApplication.instance() or QApplication()
+
+from feedback_ui import FeedbackUI, IMAGE_ID_ROLE, IMAGE_LOADING_ROLE
+
+
+def make_images(count: int, width: int = 320, height: int = 240, fmt: str = "PNG") -> list:
+    directory = tempfile.mkdtemp()
+    paths = []
+    for i in range(count):
+        image = QImage(width, height, QImage.Format_RGB32)
+        image.fill(QColor(i % 255, 80, 160))
+        path = os.path.join(directory, f"image_{i:03d}.{fmt.lower()}")
+        image.save(path, fmt)
+        paths.append(path)
+    return paths
+
+
+def run_until(condition, timeout: float = 60.0) -> float:
+    """运行事件循环直到条件满足，返回期间 16ms 定时器两次触发之间的最大间隔（毫秒）"""
+    elapsed = QElapsedTimer()
+    elapsed.start()
+    gaps = []
+    last = [0]
+
+    def tick():
+        now = elapsed.elapsed()
+        gaps.append(now - last[0])
+        last[0] = now
+
+    timer = QTimer()
+    timer.timeout.connect(tick)
+    timer.start(16)
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+    timer.stop()
+    assert condition(), "等待超时"
+    return max(gaps, default=0)
+
+
+def test_incremental_gallery():
+    """逐张添加 300 张图片，每次只插入一行、不重置模型；按 ID 删除保持其他图片不变"""
+    paths = make_images(300)
+    ui = FeedbackUI(os.getcwd(), "测试图片区域", dark_theme=True)
+    ui.show()
+
+    # 耗时只做报告；增量更新通过模型信号检查
+    model = ui.image_model
+    inserted, resets = [], []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+    model.modelReset.connect(lambda: resets.append("reset"))
+    model.layoutChanged.connect(lambda: resets.append("layout"))
+
+    timings = []
+    for path in paths:
+        start = time.perf_counter()
+        ui.image_model.add_image(path)
+        app.processEvents()
+        timings.append(time.perf_counter() - start)
+    run_until(lambda: ui.image_model.pending_count() == 0)
+
+    first = sum(timings[:50]) / 50
+    last = sum(timings[-50:]) / 50
+    print(f"📊 前 50 张平均 {first * 1000:.2f} ms，后 50 张平均 {last * 1000:.2f} ms")
+    assert inserted == [(row, row) for row in range(300)], inserted[:5]
+    assert not resets, resets
+
+    # 删除第 10 张后，其余图片的 ID 与路径保持不变
+    removed_id = model.index(10).data(IMAGE_ID_ROLE)
+    next_id = model.index(11).data(IMAGE_ID_ROLE)
+    ui._remove_image(removed_id)
+    assert model.rowCount() == 299
+    assert model.index(10).data(IMAGE_ID_ROLE) == next_id
+    assert paths[10] not in model.paths()
+    # 删除后 ID→行号映射同步更新，缩略图回调仍能找到正确的行
+    assert model._row_of(removed_id) is None
+    for row in (0, 10, 298):
+        assert model._row_of(model.index(row).data(IMAGE_ID_ROLE)) == row
+
+    # 重复添加同一路径会被忽略
+    assert model.add_image(paths[0]) is None
+
+    ui._clear_images()
+    assert model.rowCount() == 0 and ui.no_image_label.isVisibleTo(ui)
+    ui.close()
+    print("✅ 图片区域增量更新正常")
+
+
+def test_background_loading():
+    """批量添加大图时先显示占位，缩略图在后台生成；删除和清空会取消未完成的任务"""
+    paths = make_images(30, 4000, 3000, "JPG")
+    ui = FeedbackUI(os.getcwd(), "测试后台加载", dark_theme=False)
+    ui.show()
+    model = ui.image_model
+
+    start = time.perf_counter()
+    for path in paths:
+        model.add_image(path)
+    add_time = time.perf_counter() - start
+    # 行立即出现（占位），缩略图随后到达；事件循环未运行前不会有缩略图完成
+    assert model.rowCount() == 30
+    assert all(model.index(row).data(IMAGE_LOADING_ROLE) for row in range(30))
+
+    max_gap = run_until(lambda: model.pending_count() == 0)
+    print(f"📊 添加 30 张 4000x3000 图片耗时 {add_time * 1000:.1f} ms，加载期间事件循环最大间隔 {max_gap} ms")
+    for row in range(model.rowCount()):
+        index = model.index(row)
+        assert not index.data(IMAGE_LOADING_ROLE)
+        assert index.data(Qt.DecorationRole) is not None
+
+    # 删除和清空时取消尚未完成的任务
+    more = make_images(20, 2000, 1500, "JPG")
+    ids = [model.add_image(path) for path in more]
+    model.remove_image(ids[-1])
+    ui._clear_images()
+    run_until(lambda: model.pending_count() == 0)
+    assert model.rowCount() == 0
+
+    # 粘贴的图片由后台任务写入临时文件，提交前会等待写入完成
+    image = QImage(1920, 1080, QImage.Format_RGB32)
+    image.fill(QColor("#336699"))
+    QApplication.clipboard().setImage(image)
+    ui._paste_image()
+    assert len(ui.temp_images) == 1
+    temp_path = next(iter(ui.temp_images))
+    ui._submit_feedback()
+    assert ui.feedback_result["images"] == [temp_path]
+    assert QImage(temp_path).size() == image.size()
+    os.remove(temp_path)
+    print("✅ 缩略图后台加载正常")
+
+
+def test_submit_skips_pending_decodes():
+    """提交反馈只等待粘贴图片写入磁盘，不等待大图库中排队的缩略图解码"""
+    paths = make_images(30, 4000, 3000, "JPG")
+    image = QImage(1920, 1080, QImage.Format_RGB32)
+    image.fill(QColor("#993366"))
+
+    def submit(wait_all: bool) -> tuple[float, FeedbackUI, list]:
+        ui = FeedbackUI(os.getcwd(), "测试提交", dark_theme=False)
+        for path in paths:
+            ui.image_model.add_image(path)
+        QApplication.clipboard().setImage(image)
+        ui._paste_image()
+        # 记录提交过程中等待了哪些后台任务
+        waits = []
+        model = ui.image_model
+        for name in ("wait_for_pending", "wait_for_saved"):
+            original = getattr(model, name)
+            setattr(model, name, lambda *args, name=name, original=original: waits.append(name) or original(*args))
+        start = time.perf_counter()
+        if wait_all:
+            ui.image_model.wait_for_pending()
+            waits.clear()
+        ui._submit_feedback()
+        return time.perf_counter() - start, ui, waits
+
+    full, _, _ = submit(wait_all=True)
+    elapsed, ui, waits = submit(wait_all=False)
+    assert waits == ["wait_for_saved"], waits
+    temp_path = ui.feedback_result["images"][-1]
+    assert ui.feedback_result["images"][:-1] == paths
+    assert QImage(temp_path).size() == image.size()
+    run_until(lambda: ui.image_model.pending_count() == 0)
+    print(f"📊 提交耗时：等待全部解码 {full * 1000:.0f} ms，只等待粘贴写入 {elapsed * 1000:.0f} ms")
+    print("✅ 提交时不等待缩略图解码")
+
+
+if __name__ == "__main__":
+    test_incremental_gallery()
+    test_background_loading()
+    test_submit_skips_pending_decodes()
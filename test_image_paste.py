@@ -5,7 +5,6 @@
 
 import sys
 import os
-import json
 
 # 添加当前目录到 Python 路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -56,10 +55,9 @@ def test_image_paste():
     
     if result:
         print("✅ 图片粘贴测试完成")
-        feedback_data = json.loads(result['interactive_feedback'])
-        print(f"📄 文字反馈: {feedback_data.get('text_feedback', '')}")
+        print(f"📄 文字反馈: {result['text_feedback']}")
         
-        images = feedback_data.get('images', [])
+        images = result['images']
         if images:
             print(f"🖼️  图片数量: {len(images)}")
             for i, image_path in enumerate(images):
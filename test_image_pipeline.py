@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+测试服务器端图片处理流水线：缩放、重新编码与字节预算
+"""
+
+import io
+import os
+import sys
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image, ImageDraw
+
+from server import ImagePayloadCache, ImagePolicy, _build_feedback_items, image_payload_cache
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """生成带噪声的照片类 PNG（色彩丰富，适合有损编码）"""
+    small = (max(1, width // 8), max(1, height // 8))
+    img = Image.frombytes("RGB", small, os.urandom(small[0] * small[1] * 3)).resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_screenshot(width: int, height: int) -> bytes:
+    """生成色彩较少的截图类 PNG（适合无损编码）"""
+    img = Image.new("RGB", (width, height), (248, 249, 250))
+    draw = ImageDraw.Draw(img)
+    for y in range(0, height, 40):
+        draw.rectangle((20, y + 5, width - 20, y + 30), fill=(13, 110, 253) if y % 80 else (33, 37, 41))
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def image_contents(items):
+    return [item for item in items if item.type == "image"]
+
+
+def test_policy_downscales_and_reports():
+    """5K 截图被缩小到长边上限，并在文本中报告原始和最终大小"""
+    policy = ImagePolicy(max_long_edge=1568, byte_budget=8 * 1024 * 1024)
+    result = {
+        "text_feedback": "见截图",
+        "images": [
+            {"name": "photo.png", "mime_type": "image/png", "data": make_photo(5120, 2880)},
+            {"name": "screen.png", "mime_type": "image/png", "data": make_screenshot(5120, 2880)},
+        ],
+    }
+    items = _build_feedback_items(result, policy)
+    images = image_contents(items)
+    assert len(images) == 2
+    assert images[0].mimeType == "image/jpeg"   # 照片类 → 有损格式
+    assert images[1].mimeType == "image/png"    # 截图类 → PNG
+    for content in images:
+        import base64
+        decoded = Image.open(io.BytesIO(base64.b64decode(content.data)))
+        assert max(decoded.size) <= 1568
+
+    report = items[-1].text
+    assert "photo.png: 5120x2880 PNG" in report and "→ 1568x882 JPEG" in report
+    print(report)
+
+
+def test_policy_shared_budget():
+    """多张图片共享同一个字节预算"""
+    budget = 600 * 1024
+    policy = ImagePolicy(byte_budget=budget)
+    result = {
+        "text_feedback": "",
+        "images": [
+            {"name": f"photo{i}.png", "mime_type": "image/png", "data": make_photo(2400, 1600)}
+            for i in range(4)
+        ],
+    }
+    items = _build_feedback_items(result, policy)
+    total = sum(len(content.data) for content in image_contents(items))
+    assert total <= budget, total
+    print(f"✅ 4 张图片 base64 总大小 {total / 1024:.0f} KB ≤ 预算 {budget / 1024:.0f} KB")
+
+
+def test_small_image_passthrough():
+    """满足策略的小图原样返回，不重新编码"""
+    data = make_screenshot(800, 600)
+    items = _build_feedback_items({"images": [{"name": "small.png", "mime_type": "image/png", "data": data}]},
+                                  ImagePolicy())
+    import base64
+    assert base64.b64decode(image_contents(items)[0].data) == data
+    print("✅ 小图原样透传")
+
+
+def test_payload_cache_hits():
+    """重复提交同一张图片时命中缓存，结果与首次一致"""
+    import time
+    policy = ImagePolicy()
+    result = {"images": [{"name": "photo.png", "mime_type": "image/png", "data": make_photo(3000, 2000)}]}
+
+    before = image_payload_cache.stats()
+    start = time.perf_counter()
+    first = _build_feedback_items(result, policy)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    second = _build_feedback_items(result, policy)
+    warm = time.perf_counter() - start
+    after = image_payload_cache.stats()
+
+    assert image_contents(first)[0].data == image_contents(second)[0].data
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"] + 1
+    print(f"✅ 缓存命中：首次 {cold * 1000:.1f} ms，重复 {warm * 1000:.1f} ms")
+
+
+def test_payload_cache_lru_eviction():
+    """超出字节容量时淘汰最久未使用的条目"""
+    cache = ImagePayloadCache(max_bytes=100)
+    policy = ImagePolicy()
+    entries = []
+    for i in range(3):
+        key = ImagePayloadCache.make_key(bytes([i]), policy)
+        cache.put(key, {"base64": "x" * 40, "degraded": False}, 1000)
+        entries.append(key)
+    assert cache.get(entries[0], 1000) is None
+    assert cache.get(entries[2], 1000) is not None
+    assert cache.stats()["bytes"] <= 100
+    print("✅ LRU 按字节容量淘汰")
+
+
+def test_streaming_memory_ceiling():
+    """
+    基准：12 张大 PNG 经帧协议接收并编码，峰值内存只比最终响应多出约一张图片的缓冲区
+    （旧实现同时保留所有原始字节和 base64 副本，峰值约为图片总大小的 2.3 倍）
+    """
+    import asyncio
+    import tracemalloc
+    from feedback_protocol import read_message_async, write_message
+    import server
+    import tempfile
+
+    paths = []
+    for i in range(12):
+        path = os.path.join(tempfile.mkdtemp(), f"large{i}.png")
+        img = Image.frombytes("RGB", (1200, 900), os.urandom(1200 * 900 * 3))
+        img.save(path, "PNG", compress_level=1)
+        paths.append(path)
+    total = sum(os.path.getsize(path) for path in paths)
+
+    stream = io.BytesIO()
+    write_message(stream, {"id": "1", "images": [{"name": os.path.basename(p)} for p in paths]}, paths)
+    payload = stream.getvalue()
+    del stream
+
+    async def receive():
+        reader = asyncio.StreamReader()
+        reader.feed_data(payload)
+        reader.feed_eof()
+        return await read_message_async(reader, server.IMAGE_SPOOL_THRESHOLD)
+
+    policy = ImagePolicy(byte_budget=200 * 1024 * 1024)
+    server.image_payload_cache.max_bytes = 0  # 不让缓存影响内存测量
+
+    tracemalloc.start()
+    message, blobs = asyncio.run(receive())
+    images = [dict(meta, data=blob) for meta, blob in zip(message["images"], blobs)]
+    items = _build_feedback_items({"images": images}, policy)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    output = sum(len(content.data) for content in image_contents(items))
+    overhead = peak - output
+    largest = max(os.path.getsize(path) for path in paths)
+    print(f"📊 图片总大小 {total / 1024 / 1024:.1f} MB，响应 {output / 1024 / 1024:.1f} MB，"
+          f"峰值 {peak / 1024 / 1024:.1f} MB，额外开销 {overhead / 1024 / 1024:.1f} MB")
+    assert len(image_contents(items)) == 12
+    # 额外开销与图片数量无关，只与单张图片大小有关
+    assert overhead < 3 * largest, overhead
+    server.image_payload_cache.max_bytes = 64 * 1024 * 1024
+
+
+class BrokenImageData(io.BytesIO):
+    """读取时抛出异常的图片数据，用于验证单张图片的错误隔离"""
+
+    def read(self, *args):
+        raise OSError("磁盘读取失败")
+
+
+def test_parallel_order_and_errors():
+    """并行处理保持原顺序，单张图片失败不影响其他图片；并与单线程处理对比耗时"""
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import server
+
+    photos = [make_photo(3200, 2400) for _ in range(8)]
+    policy = ImagePolicy(byte_budget=64 * 1024 * 1024)
+
+    def run(workers):
+        server.image_payload_cache.max_bytes = 0
+        server.image_worker_pool = ThreadPoolExecutor(max_workers=workers)
+        images = [{"name": f"p{i}.png", "data": data} for i, data in enumerate(photos)]
+        images.insert(3, {"name": "broken.png", "data": BrokenImageData(b"x")})
+        start = time.perf_counter()
+        items = _build_feedback_items({"text_feedback": "并行", "images": images}, policy)
+        return items, time.perf_counter() - start
+
+    serial_items, serial_time = run(1)
+    parallel_items, parallel_time = run(4)
+    server.image_payload_cache.max_bytes = 64 * 1024 * 1024
+    server.image_worker_pool = ThreadPoolExecutor(max_workers=server._image_worker_count())
+
+    assert [item.data for item in image_contents(serial_items)] == [item.data for item in image_contents(parallel_items)]
+    errors = [item.text for item in parallel_items if item.type == "text" and "图片加载失败" in item.text]
+    assert len(errors) == 1 and "broken.png" in errors[0]
+    assert len(image_contents(parallel_items)) == 8
+    report = parallel_items[-1].text.splitlines()
+    assert [line.split(":")[0] for line in report[1:9]] == [f"p{i}.png" for i in range(8)]
+    print(f"✅ 8 张图片：单线程 {serial_time:.2f}s，4 线程 {parallel_time:.2f}s")
+
+
+def test_policy_from_env():
+    """格式不正确的 FEEDBACK_IMAGE_MAX_EDGE 使用默认值，不影响其他变量；尺寸和预算不小于 1"""
+    names = ("FEEDBACK_IMAGE_MAX_EDGE", "FEEDBACK_IMAGE_QUALITY", "FEEDBACK_IMAGE_BUDGET")
+    saved = {name: os.environ.get(name) for name in names}
+    try:
+        os.environ.update(FEEDBACK_IMAGE_MAX_EDGE="large", FEEDBACK_IMAGE_QUALITY="60", FEEDBACK_IMAGE_BUDGET="100000")
+        policy = ImagePolicy.from_env()
+        assert policy.max_long_edge == ImagePolicy().max_long_edge
+        assert policy.quality == 60 and policy.byte_budget == 100000
+        os.environ.update(FEEDBACK_IMAGE_MAX_EDGE="0", FEEDBACK_IMAGE_QUALITY="500", FEEDBACK_IMAGE_BUDGET="-1")
+        policy = ImagePolicy.from_env()
+        assert policy.max_long_edge == 1 and policy.quality == 100 and policy.byte_budget == 1
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    print("✅ 图片策略的环境变量逐个解析")
+
+
+if __name__ == "__main__":
+    test_policy_downscales_and_reports()
+    test_policy_shared_budget()
+    test_small_image_passthrough()
+    test_payload_cache_hits()
+    test_payload_cache_lru_eviction()
+    test_streaming_memory_ceiling()
+    test_parallel_order_and_errors()
+    test_policy_from_env()
@@ -38,7 +38,7 @@ def test_input_scroll():
     
     if result:
         print("✅ 测试完成")
-        feedback_data = result['interactive_feedback']
+        feedback_data = result['text_feedback']
         print(f"📄 用户输入的反馈长度: {len(feedback_data)} 字符")
         if len(feedback_data) > 200:
             print("✅ 输入了足够长的文本，滚动功能应该已被测试")
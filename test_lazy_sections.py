@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+测试按需构建界面：折叠的命令区域在第一次显示或运行命令时才构建，提示和联系信息在第一次绘制之后构建；
+对比一次性构建全部界面，新进程中首次绘制的耗时下降
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ["INTERACTIVE_FEEDBACK_HOME"] = tempfile.mkdtemp()
+
+from PySide6.QtGui import QColor, QImage
+from PySide6.QtWidgets import QApplication, QLabel
+
+app = QApplication.instance() or QApplication()
+
+from feedback_ui import FeedbackUI, get_project_settings_group
+from feedback_store import get_feedback_store
+
+
+def run_until(condition, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        app.processEvents()
+        time.sleep(0.001)
+    assert condition(), "等待超时"
+
+
+def test_command_section_built_on_demand():
+    """默认折叠时不构建命令区域；切换后构建并保存，下次打开同一项目时直接显示"""
+    project = tempfile.mkdtemp()
+    ui = FeedbackUI(project, "测试按需构建", dark_theme=True)
+    assert ui.command_group is None
+    assert not any(label.text().startswith("💡 提示") for label in ui.findChildren(QLabel))
+
+    ui.show()
+    run_until(lambda: ui._footer_created)
+    assert any(label.text().startswith("💡 提示") for label in ui.findChildren(QLabel))
+    assert ui.command_group is None
+
+    ui.begin_session(project, "第二轮")  # 未构建命令区域时开始新一轮
+    ui._toggle_command_section()
+    assert ui.command_group is not None and ui.command_group.isVisible()
+    layout = ui.centralWidget().layout()
+    assert layout.indexOf(ui.command_group) == layout.indexOf(ui.toggle_command_button) + 1
+    ui._toggle_command_section()
+    assert not ui.command_group.isVisible()
+    ui._toggle_command_section()
+    ui.close()
+
+    reopened = FeedbackUI(project, "测试按需构建", dark_theme=True)
+    assert reopened.command_group is not None and not reopened.command_group.isHidden()
+    reopened.close()
+    print("✅ 命令区域在第一次显示时构建，显示状态按项目保存")
+
+
+def test_auto_execute_builds_hidden_section():
+    """自动执行命令时构建命令区域但保持折叠，输出照常记录"""
+    project = tempfile.mkdtemp()
+    store = get_feedback_store()
+    store.set_many(get_project_settings_group(project), {
+        "run_command": f'"{sys.executable}" -c "print(\'lazy-output\')"',
+        "execute_automatically": True,
+    })
+    ui = FeedbackUI(project, "测试自动执行", dark_theme=True)
+    assert ui.command_group is not None and ui.command_group.isHidden()
+    run_until(lambda: ui.process is None)
+    run_until(lambda: "lazy-output" in ui.log_text.toPlainText())
+    assert "lazy-output" in ui.log_buffer.text()
+    ui.close()
+    print("✅ 自动执行时命令区域保持折叠，输出被记录")
+
+
+def test_project_switch_updates_built_section():
+    """复用窗口切换项目时，已构建的命令区域显示新项目的配置"""
+    first, second = tempfile.mkdtemp(), tempfile.mkdtemp()
+    get_feedback_store().set_many(get_project_settings_group(second), {"run_command": "make check", "use_pty": True})
+    ui = FeedbackUI(first, "测试切换项目", dark_theme=True)
+    ui._ensure_command_section()
+    ui.begin_session(second, "另一个项目")
+    assert ui.command_entry.text() == "make check" and ui.pty_check.isChecked()
+    assert second in ui.working_dir_label.text()
+    ui.close()
+    print("✅ 切换项目时已构建的命令区域随之更新")
+
+
+def test_paste_while_collapsed():
+    """命令区域折叠且未构建时粘贴图片：提示显示在状态栏，不进入命令日志；
+    此时追加的控制台文本留在 log_buffer 中，构建命令区域时补到控制台"""
+    ui = FeedbackUI(tempfile.mkdtemp(), "测试折叠时粘贴", dark_theme=True)
+    ui.show()
+    image = QImage(32, 32, QImage.Format_RGB32)
+    image.fill(QColor("red"))
+    QApplication.clipboard().setImage(image)
+    ui._paste_image()
+    assert ui.image_model.wait_for_pending(5000)
+    run_until(lambda: ui.image_model.rowCount() == 1)
+    assert ui.statusBar().currentMessage().startswith("已从剪贴板添加图片")
+    ui._save_config()
+    assert ui.statusBar().currentMessage() == "已保存此项目的配置。"
+    assert ui.log_buffer.text() == "" and ui._command_logs() == ""
+
+    ui._append_log("排队的输出\n")
+    ui._flush_log()  # 未构建时直接返回，不访问控制台
+    assert ui.command_group is None and "排队的输出" in ui.log_buffer.text()
+    ui._ensure_command_section()
+    assert "排队的输出" in ui.log_text.toPlainText()
+    assert ui._command_logs() == ""  # 本轮没有运行过命令
+    ui.close()
+    print("✅ 界面提示显示在状态栏，折叠时追加的输出在构建后显示")
+
+
+FIRST_PAINT = """
+import os, sys, time, json, tempfile
+sys.path.insert(0, {root!r})
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QObject, QEvent
+app = QApplication([])
+from feedback_ui import FeedbackUI
+
+class Eager(FeedbackUI):
+    # 旧的行为：构建窗口时一并构建命令区域和底部信息
+    def _create_ui(self):
+        super()._create_ui()
+        self._ensure_command_section()
+        self._create_footer()
+
+class PaintProbe(QObject):
+    painted = None
+    def eventFilter(self, watched, event):
+        if event.type() == QEvent.Paint and self.painted is None:
+            self.painted = time.perf_counter()
+        return False
+
+start = time.perf_counter()
+ui = (Eager if {eager!r} else FeedbackUI)(tempfile.mkdtemp(), "工作汇报 " * 50, True)
+probe = PaintProbe()
+ui.installEventFilter(probe)
+ui.show()
+while probe.painted is None:
+    app.processEvents()
+print(json.dumps({{"first_paint": probe.painted - start}}))
+"""
+
+
+def first_paint(eager: bool) -> float:
+    root = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-c", FIRST_PAINT.format(root=root, eager=eager)],
+                            capture_output=True, text=True, check=True,
+                            env=dict(os.environ, QT_QPA_PLATFORM="offscreen")).stdout
+    return json.loads(output.strip().splitlines()[-1])["first_paint"]
+
+
+def test_first_paint_benchmark():
+    """新进程中从构建窗口到第一次绘制的耗时（不含导入和 QApplication）"""
+    runs = {"lazy": [], "eager": []}
+    for _ in range(7):
+        runs["lazy"].append(first_paint(False))
+        runs["eager"].append(first_paint(True))
+    medians = {name: sorted(values)[len(values) // 2] for name, values in runs.items()}
+    print(f"📊 首次绘制：按需构建 {medians['lazy'] * 1000:.1f} ms，一次性构建 {medians['eager'] * 1000:.1f} ms"
+          f"（减少 {(1 - medians['lazy'] / medians['eager']) * 100:.0f}%）")
+    assert medians["lazy"] < medians["eager"]
+    print("✅ 按需构建缩短了首次绘制时间")
+
+
+if __name__ == "__main__":
+    test_command_section_built_on_demand()
+    test_auto_execute_builds_hidden_section()
+    test_project_switch_updates_built_section()
+    test_paste_while_collapsed()
+    test_first_paint_benchmark()
@@ -5,7 +5,6 @@
 
 import sys
 import os
-import json
 from pathlib import Path
 
 # 添加当前目录到 Python 路径
@@ -70,11 +69,9 @@ def test_mcp_content():
         print("✅ 反馈收集完成")
         print("\n📊 返回数据分析：")
         
-        # 解析 interactive_feedback
-        feedback_data = json.loads(result['interactive_feedback'])
-        print(f"💬 文字反馈: {feedback_data.get('text_feedback', '无')}")
+        print(f"💬 文字反馈: {result['text_feedback'] or '无'}")
         
-        images = feedback_data.get('images', [])
+        images = result['images']
         if images:
             print(f"🖼️  图片数量: {len(images)}")
             for i, image_path in enumerate(images):
@@ -98,7 +95,7 @@ def test_mcp_content():
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
         # 处理文字反馈
-        text_feedback = feedback_data.get('text_feedback', '').strip()
+        text_feedback = result['text_feedback'].strip()
         if text_feedback:
             text_content = {
                 "type": "text",
@@ -62,7 +62,7 @@ def test_scroll_functionality():
     
     if result:
         print("✅ 测试完成")
-        print(f"📄 反馈内容: {result['interactive_feedback']}")
+        print(f"📄 反馈内容: {result['text_feedback']}")
     else:
         print("❌ 测试被取消")
 
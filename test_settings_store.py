@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+测试 SQLite 设置存储：批量读取、写后台合并提交、多进程并发写入不丢失，
+并与 QSettings 对比启动时读取设置的 I/O 量
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+import subprocess
+
+# 添加当前目录到 Python 路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import feedback_store
+from feedback_store import WINDOW_SCOPE, FeedbackStore, setting_value
+
+PROJECTS = 300
+
+
+def committed(path: str, scope: str, key: str):
+    """用另一个连接读取已提交到数据库的值"""
+    with sqlite3.connect(path) as conn:
+        row = conn.execute("SELECT value FROM settings WHERE scope = ? AND key = ?", (scope, key)).fetchone()
+    return row and row[0]
+
+
+def test_write_behind():
+    """修改立即可读，稍后在一个事务中提交；类型按默认值转换"""
+    path = os.path.join(tempfile.mkdtemp(), "feedback.db")
+    store = FeedbackStore(path)
+    for i in range(100):
+        store.set("project_a", "run_command", f"make -j{i}")
+    store.set_many("project_a", {"use_pty": True, "command_niceness": 5, "splitterState": bytearray(b"\x00\xff")})
+
+    values = store.load(["project_a", WINDOW_SCOPE])
+    assert values["project_a"]["run_command"] == "make -j99" and values[WINDOW_SCOPE] == {}
+    assert committed(path, "project_a", "run_command") is None  # 尚未写入磁盘
+
+    time.sleep(feedback_store.WRITE_BEHIND_DELAY * 3)
+    assert committed(path, "project_a", "run_command") == "make -j99"
+    values = FeedbackStore(path).load(["project_a"])["project_a"]
+    assert setting_value(values, "use_pty", False) is True
+    assert setting_value(values, "command_niceness", 10) == 5
+    assert setting_value(values, "splitterState", b"") == b"\x00\xff"
+    assert setting_value({"execute_automatically": "false"}, "execute_automatically", True) is False
+
+    store.remove_scope("project_a")
+    store.close()
+    assert committed(path, "project_a", "run_command") is None
+    print("✅ 写入合并后台提交，读取包含未提交的修改")
+
+
+def test_without_fts5():
+    """SQLite 没有 FTS5 模块时只停用反馈归档，设置和命令历史照常读写"""
+    path = os.path.join(tempfile.mkdtemp(), "feedback.db")
+    ddl = feedback_store._ARCHIVE_DDL
+    feedback_store._ARCHIVE_DDL = ddl.replace("USING fts5", "USING missing_fts5")
+    try:
+        store = FeedbackStore(path)
+    finally:
+        feedback_store._ARCHIVE_DDL = ddl
+    assert not store._archive_enabled
+    store.set("project_a", "run_command", "make test")
+    store.record_command("/p", "make test", 0, 1.0)
+    store.record_feedback("/p", "汇报", "不会归档", "", [], None, time.time(), 1.0)
+    assert store.search_feedback("归档") == []
+    store.close()
+    assert committed(path, "project_a", "run_command") == "make test"
+
+    # 支持 FTS5 后重新打开时补建归档表
+    store = FeedbackStore(path)
+    assert store.get("project_a", "run_command") == "make test"
+    assert [entry["command"] for entry in store.load_command_history()] == ["make test"]
+    assert store._archive_enabled
+    store.close()
+    print("✅ 没有 FTS5 时设置照常保存，只停用归档")
+
+
+WRITER = """
+import sys
+sys.path.insert(0, {root!r})
+from feedback_store import FeedbackStore
+store = FeedbackStore({path!r})
+for i in range(200):
+    store.set("project_{index}", f"key_{{i}}", i)
+    store.set("shared", "key_{index}_" + str(i % 10), i)
+    if i % 50 == 0:
+        store.flush()
+store.close()
+"""
+
+
+def test_concurrent_sessions():
+    """多个界面进程同时写入同一个数据库，各自的修改都被保存"""
+    path = os.path.join(tempfile.mkdtemp(), "feedback.db")
+    FeedbackStore(path).close()
+    root = os.path.dirname(os.path.abspath(__file__))
+    writers = [
+        subprocess.Popen([sys.executable, "-c", WRITER.format(root=root, path=path, index=index)], stderr=subprocess.PIPE)
+        for index in range(6)
+    ]
+    for writer in writers:
+        _, stderr = writer.communicate(timeout=60)
+        assert writer.returncode == 0 and not stderr, stderr
+
+    store = FeedbackStore(path)
+    scopes = store.load([f"project_{index}" for index in range(6)] + ["shared"])
+    for index in range(6):
+        assert scopes[f"project_{index}"] == {f"key_{i}": i for i in range(200)}
+        for j in range(10):
+            assert scopes["shared"][f"key_{index}_{j}"] == 190 + j
+    store.close()
+    print("✅ 6 个进程并发写入，没有修改丢失")
+
+
+MEASURE = """
+import os, sys, time, json, psutil
+sys.path.insert(0, {root!r})
+project = "project_{project:03d}"
+from feedback_store import FeedbackStore, WINDOW_SCOPE
+from PySide6.QtCore import QSettings
+counters = psutil.Process().io_counters()
+start = time.perf_counter()
+if {use_store!r}:
+    values = FeedbackStore({path!r}).load([WINDOW_SCOPE, project])
+    count = sum(len(v) for v in values.values())
+else:
+    settings = QSettings({path!r}, QSettings.IniFormat)
+    count = 0
+    for group in ("MainWindow_General", project):
+        settings.beginGroup(group)
+        count += sum(settings.value(key) is not None for key in settings.childKeys())
+        settings.endGroup()
+elapsed = time.perf_counter() - start
+after = psutil.Process().io_counters()
+read = getattr(after, "read_chars", after.read_bytes) - getattr(counters, "read_chars", counters.read_bytes)
+print(json.dumps({{"count": count, "read": read, "time": elapsed}}))
+"""
+
+
+def measure(path: str, use_store: bool) -> dict:
+    root = os.path.dirname(os.path.abspath(__file__))
+    code = MEASURE.format(root=root, path=path, use_store=use_store, project=PROJECTS // 2)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, QT_QPA_PLATFORM="offscreen")).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_startup_io_benchmark():
+    """启动时只读取窗口和当前项目的设置，读取量与项目总数无关"""
+    from PySide6.QtCore import QSettings, QByteArray
+
+    tmp = tempfile.mkdtemp()
+    ini_path = os.path.join(tmp, "InteractiveFeedbackMCP.conf")
+    db_path = os.path.join(tmp, "feedback.db")
+    settings = QSettings(ini_path, QSettings.IniFormat)
+    store = FeedbackStore(db_path)
+
+    window = {"geometry": os.urandom(66), "windowState": os.urandom(42), "stayOnTop": False}
+    for name, value in window.items():
+        settings.setValue(f"{WINDOW_SCOPE}/{name}", QByteArray(value) if isinstance(value, bytes) else value)
+    store.set_many(WINDOW_SCOPE, window)
+    for index in range(PROJECTS):
+        project = {
+            "run_command": f"npm run build --workspace=packages/app-{index}",
+            "execute_automatically": False, "persistent_shell": True, "use_pty": False,
+            "command_niceness": 10, "command_io_priority": "low",
+            "command_memory_limit_mb": 0, "command_max_wall_time": 0,
+            "commandSectionVisible": True, "splitterState": os.urandom(31),
+        }
+        for name, value in project.items():
+            settings.setValue(f"project_{index:03d}/{name}",
+                              QByteArray(value) if isinstance(value, bytes) else value)
+        store.set_many(f"project_{index:03d}", project)
+    settings.sync()
+    store.close()
+
+    results = {name: [measure(path, name == "sqlite") for _ in range(5)]
+               for name, path in (("qsettings", ini_path), ("sqlite", db_path))}
+    summary = {name: (min(r["read"] for r in runs), sorted(r["time"] for r in runs)[2], runs[0]["count"])
+               for name, runs in results.items()}
+    for name, (read, elapsed, count) in summary.items():
+        print(f"📊 {name:9s}: {PROJECTS} 个项目中读取 {count} 个设置，读取 {read / 1024:.1f} KB，用时 {elapsed * 1000:.2f} ms")
+    assert summary["sqlite"][2] == summary["qsettings"][2] == 13
+    assert summary["sqlite"][0] < summary["qsettings"][0]
+    print("✅ SQLite 存储启动时的读取量低于 QSettings")
+
+
+if __name__ == "__main__":
+    test_write_behind()
+    test_without_fts5()
+    test_concurrent_sessions()
+    test_startup_io_benchmark()
@@ -60,7 +60,7 @@ def test_splitter():
     
     if result:
         print("✅ 分割器测试完成")
-        feedback_data = result['interactive_feedback']
+        feedback_data = result['text_feedback']
         print(f"📄 用户反馈: {feedback_data}")
     else:
         print("❌ 测试被取消")
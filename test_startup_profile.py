@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+测试启动预算：导入 feedback_ui 时不加载 psutil、asyncio、Windows API 等只在运行命令或服务器端用到的模块；
+--startup-profile 打印各阶段耗时并对照预算；服务器预编译宿主模块并以导入方式启动宿主，
+比直接运行脚本（每次重新编译）更快
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import importlib.util
+
+# 添加当前目录到 Python 路径
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+os.environ["INTERACTIVE_FEEDBACK_HOME"] = tempfile.mkdtemp()
+
+from server import HOST_BOOTSTRAP, HOST_MODULES, FeedbackHost, precompile_host_modules
+
+PHASES = ["imports", "QApplication", "UI build", "first paint"]
+
+
+def run(args: list[str]) -> str:
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True,
+                          cwd=tempfile.gettempdir()).stdout
+
+
+def test_deferred_imports():
+    """psutil、asyncio、uuid、Windows API、pty 等只在运行命令、Windows 或服务器端用到的模块在导入 feedback_ui 时都不加载"""
+    deferred = ('psutil', 'asyncio', 'uuid', 'ctypes.wintypes', 'pty', 'resource')
+    output = run(["-c", f"import sys, json; sys.path.insert(0, {ROOT!r}); import feedback_ui; "
+                        f"print(json.dumps({{name: name in sys.modules for name in {deferred!r}}}))"])
+    loaded = json.loads(output.strip().splitlines()[-1])
+    assert not any(loaded.values()), loaded
+    print("✅ 只在运行命令或服务器端使用的模块延迟导入")
+
+
+def test_startup_profile():
+    """--startup-profile 依次打印四个阶段和总耗时，并对照预算给出结论（耗时取决于机器，不作断言）"""
+    output = run([os.path.join(ROOT, "feedback_ui.py"), "--startup-profile",
+                  "--project-directory", tempfile.mkdtemp()])
+    print(output.rstrip())
+    rows = [line.split() for line in output.splitlines() if line.startswith("  ")]
+    names = [" ".join(row[:-2]) for row in rows[:-1]]
+    assert names == PHASES, names
+    assert all(float(row[-2]) >= 0 for row in rows[:-1])
+    total = float(rows[-1][1])
+    assert abs(total - sum(float(row[-2]) for row in rows[:-1])) < 0.5
+    assert re.search(r"（预算 \d+ ms，(在预算内|超出预算)）", output), output
+    print("✅ 启动各阶段耗时与预算一同报告")
+
+
+def launch_time(args: list[str], runs: int = 9) -> float:
+    """新进程解析完命令行参数（--help）所用的时间，取中位数"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run(args + ["--help"])
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def test_precompiled_launch():
+    """预编译后以导入方式启动，比直接运行脚本（__main__ 每次重新编译）更快"""
+    package_dir = tempfile.mkdtemp()
+    for name in HOST_MODULES:
+        shutil.copy(os.path.join(ROOT, name + ".py"), package_dir)
+    precompile_host_modules(package_dir)
+    for name in HOST_MODULES:
+        assert os.path.exists(importlib.util.cache_from_source(os.path.join(package_dir, name + ".py"))), name
+
+    script = launch_time([os.path.join(package_dir, "feedback_ui.py")])
+    module = launch_time(["-c", HOST_BOOTSTRAP, package_dir])
+    print(f"📊 启动到解析完参数：运行脚本 {script * 1000:.1f} ms，导入预编译模块 {module * 1000:.1f} ms")
+    assert module < script
+    print("✅ 宿主使用预编译的字节码启动")
+
+
+def test_host_round_trip():
+    """服务器以导入方式启动宿主，一轮请求取消后收到空反馈，关闭后宿主正常退出"""
+    async def scenario():
+        host = FeedbackHost(ROOT, theme="dark")
+        await host.start()
+        task = asyncio.create_task(host.request(tempfile.mkdtemp(), "测试宿主启动", "dark", timeout=30))
+        while not host._pending:
+            await asyncio.sleep(0.01)
+        host.cancel(next(iter(host._pending)))
+        result = await task
+        process = host._process
+        await host.stop()
+        return result, process.returncode
+
+    result, returncode = asyncio.run(scenario())
+    assert result["text_feedback"] == "" and result["images"] == []
+    assert returncode == 0, returncode
+    print("✅ 宿主以导入方式启动并完成一轮请求")
+
+
+if __name__ == "__main__":
+    test_deferred_imports()
+    test_startup_profile()
+    test_precompiled_launch()
+    test_host_round_trip()